@@ -1,32 +1,210 @@
 """
 Predicting Movie Revenue --
 Script to kick off web scraping and movie preprocessing tasks
-Used to create pickled dataframes for exploratory analysis and modeling
-This script is designed to be run through a jupyter notebook or the command line
+Used to create parquet dataframes for exploratory analysis and modeling
+This script is designed to be run through a jupyter notebook or the command line, e.g. python . merge --only
+Subcommands import the modules they need when they run, so --help and cached stages start without loading them
 """
 
-from movies_web_scraping import imdb_scraper, thenumbers_scraper, imdbstarmeter_scraper
-from movies_preprocessing import clean_imdb, clean_thenumbers, clean_stars, merge_data, engineer_features, agg_stars_genre  
+import sys
+import json
+import argparse
+
+from movies_stages import STAGES, run_stage
+from movies_metrics import METRICS_PATH, Recorder, recording, stage
+
+# subcommand: stages it builds, in order
+COMMANDS = {
+    'scrape': ['scrape_imdb', 'scrape_thenumbers', 'scrape_stars'],
+    'clean': ['clean_imdb', 'clean_thenumbers', 'clean_stars'],
+    'merge': ['match_titles', 'merge'],
+    'features': ['features', 'feature_state'],
+    'aggregate': ['aggregate'],
+}
+
+# stages the model and lookup tables of the prediction service are built from
+TRAIN_STAGES = ['clean_stars', 'feature_state', 'aggregate']
 
 #====================================================================
 ### Execute web scraping and preprocessing
 #====================================================================
 
-def main():
+def main(invalidate=(), incremental=False, metrics_path=METRICS_PATH, profile=(), stages=('aggregate',), only=False):
     """
-    Kick off web scraping and preprocessing tasks, returns pickled dataframes for eda and modeling 
+    Kick off web scraping and preprocessing tasks, returns the output of the last of stages (by default the
+    parquet dataframes for eda and modeling)
+    Stage outputs are cached in data/stages, stages listed in invalidate (e.g. 'scrape_imdb') are recomputed
+    and upstream stages are rebuilt when stale, unless only is set: then exactly the given stages are rerun
+    on the existing upstream artifacts
+    With incremental, only releases from the last run's high-water marks on are scraped and merged in first
+    Stage, request and parse metrics are written as json lines to metrics_path and summarized at the end,
+    stages listed in profile are rerun under cProfile
     """
-    # web scrape data
-    imdb_scraper()
-    thenumbers_scraper()
-    imdbstarmeter_scraper()
-
     # set recursion limit
     # sys.setrecursionlimit(10000)
 
-    # preprocess the web scraped data
-    agg_stars_genre()
- 
+    recorder = Recorder(metrics_path, profile)
+    with recording(recorder):
+        # fetch only new releases into the cached scrape stages
+        if incremental:
+            from movies_incremental import incremental_scrape
+            with stage('incremental_scrape'):
+                incremental_scrape()
+
+        # web scrape and preprocess the data, reusing any stage whose inputs and code are unchanged
+        for name in stages:
+            output = run_stage(name, set(invalidate) | set(profile), only)
+
+    recorder.report()
+    return output
+
+#====================================================================
+### Training, predictions and benchmarks
+#====================================================================
+
+def train(invalidate=(), incremental=False, metrics_path=METRICS_PATH, profile=(), only=False):
+    """
+    Builds the aggregate, feature_state and clean_stars stages (reusing cached ones as main does), fits the final
+    random forest through the model registry and writes the model and lookup tables read by predict
+    """
+    from movies_stages import StageCache
+    from movies_predict import MODEL_PATH, LOOKUP_PATH, train_model, build_lookup_tables
+    from movies_registry import ModelRegistry
+
+    _, movies_genre_df = main(invalidate, incremental, metrics_path, profile, TRAIN_STAGES, only)
+    cache = StageCache()
+    train_model(movies_genre_df, registry=ModelRegistry())
+    build_lookup_tables(cache.load('feature_state'), cache.load('clean_stars'))
+    print('Wrote {} and {}'.format(MODEL_PATH, LOOKUP_PATH))
+
+def chunked(metrics_path=METRICS_PATH, profile=(), chunk_pages=None):
+    """
+    Runs the out-of-core pipeline for scrapes too large for memory: pages are scraped chunk_pages at a time into
+    year partitions under data/partitions, then cleaned, merged, engineered and aggregated one year at a time
+    The aggregated data is written per release year, to be read back with movies_artifacts.read_partitions
+    """
+    from movies_chunked import CHUNK_PAGES, run_chunked
+
+    recorder = Recorder(metrics_path, profile)
+    with recording(recorder):
+        with stage('chunked'):
+            run_chunked(chunk_pages=chunk_pages or CHUNK_PAGES)
+    recorder.report()
+
+def predict(movies_path, model_path=None, lookup_path=None, host=None, port=8000):
+    """
+    Scores the movie dict (or list of movie dicts) in the json file at movies_path ('-' for stdin) and prints the
+    predicted domestic gross as json, or serves predictions over HTTP if a host is given
+    Model and lookup tables are read from the prediction service's default paths unless given
+    """
+    from movies_predict import MODEL_PATH, LOOKUP_PATH, MoviePredictor, serve
+
+    predictor = MoviePredictor(model_path or MODEL_PATH, lookup_path or LOOKUP_PATH)
+    if host is not None:
+        serve(predictor, host, port)
+        return
+
+    with (sys.stdin if movies_path == '-' else open(movies_path)) as f:
+        movies = json.load(f)
+    if isinstance(movies, dict):
+        print(json.dumps({'domestic_gross': predictor.predict(movies)}))
+    else:
+        print(json.dumps({'domestic_gross': predictor.predict_batch(movies).tolist()}))
+
+def bench(sizes, pipelines, seed=0, path=None):
+    """
+    Runs the pipeline benchmark suite on synthetic data, appending it to the csv at path (data/benchmarks.csv
+    unless given), and prints one row per stage
+    """
+    from movies_benchmark import BENCHMARK_PATH, run_suite
+
+    results = run_suite(sizes, pipelines, seed, path or BENCHMARK_PATH)
+    print(results[['size', 'pipeline', 'stage', 'rows_in', 'rows_out', 'seconds', 'peak_mb']].to_string(index=False))
+
+#====================================================================
+### Command line
+#====================================================================
+
+def parse_args(argv=None):
+    """
+    Takes in command line arguments (sys.argv by default), returns them parsed, the subcommand under 'command'
+    """
+    parser = argparse.ArgumentParser(description='Scrape, preprocess and score movie data')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    # stage subcommands share the stage cache, metrics and profiling options
+    stage_options = argparse.ArgumentParser(add_help=False)
+    stage_options.add_argument('--only', action='store_true',
+                               help='rerun exactly these stages on the existing upstream artifacts')
+    stage_options.add_argument('--invalidate', action='append', default=[], choices=list(STAGES), metavar='STAGE',
+                               help='force a stage to rerun (repeatable), one of: ' + ', '.join(STAGES))
+    stage_options.add_argument('--incremental', action='store_true',
+                               help='only scrape releases from the high-water marks of the last run on')
+    stage_options.add_argument('--metrics', default=METRICS_PATH, metavar='PATH',
+                               help='json lines file the run metrics are appended to (default: %(default)s)')
+    stage_options.add_argument('--profile', action='append', default=[], choices=list(STAGES), metavar='STAGE',
+                               help='rerun a stage under cProfile and dump its stats to data/profiles (repeatable)')
+    for command, stages in COMMANDS.items():
+        commands.add_parser(command, parents=[stage_options],
+                            help='build the {} stage{}'.format(', '.join(stages), 's' if len(stages) > 1 else ''))
+    aggregate_parser = commands.choices['aggregate']
+    aggregate_parser.add_argument('--chunked', action='store_true',
+                                  help='scrape and process in chunks over release-year partitions under '
+                                       'data/partitions, for scrapes too large for memory')
+    aggregate_parser.add_argument('--chunk-pages', type=int, metavar='N',
+                                  help='pages scraped per chunk with --chunked (default: 20)')
+
+    commands.add_parser('train', parents=[stage_options],
+                        help='build the {} stages and train the model and lookup tables for predict'.format(
+                            ', '.join(TRAIN_STAGES)))
+
+    predict_parser = commands.add_parser('predict', help='score movies with the trained model (see train)')
+    predict_parser.add_argument('movies', nargs='?', default='-',
+                                help='json file of a movie dict or a list of them (default: stdin)')
+    predict_parser.add_argument('--model', metavar='PATH', help='pickled model (default: data/model.pkl, written by train)')
+    predict_parser.add_argument('--lookup', metavar='PATH', help='lookup tables (default: data/lookup_tables.pkl)')
+    predict_parser.add_argument('--serve', metavar='HOST', help='serve predictions over HTTP on this host instead')
+    predict_parser.add_argument('--port', type=int, default=8000)
+
+    bench_parser = commands.add_parser('bench', help='benchmark every pipeline stage on synthetic data')
+    bench_parser.add_argument('--size', action='append', dest='sizes', metavar='SIZE',
+                              help='3k, 30k, 300k or a number of movies (repeatable, default: 3k)')
+    bench_parser.add_argument('--pipeline', action='append', dest='pipelines', choices=['wide', 'normalized'],
+                              help='pipeline to benchmark (repeatable, default: both)')
+    bench_parser.add_argument('--seed', type=int, default=0)
+    bench_parser.add_argument('--output', metavar='PATH',
+                              help='csv the stage rows are appended to (default: data/benchmarks.csv)')
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # no subcommand builds everything, as before subcommands existed
+        args = parser.parse_args(['aggregate'])
+    return args
+
 if __name__ == '__main__':
     # execute only if run as the entry point into the program
-    main() 
\ No newline at end of file
+    args = parse_args()
+    if args.command == 'bench':
+        sizes = [int(size) if size.isdigit() else size for size in args.sizes or ['3k']]
+        bench(sizes, args.pipelines or ['wide', 'normalized'], args.seed, args.output)
+    elif args.command == 'predict':
+        try:
+            predict(args.movies, args.model, args.lookup, args.serve, args.port)
+        except FileNotFoundError as error:
+            # the default model and lookup tables are written by the train subcommand
+            sys.exit('error: {} (run python . train first)'.format(error))
+        except (ValueError, KeyError, TypeError) as error:
+            sys.exit('error: invalid movie: {}'.format(error))
+    elif args.command == 'aggregate' and args.chunked:
+        chunked(args.metrics, args.profile, args.chunk_pages)
+    elif args.command == 'train':
+        try:
+            train(args.invalidate, args.incremental, args.metrics, args.profile, args.only)
+        except FileNotFoundError as error:
+            sys.exit('error: {}'.format(error))
+    else:
+        try:
+            main(args.invalidate, args.incremental, args.metrics, args.profile, COMMANDS[args.command], args.only)
+        except FileNotFoundError as error:
+            # e.g. --only on a stage whose upstream stages were never built
+            sys.exit('error: {}'.format(error))
@@ -0,0 +1,163 @@
+"""
+Predicting Movie Revenue --
+Columnar artifact store for the eda and modeling dataframes
+Tables are written as Parquet with compact dtypes and read back with column projection and row filters
+"""
+
+import os
+import time
+import shutil
+
+import pandas as pd
+
+DATA_DIR = 'data'
+PARTITION_DIR = 'data/partitions'
+
+CATEGORICAL_COLS = ['certificate', 'month', 'genre', 'director']
+INT32_COLS = ['runtime', 'year', 'genre_count', 'title_length', 'votes', 'star_appearances']
+
+#====================================================================
+### Writing artifacts
+#====================================================================
+
+def compact_dtypes(df):
+    """
+    Takes in a dataframe, returns a copy with categorical labels and 32-bit counts
+    Float and money columns are left untouched so values round-trip exactly
+    """
+    df = df.copy()
+    for col in CATEGORICAL_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col in INT32_COLS:
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = df[col].astype('int32')
+    return df
+
+def artifact_path(name, directory=DATA_DIR):
+    return os.path.join(directory, name + '.parquet')
+
+def write_artifact(df, name, directory=DATA_DIR, row_group_size=1024):
+    """
+    Takes in a dataframe and an artifact name, writes it as a compressed Parquet file and returns the path
+    Row order and index are preserved, so train/test splits on the loaded frame are unchanged
+    """
+    path = artifact_path(name, directory)
+    compact_dtypes(df).to_parquet(path, engine='pyarrow', compression='zstd', row_group_size=row_group_size)
+    return path
+
+#====================================================================
+### Reading artifacts
+#====================================================================
+
+def read_artifact(name, columns=None, years=None, release_dates=None, directory=DATA_DIR):
+    """
+    Takes in an artifact name, returns the dataframe restricted to the given columns
+    years and release_dates are optional (start, end) inclusive ranges pushed down to the Parquet reader
+    """
+    filters = []
+    if years is not None:
+        filters += [('year', '>=', years[0]), ('year', '<=', years[1])]
+    if release_dates is not None:
+        filters += [('release_date', '>=', pd.Timestamp(release_dates[0])),
+                    ('release_date', '<=', pd.Timestamp(release_dates[1]))]
+
+    return pd.read_parquet(artifact_path(name, directory), engine='pyarrow', columns=columns,
+                           filters=filters or None)
+
+def convert_pickles(names=('movies_df', 'movies_genre_df', 'movies_df_no_outliers', 'movies_genre_df_no_outliers'),
+                    directory=DATA_DIR):
+    """
+    Takes in the names of pickled dataframes in data/, writes each one as a Parquet artifact
+    """
+    for name in names:
+        write_artifact(pd.read_pickle(os.path.join(directory, name + '.pkl')), name, directory)
+
+#====================================================================
+### Partitioned artifacts
+#====================================================================
+
+def partition_dir(name, key, value, directory=PARTITION_DIR):
+    return os.path.join(directory, name, '{}={}'.format(key, value))
+
+def partition_values(name, key, directory=PARTITION_DIR):
+    """
+    Takes in a partitioned artifact name and its partition key, returns the (integer) key values it has
+    partitions for, in ascending order
+    """
+    path, prefix = os.path.join(directory, name), key + '='
+    if not os.path.isdir(path):
+        return []
+    return sorted(int(entry[len(prefix):]) for entry in os.listdir(path) if entry.startswith(prefix))
+
+def clear_partitions(name, directory=PARTITION_DIR):
+    """
+    Takes in a partitioned artifact name, deletes all of its partitions
+    """
+    shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+def write_partition(df, name, key, value, part=0, directory=PARTITION_DIR, compact=True):
+    """
+    Takes in a dataframe and a partitioned artifact name, key and value, writes the dataframe as part file number part
+    of that partition (a directory of Parquet files) and returns the path
+    Intermediate tables are written with compact False, keeping their exact dtypes
+    """
+    path = partition_dir(name, key, value, directory)
+    os.makedirs(path, exist_ok=True)
+    part_name = 'part-{:05d}'.format(part)
+    if compact:
+        return write_artifact(df, part_name, path)
+    df.to_parquet(artifact_path(part_name, path), engine='pyarrow', compression='zstd')
+    return artifact_path(part_name, path)
+
+def read_partitions(name, key, values=None, columns=None, directory=PARTITION_DIR):
+    """
+    Takes in a partitioned artifact name and its partition key, returns the dataframe of the partitions whose key
+    values fall in values, an optional (start, end) inclusive range, restricted to the given columns
+    Only the selected partitions' files are read, in key value and part order
+    """
+    frames = []
+    for value in partition_values(name, key, directory):
+        if values is None or values[0] <= value <= values[1]:
+            path = partition_dir(name, key, value, directory)
+            frames += [pd.read_parquet(os.path.join(path, part), engine='pyarrow', columns=columns)
+                       for part in sorted(os.listdir(path))]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+
+    # partitions have their own categories, the combined frame gets the union of them
+    categorical = [col for col in frames[0].columns if isinstance(frames[0][col].dtype, pd.CategoricalDtype)]
+    return pd.concat(frames, ignore_index=True).astype({col: 'category' for col in categorical})
+
+#====================================================================
+### Benchmark against the pickles
+#====================================================================
+
+def benchmark_artifacts(names=('movies_df_no_outliers', 'movies_genre_df_no_outliers'),
+                        columns=('production_budget', 'director_power', 'star_power', 'star_appearances',
+                                 'star_points', 'domestic_gross'),
+                        repeat=5, directory=DATA_DIR):
+    """
+    Takes in artifact names, returns a dataframe comparing file size and best-of-repeat load time
+    of the pickle, the full Parquet artifact and a projected Parquet read of the given columns
+    """
+    def best_time(load):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            load()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    results = []
+    for name in names:
+        pickle_path = os.path.join(directory, name + '.pkl')
+        parquet_path = artifact_path(name, directory)
+        results.append({'artifact': name,
+                        'pickle_mb': os.path.getsize(pickle_path) / 1e6,
+                        'parquet_mb': os.path.getsize(parquet_path) / 1e6,
+                        'pickle_load_s': best_time(lambda: pd.read_pickle(pickle_path)),
+                        'parquet_load_s': best_time(lambda: read_artifact(name, directory=directory)),
+                        'parquet_projected_s': best_time(lambda: read_artifact(name, list(columns), directory=directory))})
+
+    return pd.DataFrame(results)
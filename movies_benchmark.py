@@ -0,0 +1,164 @@
+"""
+Predicting Movie Revenue --
+Benchmark suite for the scraping and preprocessing pipeline
+Runs every stage on synthetic data of a given size (parsing saved pages, cleaning, merging, feature engineering
+and aggregation), times it and traces its peak memory, and appends the numbers to a csv to track them over time
+"""
+
+import os
+import time
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from movies_synthetic import SIZES, money, synthetic_scrape, write_pages
+from movies_parsing import ColumnBuffer, iter_imdb_records, iter_thenumbers_records, iter_imdbstarmeter_records
+from movies_web_scraping import IMDB_COLUMNS, THENUMBERS_COLUMNS, STARMETER_COLUMNS
+from movies_preprocessing import clean_imdb, clean_thenumbers, clean_stars, merge_data, engineer_features, agg_stars_genre, \
+    parse_money
+from movies_matching import align_thenumbers
+from movies_tables import normalize_imdb, merge_tables, engineer_table_features, agg_tables
+from movies_metrics import count_rows, max_rss_mb
+
+BENCHMARK_PATH = 'data/benchmarks.csv'
+
+# pipeline: (clean imdb, merge, engineer features, aggregate) stage functions
+PIPELINES = {
+    'wide': (clean_imdb, merge_data, engineer_features, agg_stars_genre),
+    'normalized': (normalize_imdb, merge_tables, engineer_table_features, agg_tables),
+}
+
+#====================================================================
+### Measuring a stage
+#====================================================================
+
+def parse_files(paths, parse_page, columns):
+    """
+    Takes in saved page paths, a streaming page parser and the record columns, returns the parsed dataframe
+    """
+    buffer = ColumnBuffer(columns)
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            buffer.extend(parse_page(f.read()))
+    return buffer.to_frame()
+
+def measure(func, inputs, trace=True, **kwargs):
+    """
+    Takes in a stage function and its inputs, returns its output, wall time in seconds and peak traced memory in MB
+    The stage is timed untraced, then run a second time under tracemalloc if trace is set
+    """
+    start = time.perf_counter()
+    output = func(*inputs, **kwargs)
+    seconds = time.perf_counter() - start
+
+    peak_mb = None
+    if trace:
+        tracemalloc.start()
+        func(*inputs, **kwargs)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    return output, seconds, peak_mb
+
+def revision():
+    # current git commit, so results can be tied to the code they measured
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+#====================================================================
+### Benchmark suite
+#====================================================================
+
+def run_benchmark(size='3k', seed=0, pipeline='wide', pages=True, trace=True, path=BENCHMARK_PATH):
+    """
+    Takes in a benchmark size (a key of SIZES or a number of movies) and the pipeline to run ('wide' or 'normalized'),
+    runs every stage on synthetic data, appends one row per stage to the csv at path (unless None)
+    and returns them as a dataframe
+    Saved pages are generated and parsed first unless pages is False
+    """
+    n_movies = SIZES.get(size, size)
+    clean_imdb_stage, merge_stage, features_stage, aggregate_stage = PIPELINES[pipeline]
+    imdb_data, thenumbers_data, star_data = synthetic_scrape(n_movies, seed)
+
+    results = []
+    run = {'run': datetime.now().isoformat(timespec='seconds'), 'revision': revision(), 'size': size,
+           'n_movies': n_movies, 'pipeline': pipeline}
+
+    def stage(name, func, inputs, **kwargs):
+        output, seconds, peak_mb = measure(func, inputs, trace, **kwargs)
+        results.append(dict(run, stage=name, rows_in=count_rows(inputs), rows_out=count_rows(output),
+                            seconds=seconds, peak_mb=peak_mb))
+        print('{}: {:.2f} s'.format(name, seconds))
+        return output
+
+    with tempfile.TemporaryDirectory() as directory:
+        if pages:
+            paths = write_pages(directory, imdb_data, thenumbers_data, star_data)
+            imdb_data = stage('parse_imdb', parse_files, (paths['imdb'],),
+                              parse_page=iter_imdb_records, columns=IMDB_COLUMNS)
+            thenumbers_data = stage('parse_thenumbers', parse_files, (paths['thenumbers'],),
+                                    parse_page=iter_thenumbers_records, columns=THENUMBERS_COLUMNS)
+            star_data = stage('parse_stars', parse_files, (paths['imdbstarmeter'],),
+                              parse_page=iter_imdbstarmeter_records, columns=STARMETER_COLUMNS)
+
+        imdb_clean = stage(clean_imdb_stage.__name__, clean_imdb_stage, (imdb_data,))
+        thenumbers_clean = stage('clean_thenumbers', clean_thenumbers, (thenumbers_data,))
+        stars_clean = stage('clean_stars', clean_stars, (star_data,))
+        thenumbers_clean = stage('match_titles', align_thenumbers, (imdb_clean, thenumbers_clean))
+        merged = stage(merge_stage.__name__, merge_stage, (imdb_clean, thenumbers_clean, stars_clean))
+        features = stage(features_stage.__name__, features_stage, (merged,))
+        stage(aggregate_stage.__name__, aggregate_stage, (features,), directory=directory)
+
+    # whole run: total time and the process's peak resident memory
+    results.append(dict(run, stage='total', rows_in=n_movies, rows_out=results[-1]['rows_out'],
+                        seconds=sum(result['seconds'] for result in results),
+                        peak_mb=max_rss_mb()))
+    results = pd.DataFrame(results)
+
+    if path is not None:
+        results.to_csv(path, mode='a', index=False, header=not os.path.exists(path))
+
+    return results
+
+def run_suite(sizes=('3k', '30k', '300k'), pipelines=('wide', 'normalized'), seed=0, path=BENCHMARK_PATH):
+    """
+    Takes in benchmark sizes and pipelines, runs the benchmark for each combination and returns all stage rows
+    """
+    return pd.concat([run_benchmark(size, seed, pipeline, path=path) for size in sizes for pipeline in pipelines],
+                     ignore_index=True)
+
+#====================================================================
+### Money parsing benchmark
+#====================================================================
+
+def chained_replace(values):
+    # the-numbers amounts as clean_thenumbers used to convert them, raising on any sentinel
+    return values.str.replace(',', '').str.replace('$', '').astype(int)
+
+def benchmark_money_parsing(n_rows=1000000, seed=0, missing=0.01):
+    """
+    Takes in a number of rows and the share of 'no domestic gross' sentinels among them, times the chained
+    string replaces against parse_money on a synthetic money column stored as object and as pyarrow strings,
+    returns the timings as a dataframe
+    The chained replaces are timed on the column without sentinels, since they cannot parse them
+    """
+    rng = np.random.default_rng(seed)
+    amounts = money(rng.integers(0, 3000000000, n_rows))
+    with_sentinels = np.where(rng.random(n_rows) < missing, 'no domestic gross', amounts).tolist()
+
+    results = []
+    for dtype in ['object', 'str']:
+        for method, func, values in [('chained_replace', chained_replace, amounts),
+                                     ('parse_money', parse_money, with_sentinels)]:
+            _, seconds, _ = measure(func, (pd.Series(values, dtype=dtype),), trace=False)
+            results.append({'method': method, 'dtype': dtype, 'rows': n_rows, 'seconds': seconds,
+                            'rows_per_second': n_rows / seconds})
+
+    return pd.DataFrame(results)
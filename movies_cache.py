@@ -0,0 +1,243 @@
+"""
+Predicting Movie Revenue --
+On-disk response cache for the scraper pages
+Bodies are stored compressed and content-addressed, with a per-url index holding the validators used for revalidation
+"""
+
+import os
+import json
+import time
+import zlib
+import hashlib
+import threading
+from urllib.parse import urlsplit
+
+CACHE_DIR = 'data/cache'
+
+# ttl per source, keyed by url prefix (host and path, the longest matching prefix applies):
+# imdb search pages of historical releases rarely change, budgets and star rankings are refreshed more often
+TTLS = {'www.imdb.com/search/keyword': 7 * 24 * 3600,
+        'www.imdb.com/search/name': 24 * 3600,
+        'www.the-numbers.com': 24 * 3600}
+DEFAULT_TTL = 24 * 3600
+MAX_BYTES = 512 * 1024 * 1024
+
+# a full cache is evicted down to this fraction of max_bytes, so it is not rescanned on every store
+LOW_WATER = 0.9
+
+# access times of cache hits are written back to the index in batches of this many urls
+FLUSH_EVERY = 100
+
+#====================================================================
+### Cached response
+#====================================================================
+
+class CachedResponse:
+    """
+    Minimal stand-in for a requests response served from the cache
+    """
+    from_cache = True
+
+    def __init__(self, url, content, headers, encoding, status_code=200):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+#====================================================================
+### Response cache
+#====================================================================
+
+class ResponseCache:
+    """
+    Caches response bodies on disk keyed by url, with a ttl per source (url prefix) and size-bounded least-recently-used eviction
+    The size of the stored bodies is kept as a running total, so the index is only scanned when it exceeds max_bytes;
+    access times are held in memory and written back in batches (call flush, or close the fetcher, when done)
+    """
+    def __init__(self, directory=CACHE_DIR, ttls=None, default_ttl=DEFAULT_TTL, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.ttls = TTLS if ttls is None else ttls
+        self.prefixes = sorted(self.ttls, key=len, reverse=True)
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # bytes of the stored bodies (counted on the first store) and url: entry of hits not written back yet
+        self.total = None
+        self.accessed = {}
+        os.makedirs(os.path.join(directory, 'index'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+
+    def index_path(self, url):
+        return os.path.join(self.directory, 'index', hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest + '.z')
+
+    def write(self, path, data):
+        # write to a temporary file first so readers never see a partial file
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def entry(self, url):
+        """
+        Takes in a url, returns its index entry or None if the url is not cached
+        """
+        try:
+            with open(self.index_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self.object_path(entry['digest'])):
+            return None
+        return entry
+
+    def ttl(self, url):
+        parts = urlsplit(url)
+        location = parts.netloc + parts.path
+        for prefix in self.prefixes:
+            if location.startswith(prefix):
+                return self.ttls[prefix]
+        return self.default_ttl
+
+    def is_fresh(self, url, entry):
+        return time.time() - entry['fetched_at'] < self.ttl(url)
+
+    def cached_response(self, url, entry):
+        with open(self.object_path(entry['digest']), 'rb') as f:
+            content = zlib.decompress(f.read())
+        return CachedResponse(url, content, entry['headers'], entry['encoding'])
+
+    def response(self, url, entry):
+        """
+        Takes in a url and its index entry, returns the cached body as a response and marks it as recently used
+        """
+        response = self.cached_response(url, entry)
+        entry['accessed_at'] = time.time()
+        with self.lock:
+            self.accessed[url] = entry
+            flush = len(self.accessed) >= FLUSH_EVERY
+        if flush:
+            self.flush()
+        return response
+
+    def flush(self):
+        """
+        Writes the access times of the urls served from the cache since the last flush to their index entries
+        """
+        with self.lock:
+            for url, entry in self.accessed.items():
+                self.write(self.index_path(url), json.dumps(entry).encode())
+            self.accessed = {}
+
+    def validators(self, entry):
+        """
+        Takes in an index entry, returns the headers for a conditional request
+        """
+        headers = {}
+        if entry['headers'].get('ETag'):
+            headers['If-None-Match'] = entry['headers']['ETag']
+        if entry['headers'].get('Last-Modified'):
+            headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+        return headers
+
+    def store(self, url, response):
+        """
+        Takes in a url and a 200 response, stores the compressed body and its validators
+        """
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.object_path(digest)
+        compressed = None if os.path.exists(path) else zlib.compress(content, 6)
+
+        now = time.time()
+        headers = {name: response.headers[name] for name in ('ETag', 'Last-Modified', 'Content-Type')
+                   if name in response.headers}
+        entry = {'url': url,
+                 'digest': digest,
+                 'headers': headers,
+                 'encoding': response.encoding,
+                 'fetched_at': now,
+                 'accessed_at': now}
+
+        # the body and its index entry are written under the lock, so eviction never sees one without the other
+        with self.lock:
+            if self.total is None:
+                self.total = self.stored_bytes()
+            if not os.path.exists(path):
+                compressed = zlib.compress(content, 6) if compressed is None else compressed
+                self.write(path, compressed)
+                self.total += len(compressed)
+            entry['size'] = os.path.getsize(path)
+            self.write(self.index_path(url), json.dumps(entry).encode())
+            self.accessed.pop(url, None)
+            full = self.total > self.max_bytes
+        if full:
+            self.evict()
+
+    def revalidated(self, url, entry):
+        """
+        Takes in a url and its index entry after a 304 response, restarts its ttl and returns the cached response
+        """
+        entry['fetched_at'] = entry['accessed_at'] = time.time()
+        with self.lock:
+            self.write(self.index_path(url), json.dumps(entry).encode())
+            self.accessed.pop(url, None)
+        return self.cached_response(url, entry)
+
+    def stored_bytes(self):
+        # bytes of every body in the objects directory
+        with os.scandir(os.path.join(self.directory, 'objects')) as files:
+            return sum(f.stat().st_size for f in files if f.name.endswith('.z'))
+
+    def entries(self):
+        index_dir = os.path.join(self.directory, 'index')
+        for name in os.listdir(index_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(index_dir, name)
+            try:
+                with open(path) as f:
+                    yield path, json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def evict(self):
+        """
+        Drops least recently used urls until the stored bodies fit in LOW_WATER of max_bytes,
+        then removes the bodies no url refers to
+        """
+        # eviction goes by the latest access times
+        self.flush()
+        with self.lock:
+            entries = sorted(self.entries(), key=lambda item: item[1]['accessed_at'])
+            sizes = {entry['digest']: entry['size'] for _, entry in entries}
+            total = sum(sizes.values())
+
+            referenced = {}
+            for _, entry in entries:
+                referenced[entry['digest']] = referenced.get(entry['digest'], 0) + 1
+
+            for path, entry in entries:
+                if total <= LOW_WATER * self.max_bytes:
+                    break
+                os.remove(path)
+                referenced[entry['digest']] -= 1
+                if referenced[entry['digest']] == 0:
+                    total -= sizes[entry['digest']]
+
+            # bodies of evicted urls and of urls since stored with a different body
+            objects_dir = os.path.join(self.directory, 'objects')
+            for name in os.listdir(objects_dir):
+                if name.endswith('.z') and referenced.get(name[:-2], 0) == 0:
+                    try:
+                        os.remove(os.path.join(objects_dir, name))
+                    except OSError:
+                        pass
+            self.total = total
@@ -0,0 +1,95 @@
+"""
+Predicting Movie Revenue --
+Per-page checkpoints for the web scrapers
+The records parsed from each page are appended to a json lines log as soon as the page is done,
+so a scrape interrupted by a network failure or crash resumes from the pages already parsed
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from movies_parsing import ColumnBuffer
+
+CHECKPOINT_DIR = 'data/checkpoints'
+
+# a log older than this is from an abandoned scrape whose pages may have changed since, and is started over
+MAX_AGE = 24 * 3600
+
+class PageCheckpoint:
+    """
+    Append-only json lines log of the records parsed from each page of one scrape, one line per page
+    The log is keyed by the scrape's source name and page urls, so a different page list starts a new log;
+    a line cut short by a crash is truncated away when the log is reopened
+    """
+    def __init__(self, source, urls, directory=CHECKPOINT_DIR, max_age=MAX_AGE):
+        self.urls = list(urls)
+        digest = hashlib.sha256('\n'.join(self.urls).encode()).hexdigest()[:16]
+        self.path = os.path.join(directory, '{}_{}.jsonl'.format(source, digest))
+        os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(self.path) and time.time() - os.path.getmtime(self.path) > max_age:
+            os.remove(self.path)
+        self.pages = self.read()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def read(self):
+        """
+        Returns the records logged per page url, truncating the log after its last complete line
+        """
+        pages = {}
+        if not os.path.exists(self.path):
+            return pages
+
+        valid = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                pages[entry['url']] = entry['records']
+                valid += len(line)
+
+        if valid < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid)
+        return pages
+
+    def pending(self):
+        """
+        Returns the page urls not logged yet, in order
+        """
+        return [url for url in self.urls if url not in self.pages]
+
+    def append(self, url, records):
+        """
+        Takes in a page url and the records parsed from it, appends them to the log and syncs it to disk
+        """
+        records = [list(record) for record in records]
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'url': url, 'records': records}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.pages[url] = records
+
+    def to_frame(self, columns):
+        """
+        Takes in the record columns, returns a dataframe of the logged records in page order
+        """
+        buffer = ColumnBuffer(columns)
+        for url in self.urls:
+            buffer.extend(self.pages.get(url, ()))
+        return buffer.to_frame()
+
+    def remove(self):
+        """
+        Deletes the log once its scrape has completed
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
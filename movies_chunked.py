@@ -0,0 +1,203 @@
+"""
+Predicting Movie Revenue --
+Out-of-core chunked pipeline for catalog-scale scrapes
+Pages are scraped a chunk at a time and partitioned by year on disk, cleaning, title matching and merging then run one imdb year at a time
+and feature engineering and aggregation one release year at a time in chronological order, with star and director
+history carried across partitions; each release year's movies_df and movies_genre_df are written as separate files
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from movies_web_scraping import CHUNK_PAGES, imdb_scrape_chunks, thenumbers_scrape_chunks
+from movies_artifacts import PARTITION_DIR, partition_dir, partition_values, clear_partitions, write_partition, \
+    read_partitions
+from movies_preprocessing import clean_thenumbers
+from movies_matching import KEYS, align_thenumbers
+from movies_tables import MovieTables, normalize_imdb, merge_tables, engineer_table_features, aggregate_tables, \
+    categorize, rekey
+from movies_history import FeatureState
+from movies_stages import run_stage
+
+# merged movie table and its bridge tables, as in MovieTables
+TABLES = ['movies', 'genres', 'stars']
+
+#====================================================================
+### Partitioning the scrape
+#====================================================================
+
+def imdb_years(imdb_data):
+    # year as clean_imdb_records reads it, e.g. '(2015)' or '(I) (2015)'
+    return imdb_data['year'].str[-5:-1].astype(int)
+
+def thenumbers_years(thenumbers_data):
+    # year of a full release date, e.g. 'Dec 18, 2015'
+    return thenumbers_data['release_date'].str[-4:].astype(int)
+
+def scrape_chunks(data):
+    # a single scraped dataframe is one chunk
+    return [data] if isinstance(data, pd.DataFrame) else data
+
+def partition_scrape(imdb_chunks, thenumbers_chunks, directory=PARTITION_DIR):
+    """
+    Takes in scraped imdb and the numbers data, each as a dataframe or an iterable of dataframe chunks with the
+    scrapers' columns, writes every chunk's rows as a part file of their year's partition and returns the imdb
+    and the numbers years
+    Scraped columns mix numbers, lists and placeholder strings, which Parquet cannot store, so parts are pickled
+    """
+    for source, chunks, years_of in (('scrape_imdb', imdb_chunks, imdb_years),
+                                     ('scrape_thenumbers', thenumbers_chunks, thenumbers_years)):
+        clear_partitions(source, directory)
+        for part, chunk in enumerate(scrape_chunks(chunks)):
+            # e.g. a chunk of pages past the last result
+            if not len(chunk):
+                continue
+            # the numbers rows without a full release date are dropped by clean_thenumbers anyway
+            if source == 'scrape_thenumbers':
+                chunk = chunk[chunk.release_date.str.len() >= 11]
+            for year, rows in chunk.groupby(years_of(chunk).to_numpy()):
+                path = partition_dir(source, 'year', year, directory)
+                os.makedirs(path, exist_ok=True)
+                rows.to_pickle(os.path.join(path, 'part-{:05d}.pkl'.format(part)))
+
+    return partition_values('scrape_imdb', 'year', directory), partition_values('scrape_thenumbers', 'year', directory)
+
+def read_scrape(source, year, directory=PARTITION_DIR):
+    """
+    Takes in a scrape source ('imdb' or 'thenumbers') and a year, returns the scraped rows of that year's partition
+    """
+    path = partition_dir('scrape_' + source, 'year', year, directory)
+    return pd.concat([pd.read_pickle(os.path.join(path, part)) for part in sorted(os.listdir(path))],
+                     ignore_index=True)
+
+#====================================================================
+### Cleaning, matching and merging per imdb year
+#====================================================================
+
+def merge_partitions(star_data=None, fuzzy=True, threshold=0.75, directory=PARTITION_DIR):
+    """
+    Takes in cleaned stars data (the clean_stars stage artifact if not given), cleans, title matches and merges the
+    scrape partitions one imdb year at a time, writes the merged movie tables split by release year and returns
+    the number of merged movies
+    Only the imdb movies of the year and the next and the numbers rows of the year before to the year after are
+    in memory; a the numbers row matched to an earlier year's movie is not offered again, so matches are one-to-one
+    in chronological order rather than by best score over all years as align_thenumbers does on the full data
+    """
+    star_data = run_stage('clean_stars') if star_data is None else star_data
+    for table in TABLES:
+        clear_partitions('merged_' + table, directory)
+
+    years = partition_values('scrape_imdb', 'year', directory)
+    thenumbers_partitions = set(partition_values('scrape_thenumbers', 'year', directory))
+    tables, loaded = {}, set()
+    thenumbers_data = None
+    n_rows = n_movies = 0
+
+    for year in years:
+        # normalized imdb movies of this year and the next, whose exact matches are not offered to this year
+        for imdb_year in (year, year + 1):
+            if imdb_year not in tables and imdb_year in years:
+                tables[imdb_year] = normalize_imdb(read_scrape('imdb', imdb_year, directory))
+        tables.pop(year - 1, None)
+
+        # cleaned the numbers rows of the year before to the year after, numbered across partitions
+        for thenumbers_year in (year - 1, year, year + 1):
+            if thenumbers_year not in loaded and thenumbers_year in thenumbers_partitions:
+                rows = clean_thenumbers(read_scrape('thenumbers', thenumbers_year, directory)).reset_index(drop=True)
+                rows.index = pd.RangeIndex(n_rows, n_rows + len(rows), name='row_id')
+                rows = rows.assign(partition=thenumbers_year, claimed=False)
+                thenumbers_data = rows if thenumbers_data is None else pd.concat([thenumbers_data, rows])
+                loaded.add(thenumbers_year)
+                n_rows += len(rows)
+        if thenumbers_data is None:
+            continue
+        thenumbers_data = thenumbers_data[thenumbers_data['partition'] >= year - 1]
+
+        movie_tables = tables[year]
+        if not len(movie_tables) or not len(thenumbers_data):
+            continue
+
+        # match the rows not claimed yet, then claim the ones joining this year's movies under their new title
+        offered = ~thenumbers_data['claimed']
+        if year + 1 in tables:
+            next_keys = pd.MultiIndex.from_frame(tables[year + 1].movies[KEYS])
+            offered &= ~pd.MultiIndex.from_frame(thenumbers_data[KEYS]).isin(next_keys)
+        aligned = align_thenumbers(movie_tables, thenumbers_data[offered].reset_index(), fuzzy, threshold)
+        keys = pd.MultiIndex.from_frame(movie_tables.movies[KEYS])
+        aligned = aligned[pd.MultiIndex.from_frame(aligned[KEYS]).isin(keys)]
+        row_ids = aligned['row_id'].to_numpy()
+        thenumbers_data.loc[row_ids, 'movie'] = aligned['movie'].to_numpy()
+        thenumbers_data.loc[row_ids, 'year'] = aligned['year'].to_numpy()
+        thenumbers_data.loc[row_ids, 'claimed'] = True
+
+        # merge, number the movies across partitions and write each table split by release year
+        merged = merge_tables(movie_tables, aligned.drop(columns=['row_id', 'partition', 'claimed']), star_data)
+        frames = {table: getattr(merged, table) for table in TABLES}
+        frames = {table: frame.assign(movie_id=frame['movie_id'].astype(np.int64) + n_movies)
+                  for table, frame in frames.items()}
+        release_years = frames['movies']['release_date'].dt.year.to_numpy()
+        for release_year, movie_ids in frames['movies']['movie_id'].groupby(release_years):
+            for table, frame in frames.items():
+                write_partition(frame[frame['movie_id'].isin(movie_ids)], 'merged_' + table, 'release_year',
+                                release_year, part=year, directory=directory, compact=False)
+        n_movies += len(merged)
+
+    return n_movies
+
+#====================================================================
+### Features and aggregation per release year
+#====================================================================
+
+def read_merged(release_year, directory=PARTITION_DIR):
+    """
+    Takes in a release year, returns its merged movie tables, renumbered so movie_id is the row position
+    """
+    frames = {table: read_partitions('merged_' + table, 'release_year', (release_year, release_year),
+                                     directory=directory) for table in TABLES}
+    record_ids = frames['movies']['movie_id'].to_numpy()
+    movies = frames['movies'].assign(movie_id=np.arange(len(record_ids), dtype=np.int32))
+    return MovieTables(categorize(movies), categorize(rekey(frames['genres'], record_ids)),
+                       categorize(rekey(frames['stars'], record_ids)))
+
+def engineer_partitions(state=None, directory=PARTITION_DIR):
+    """
+    Takes in a feature state with the history of movies released before the merged partitions (empty if not given),
+    engineers features and aggregates the merged movie tables one release year at a time in chronological order,
+    writes each year's movies_df and movies_genre_df partitions and returns the state with the full history
+    """
+    state = FeatureState() if state is None else state
+    for name in ('movies_df', 'movies_genre_df'):
+        clear_partitions(name, directory)
+
+    for release_year in partition_values('merged_movies', 'release_year', directory):
+        movies_df, movies_genre_df = aggregate_tables(engineer_table_features(read_merged(release_year, directory),
+                                                                              state))
+        write_partition(movies_df, 'movies_df', 'release_year', release_year, directory=directory)
+        write_partition(movies_genre_df, 'movies_genre_df', 'release_year', release_year, directory=directory)
+
+    return state
+
+#====================================================================
+### Chunked pipeline
+#====================================================================
+
+def run_chunked(imdb_chunks=None, thenumbers_chunks=None, star_data=None, fuzzy=True, state=None,
+                directory=PARTITION_DIR, chunk_pages=CHUNK_PAGES, fetcher=None):
+    """
+    Takes in scraped imdb and the numbers data as dataframes or iterables of chunks (scraped chunk_pages pages at
+    a time if not given, so the full scrape is never in memory) and cleaned stars data (the clean_stars stage
+    artifact if not given), runs the chunked pipeline from partitioning to aggregation under directory and returns
+    the feature state with the full star and director history
+    The aggregated data is read back per release year with read_partitions, e.g.
+    read_partitions('movies_df', 'release_year', (2010, 2019))
+    """
+    if imdb_chunks is None:
+        imdb_chunks = imdb_scrape_chunks(fetcher, chunk_pages=chunk_pages)
+    if thenumbers_chunks is None:
+        thenumbers_chunks = thenumbers_scrape_chunks(fetcher, chunk_pages=chunk_pages)
+
+    partition_scrape(imdb_chunks, thenumbers_chunks, directory)
+    merge_partitions(star_data, fuzzy, directory=directory)
+    return engineer_partitions(state, directory)
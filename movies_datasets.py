@@ -0,0 +1,120 @@
+"""
+Predicting Movie Revenue --
+Named feature sets for the notebooks, the experiment runner and the model scripts
+Each set is read with column projection from the Parquet artifacts on first access, the one-hot encoded matrix
+is built once and cached on disk next to a fingerprint of its source, so later kernels and scripts load it directly
+"""
+
+import os
+import sys
+import json
+import hashlib
+import inspect
+
+from movies_artifacts import DATA_DIR, read_artifact, write_artifact
+from movies_features import TARGET, BASELINE_FEATURES, EXPANDED_FEATURES, NUMERIC_FEATURES, COMPLETE_FEATURES, \
+    encode_movies, encode_movies_sparse
+
+DATASET_DIR = 'data/datasets'
+
+# feature set: (dataframe it is taken from, feature columns), as in the modeling notebook
+FEATURE_SETS = {
+    'baseline': ('movies_df', BASELINE_FEATURES),
+    'expanded': ('movies_df', EXPANDED_FEATURES),
+    'numeric': ('movies_df', NUMERIC_FEATURES),
+    'complete': ('movies_matrix', COMPLETE_FEATURES),
+}
+
+# columns of the per-genre data that encode_movies needs
+MATRIX_SOURCE_COLS = ['runtime', 'year', 'domestic_gross', 'production_budget', 'genre_count', 'director',
+                      'title_length', 'director_power', 'star_power', 'star_points', 'star_appearances',
+                      'certificate', 'month', 'genre']
+
+class DatasetStore:
+    """
+    Lazily built feature sets over the movies artifacts (the no-outlier ones unless outliers is set)
+    Frames are kept in memory once loaded; the encoded matrix is also cached as a Parquet artifact under cache_dir
+    and rebuilt only when its source artifact or the encoding code changes
+    """
+    def __init__(self, directory=DATA_DIR, cache_dir=DATASET_DIR, outliers=False):
+        self.directory = directory
+        self.cache_dir = cache_dir
+        suffix = '' if outliers else '_no_outliers'
+        self.sources = {'movies_df': 'movies_df' + suffix, 'movies_matrix': 'movies_genre_df' + suffix}
+        self.frames = {}
+
+    def fingerprint(self, artifact):
+        """
+        Takes in a source artifact name, returns a hash of its file and of the encoding code
+        """
+        digest = hashlib.sha256(inspect.getsource(sys.modules[encode_movies.__module__]).encode())
+        with open(os.path.join(self.directory, artifact + '.parquet'), 'rb') as f:
+            digest.update(f.read())
+        return digest.hexdigest()
+
+    def movies_matrix(self):
+        """
+        Returns the one-hot encoded movies matrix (one row per movie), from the disk cache when it is current
+        """
+        artifact = self.sources['movies_matrix']
+        name = artifact + '_matrix'
+        meta_path = os.path.join(self.cache_dir, name + '.json')
+        fingerprint = self.fingerprint(artifact)
+
+        try:
+            with open(meta_path) as f:
+                cached = json.load(f)['fingerprint'] == fingerprint
+        except (OSError, ValueError, KeyError):
+            cached = False
+        if cached and os.path.exists(os.path.join(self.cache_dir, name + '.parquet')):
+            return read_artifact(name, directory=self.cache_dir)
+
+        movies_matrix = encode_movies(read_artifact(artifact, MATRIX_SOURCE_COLS, directory=self.directory))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_artifact(movies_matrix, name, self.cache_dir)
+        with open(meta_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'source': artifact}, f)
+        return read_artifact(name, directory=self.cache_dir)
+
+    def frame(self, name):
+        """
+        Takes in a feature set name, returns its feature columns and the target as a dataframe,
+        loading (and for the complete set encoding) it on first access
+        """
+        if name not in self.frames:
+            source, features = FEATURE_SETS[name]
+            if source == 'movies_matrix':
+                self.frames[name] = self.movies_matrix()[features + [TARGET]]
+            else:
+                self.frames[name] = read_artifact(self.sources[source], features + [TARGET], directory=self.directory)
+        return self.frames[name]
+
+    def sparse_X_y(self):
+        """
+        Returns the complete feature set as a scipy CSR matrix and the target array,
+        encoded straight from a projected read of the per-genre artifact on first access
+        """
+        if 'sparse' not in self.frames:
+            artifact = self.sources['movies_matrix']
+            self.frames['sparse'] = encode_movies_sparse(read_artifact(artifact, MATRIX_SOURCE_COLS,
+                                                                       directory=self.directory))
+        return self.frames['sparse']
+
+    def X_y(self, name):
+        """
+        Takes in a feature set name, returns its (X, y) float arrays
+        """
+        frame = self.frame(name)
+        return frame[FEATURE_SETS[name][1]].to_numpy(dtype=float), frame[TARGET].to_numpy(dtype=float)
+
+# shared by every caller in a process, so a kernel loads each set once
+_STORE = {}
+
+def load_feature_set(name, outliers=False):
+    """
+    Takes in a feature set name ('baseline', 'expanded', 'numeric' or 'complete'), returns its features and
+    target as a dataframe, built on first access and reused afterwards
+    """
+    if outliers not in _STORE:
+        _STORE[outliers] = DatasetStore(outliers=outliers)
+    return _STORE[outliers].frame(name)
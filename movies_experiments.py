@@ -0,0 +1,247 @@
+"""
+Predicting Movie Revenue --
+Cross-validation and hyperparameter grid for the modeling notebook's models
+Runs every model configuration on every feature set across a process pool, with the polynomial and scaling
+transforms fitted once per fold in each worker, and writes a results table of scores and wall time
+"""
+
+import json
+import time
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from movies_artifacts import read_artifact
+from movies_features import TARGET, encode_movies, encode_movies_sparse
+from movies_datasets import FEATURE_SETS, DatasetStore
+
+RESULTS_PATH = 'data/experiment_results.csv'
+
+# model: transform applied to the features before fitting
+MODEL_TRANSFORMS = {
+    'linear': 'none',
+    'poly_linear': 'poly2',
+    'lasso': 'poly2_scaled',
+    'ridge': 'poly2_scaled',
+    'random_forest': 'none',
+    'gbm': 'none',
+}
+
+# (model, parameters) configurations, around the values tried in the notebook
+MODEL_GRID = [('linear', {}), ('poly_linear', {})] \
+    + [('lasso', {'alpha': alpha}) for alpha in [1e-2, 1e-1, 1, 10, 100]] \
+    + [('ridge', {'alpha': alpha}) for alpha in [1e-3, 1e-2, 1e-1, 1, 10]] \
+    + [('random_forest', {'n_estimators': 300, 'max_features': max_features}) for max_features in [3, 6, 'sqrt']] \
+    + [('random_forest', {'n_estimators': 1800, 'max_features': 3}),
+       ('gbm', {'n_estimators': 1600, 'max_depth': 3, 'learning_rate': 0.01})]
+
+#====================================================================
+### Models and transforms
+#====================================================================
+
+def make_model(name, params):
+    """
+    Takes in a model name and its parameters, returns an unfitted scikit-learn estimator
+    """
+    from sklearn.linear_model import LinearRegression, Lasso, Ridge
+    from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+
+    models = {'linear': LinearRegression, 'poly_linear': LinearRegression, 'lasso': Lasso, 'ridge': Ridge,
+              'random_forest': RandomForestRegressor, 'gbm': GradientBoostingRegressor}
+    return models[name](**params)
+
+def make_transforms(name, sparse=False):
+    """
+    Takes in a transform name, returns the list of unfitted transformers applied in order
+    For sparse features the scaler only divides by the standard deviation, centering would make them dense
+    """
+    from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+    transforms = {'none': [],
+                  'poly2': [PolynomialFeatures(degree=2)],
+                  'poly2_scaled': [PolynomialFeatures(degree=2), StandardScaler(with_mean=not sparse)]}
+    return transforms[name]
+
+#====================================================================
+### Datasets
+#====================================================================
+
+def load_datasets(movies_df=None, movies_genre_df=None, feature_sets=FEATURE_SETS, test_size=0.2, random_state=1,
+                  sparse=False):
+    """
+    Takes in the movies data and movies data with one row per genre (the no-outlier feature sets of
+    movies_datasets if not given), returns the training split of every feature set as (X, y) arrays,
+    split as in the modeling notebook
+    With sparse, the complete feature set is a scipy CSR matrix built without dense dummies (same rows and split)
+    """
+    from sklearn.model_selection import train_test_split
+
+    # frames passed in are used as they are, other feature sets are loaded lazily from the dataset store
+    store = DatasetStore()
+    given = {'movies_df': movies_df,
+             'movies_matrix': encode_movies(movies_genre_df) if movies_genre_df is not None and not sparse else None}
+
+    datasets = {}
+    for name, (frame, features) in feature_sets.items():
+        if sparse and frame == 'movies_matrix':
+            X, y = encode_movies_sparse(movies_genre_df) if movies_genre_df is not None else store.sparse_X_y()
+        else:
+            data = given[frame] if given[frame] is not None else store.frame(name)
+            X = data[features].to_numpy(dtype=float)
+            y = data[TARGET].to_numpy(dtype=float)
+        X_train, _, y_train, _ = train_test_split(X, y, test_size=test_size, random_state=random_state)
+        datasets[name] = (X_train, y_train)
+
+    return datasets
+
+#====================================================================
+### Workers
+#====================================================================
+
+# per worker process: training data per feature set, number of folds and transformed folds per
+# (feature set, transform, fold)
+_WORKER = {'datasets': {}, 'n_folds': 5, 'folds': {}}
+
+def _init_worker(datasets, n_folds):
+    # scikit-learn is imported up front so the first configuration's wall time does not include it
+    import sklearn.ensemble, sklearn.linear_model, sklearn.model_selection, sklearn.preprocessing
+
+    _WORKER['datasets'] = datasets
+    _WORKER['n_folds'] = n_folds
+
+def fold_data(feature_set, transform, fold):
+    """
+    Takes in a feature set, a transform and a fold number, returns the transformed (X_train, y_train, X_val, y_val)
+    of that fold, fitting the transforms on the fold's training rows only once per worker
+    """
+    key = (feature_set, transform, fold)
+    folds = _WORKER['folds']
+    if key not in folds:
+        import scipy.sparse
+        from sklearn.model_selection import KFold
+
+        # unshuffled folds, as cross_val_score(cv=5) uses
+        X, y = _WORKER['datasets'][feature_set]
+        train, val = list(KFold(n_splits=_WORKER['n_folds']).split(X))[fold]
+        X_train, X_val = X[train], X[val]
+        for step in make_transforms(transform, sparse=scipy.sparse.issparse(X)):
+            X_train = step.fit_transform(X_train)
+            X_val = step.transform(X_val)
+        folds[key] = (X_train, y[train], X_val, y[val])
+
+    return folds[key]
+
+def run_configuration(feature_set, model, params):
+    """
+    Takes in a feature set, a model name and its parameters, returns the cross-validated scores and wall time
+    (which includes fitting the fold transforms when this worker has not fitted them yet)
+    """
+    start = time.perf_counter()
+    r2, rmse, mae = [], [], []
+    for fold in range(_WORKER['n_folds']):
+        X_train, y_train, X_val, y_val = fold_data(feature_set, MODEL_TRANSFORMS[model], fold)
+        estimator = make_model(model, params).fit(X_train, y_train)
+        residuals = y_val - estimator.predict(X_val)
+        r2.append(1 - (residuals ** 2).sum() / ((y_val - y_val.mean()) ** 2).sum())
+        rmse.append(np.sqrt((residuals ** 2).mean()))
+        mae.append(np.abs(residuals).mean())
+
+    return {'feature_set': feature_set, 'model': model, 'params': json.dumps(params),
+            'r2_mean': np.mean(r2), 'r2_std': np.std(r2), 'rmse_mean': np.mean(rmse), 'mae_mean': np.mean(mae),
+            'seconds': time.perf_counter() - start}
+
+#====================================================================
+### Experiment runner
+#====================================================================
+
+def run_experiments(grid=MODEL_GRID, feature_sets=None, n_folds=5, max_workers=None, path=RESULTS_PATH,
+                    movies_df=None, movies_genre_df=None, sparse=False):
+    """
+    Takes in a list of (model, parameters) configurations and feature set names (all if not given),
+    cross-validates every configuration on every feature set in a process pool,
+    writes and returns the results table sorted by feature set and mean r2
+    With sparse, the complete feature set is fed to the models as a CSR matrix
+    """
+    datasets = load_datasets(movies_df, movies_genre_df, sparse=sparse)
+    feature_sets = list(datasets) if feature_sets is None else list(feature_sets)
+    datasets = {name: datasets[name] for name in feature_sets}
+
+    # configurations sharing a feature set and transform are submitted together, so workers reuse fitted folds
+    tasks = sorted(((feature_set, model, params) for feature_set in feature_sets for model, params in grid),
+                   key=lambda task: (task[0], MODEL_TRANSFORMS[task[1]]))
+
+    start = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                             initializer=_init_worker, initargs=(datasets, n_folds)) as pool:
+        futures = [pool.submit(run_configuration, *task) for task in tasks]
+        results = pd.DataFrame([future.result() for future in futures])
+    print('Ran {} configurations in {:.1f} seconds'.format(len(results), time.perf_counter() - start))
+
+    results = results.sort_values(['feature_set', 'r2_mean'], ascending=[True, False]).reset_index(drop=True)
+    if path is not None:
+        results.to_csv(path, index=False)
+
+    return results
+
+#====================================================================
+### Sparse vs dense benchmark
+#====================================================================
+
+def matrix_mb(X):
+    # memory held by a dense array or a CSR matrix's data, indices and index pointers
+    if hasattr(X, 'indptr'):
+        return (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes) / 2 ** 20
+    return np.asarray(X).nbytes / 2 ** 20
+
+def benchmark_sparse(movies_genre_df=None, grid=(('linear', {}), ('lasso', {'alpha': 1}), ('ridge', {'alpha': 1})),
+                     repeat=3):
+    """
+    Takes in the movies data with one row per genre (the no-outlier artifact if not given) and (model, parameters)
+    configurations, returns a dataframe comparing the dense get_dummies path and the sparse CSR path on the
+    complete feature set: encoding time, design matrix size after each model's transforms,
+    best-of-repeat transform and fit time, peak traced memory of one transform and fit, and training r2
+    """
+    from movies_datasets import MATRIX_SOURCE_COLS
+    from movies_features import COMPLETE_FEATURES
+
+    if movies_genre_df is None:
+        movies_genre_df = read_artifact('movies_genre_df_no_outliers', MATRIX_SOURCE_COLS)
+
+    def encode_dense(df):
+        movies_matrix = encode_movies(df)
+        return movies_matrix[COMPLETE_FEATURES].to_numpy(dtype=float), movies_matrix[TARGET].to_numpy(dtype=float)
+
+    def fit(X, y, model, params, sparse):
+        for step in make_transforms(MODEL_TRANSFORMS[model], sparse):
+            X = step.fit_transform(X)
+        return X, make_model(model, params).fit(X, y)
+
+    results = []
+    for path, encode, sparse in [('dense', encode_dense, False), ('sparse', encode_movies_sparse, True)]:
+        start = time.perf_counter()
+        X, y = encode(movies_genre_df)
+        encode_seconds = time.perf_counter() - start
+
+        for model, params in grid:
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fit(X, y, model, params, sparse)
+                seconds.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            X_model, estimator = fit(X, y, model, params, sparse)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+            residuals = y - estimator.predict(X_model)
+            results.append({'path': path, 'model': model, 'params': json.dumps(params),
+                            'encode_seconds': encode_seconds, 'matrix_mb': matrix_mb(X_model),
+                            'fit_seconds': min(seconds), 'peak_mb': peak_mb,
+                            'train_r2': 1 - (residuals ** 2).sum() / ((y - y.mean()) ** 2).sum()})
+
+    return pd.DataFrame(results)
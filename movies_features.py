@@ -0,0 +1,149 @@
+"""
+Predicting Movie Revenue --
+Feature sets and one-hot encoding used by the modeling notebook
+Functions are shared by the prediction service and the modeling scripts
+"""
+
+import numpy as np
+import pandas as pd
+
+#====================================================================
+### Feature sets
+#====================================================================
+
+TARGET = 'domestic_gross'
+
+BASELINE_FEATURES = ['production_budget']
+
+EXPANDED_FEATURES = ['production_budget', 'director_power', 'star_power', 'star_appearances', 'star_points']
+
+NUMERIC_FEATURES = ['runtime', 'year', 'genre_count', 'title_length', 'production_budget',
+                    'director_power', 'star_power', 'star_points', 'star_appearances']
+
+# one-hot columns, 'certificate_G' and 'month_Apr' are dropped as the reference levels
+CERTIFICATES = ['NC-17', 'Not Rated', 'PG', 'PG-13', 'R']
+MONTHS = ['Sep', 'Jul', 'Oct', 'Aug', 'Dec', 'Feb', 'Jan', 'Jun', 'Mar', 'May', 'Nov']
+GENRES = ['Action', 'Adventure', 'Animation', 'Biography', 'Comedy', 'Crime', 'Documentary', 'Drama',
+          'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Musical', 'Mystery', 'News',
+          'Romance', 'Sci-Fi', 'Sport', 'Thriller', 'War', 'Western']
+
+CERTIFICATE_COLS = ['certificate_' + certificate for certificate in CERTIFICATES]
+MONTH_COLS = ['month_' + month for month in MONTHS]
+GENRE_COLS = ['genre_' + genre for genre in GENRES]
+
+COMPLETE_FEATURES = NUMERIC_FEATURES + CERTIFICATE_COLS + MONTH_COLS + GENRE_COLS
+
+# columns identifying a movie among its genre rows, and the columns movies count as duplicates on
+MOVIE_COLS = ['runtime', 'year', 'domestic_gross', 'production_budget', 'genre_count', 'director',
+              'title_length', 'director_power', 'star_power', 'star_points', 'star_appearances']
+DUPLICATE_COLS = ['production_budget', 'domestic_gross', 'title_length', 'director', 'year', 'runtime']
+
+#====================================================================
+### Encoding the movies data
+#====================================================================
+
+def encode_movies(movies_genre_df):
+    """
+    Takes in the movies data with one row per genre, returns one row per movie with genre, certificate
+    and month one-hot encoded, as built in the modeling notebook
+    """
+    # one-hot encode genre, certificate and month
+    movies_matrix = pd.get_dummies(movies_genre_df, prefix=['genre'], columns=['genre'])
+    movies_matrix = pd.get_dummies(movies_matrix, prefix=['certificate', 'month'], columns=['certificate', 'month'],
+                                   drop_first=True)
+
+    # make sure every vocabulary column exists, even if a level is absent from this data
+    for col in CERTIFICATE_COLS + MONTH_COLS + GENRE_COLS:
+        if col not in movies_matrix.columns:
+            movies_matrix[col] = 0
+
+    # aggregate the dataframe to one row per movie by summing the encoded genre features
+    groupby_cols = MOVIE_COLS + CERTIFICATE_COLS + MONTH_COLS
+    movies_matrix = movies_matrix.groupby(groupby_cols, as_index=False, observed=True)[GENRE_COLS].sum() \
+        .drop_duplicates(subset=DUPLICATE_COLS)
+
+    return movies_matrix[COMPLETE_FEATURES + [TARGET, 'director']]
+
+def dummy_rank(values, levels):
+    # sort position of each value's one-hot row among the levels' dummy columns: the reference level
+    # (all zeros) first, then the level whose column comes last
+    codes = pd.Categorical(values, categories=levels).codes
+    return np.where(codes >= 0, len(levels) - codes, 0)
+
+def encode_movies_sparse(movies_genre_df):
+    """
+    Takes in the movies data with one row per genre, returns (X, y): the complete feature matrix as a scipy
+    CSR matrix in COMPLETE_FEATURES order and the target, with the rows of encode_movies in the same order,
+    built straight from the movie/genre rows without dense dummy columns
+    """
+    from scipy import sparse
+
+    # one group per movie, numbered in the order encode_movies' groupby sorts its dummy columns
+    keys = movies_genre_df[MOVIE_COLS].assign(certificate=dummy_rank(movies_genre_df['certificate'], CERTIFICATES),
+                                              month=dummy_rank(movies_genre_df['month'], MONTHS))
+    groups = keys.groupby(list(keys.columns), observed=True).ngroup().to_numpy()
+    valid = groups >= 0
+    group_ids, first_rows = np.unique(groups[valid], return_index=True)
+    movies = movies_genre_df[valid].iloc[first_rows].reset_index(drop=True)
+
+    # duplicate movies are dropped, remaining groups are numbered by output row (-1 for dropped ones)
+    keep = ~movies.duplicated(subset=DUPLICATE_COLS).to_numpy()
+    movies = movies[keep].reset_index(drop=True)
+    rows_of_group = np.full(len(group_ids), -1)
+    rows_of_group[keep] = np.arange(keep.sum())
+    n_movies = len(movies)
+
+    # numeric features, then a single certificate and month entry per movie outside the reference levels
+    rows = [np.repeat(np.arange(n_movies), len(NUMERIC_FEATURES))]
+    cols = [np.tile(np.arange(len(NUMERIC_FEATURES)), n_movies)]
+    data = [movies[NUMERIC_FEATURES].to_numpy(dtype=float).ravel()]
+    offset = len(NUMERIC_FEATURES)
+    for column, levels in (('certificate', CERTIFICATES), ('month', MONTHS)):
+        codes = pd.Categorical(movies[column], categories=levels).codes
+        known = np.flatnonzero(codes >= 0)
+        rows.append(known)
+        cols.append(offset + codes[known])
+        data.append(np.ones(len(known)))
+        offset += len(levels)
+
+    # one genre entry per genre row, summed per movie when converted
+    genre_rows = rows_of_group[groups[valid]]
+    genre_codes = pd.Categorical(movies_genre_df['genre'][valid], categories=GENRES).codes
+    known = (genre_rows >= 0) & (genre_codes >= 0)
+    rows.append(genre_rows[known])
+    cols.append(offset + genre_codes[known])
+    data.append(np.ones(known.sum()))
+
+    X = sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(n_movies, len(COMPLETE_FEATURES)))
+    X.eliminate_zeros()
+    return X, movies[TARGET].to_numpy(dtype=float)
+
+#====================================================================
+### Encoding new movies
+#====================================================================
+
+def encode_inputs(inputs):
+    """
+    Takes in a dataframe of movies with the numeric features and certificate, month and genres (list) columns,
+    returns the complete feature matrix in COMPLETE_FEATURES order as a float array, built in one vectorized pass
+    """
+    X = np.zeros((len(inputs), len(COMPLETE_FEATURES)))
+    X[:, :len(NUMERIC_FEATURES)] = inputs[NUMERIC_FEATURES].to_numpy(dtype=float)
+
+    # certificate and month dummies: a single one per row, none for the reference levels
+    offset = len(NUMERIC_FEATURES)
+    for column, levels in (('certificate', CERTIFICATES), ('month', MONTHS)):
+        codes = pd.Categorical(inputs[column], categories=levels).codes
+        rows = np.flatnonzero(codes >= 0)
+        X[rows, offset + codes[rows]] = 1
+        offset += len(levels)
+
+    # genre dummies: one per listed genre
+    genres = inputs['genres'].explode()
+    codes = pd.Categorical(genres, categories=GENRES).codes
+    rows = np.arange(len(inputs)).repeat(inputs['genres'].str.len().fillna(0).astype(int).clip(lower=1))
+    known = codes >= 0
+    X[rows[known], offset + codes[known]] = 1
+
+    return X
@@ -0,0 +1,207 @@
+"""
+Predicting Movie Revenue --
+Shared fetch layer for the web scrapers
+Pages are fetched concurrently through a pooled HTTP session, rate limited per host and retried on failure,
+optionally through the on-disk response cache in movies_cache.py
+"""
+
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from warnings import warn
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+from movies_cache import ResponseCache, CachedResponse
+from movies_metrics import emit
+
+# defaults: a few pages in flight, about one request per second to any single host
+CONCURRENCY = 4
+RATE = 1.0
+BURST = 2
+RETRIES = 3
+BACKOFF = 2.0
+TIMEOUT = 30
+
+#====================================================================
+### Per-host token bucket
+#====================================================================
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `capacity`, acquire() blocks until a token is available
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+#====================================================================
+### Fetcher
+#====================================================================
+
+class Fetcher:
+    """
+    Fetches pages through one pooled session using a bounded thread pool,
+    with a token bucket rate limit per host and retry with exponential backoff on non-200 responses
+    With a cache, fresh pages are served from disk and stale ones are revalidated with a conditional request;
+    offline mode serves every cached page and never touches the network
+    """
+    def __init__(self, concurrency=CONCURRENCY, rate=RATE, burst=BURST, retries=RETRIES,
+                 backoff=BACKOFF, timeout=TIMEOUT, session=None, cache=None, offline=False):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+
+        # share one connection pool across the worker threads
+        if session is None:
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # write back the access times of pages served from the cache
+        if self.cache is not None:
+            self.cache.flush()
+        self.session.close()
+
+    def bucket(self, url):
+        """
+        Takes in a url, returns the token bucket for its host
+        """
+        host = urlsplit(url).netloc
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def request(self, url, headers=None):
+        """
+        Takes in a url, returns the raw response of a single rate-limited get request
+        """
+        wait_start = time.perf_counter()
+        self.bucket(url).acquire()
+        start = time.perf_counter()
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        emit('request', url=url, status=response.status_code, bytes=len(response.content),
+             seconds=time.perf_counter() - start, wait_seconds=start - wait_start)
+        return response
+
+    def get(self, url):
+        """
+        Takes in a url, returns the response from the cache when fresh, otherwise from the network
+        """
+        if self.cache is None:
+            return self.fetch(url)
+
+        entry = self.cache.entry(url)
+        if entry is not None and (self.offline or self.cache.is_fresh(url, entry)):
+            emit('cache_hit', url=url)
+            return self.cache.response(url, entry)
+        if self.offline:
+            warn('Request: {}; not in cache (offline)'.format(url))
+            return CachedResponse(url, b'', {}, None, status_code=504)
+
+        # revalidate a stale page, a 304 means the cached body is still current
+        headers = self.cache.validators(entry) if entry is not None else None
+        response = self.fetch(url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            return self.cache.revalidated(url, entry)
+        if response.status_code == 200:
+            self.cache.store(url, response)
+        return response
+
+    def fetch(self, url, headers=None):
+        """
+        Takes in a url, returns the network response, retrying non-200 responses and connection errors with backoff
+        """
+        response = None
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.request(url, headers=headers)
+            except RequestException as error:
+                if attempt == self.retries:
+                    raise
+                response = None
+                warn('Request: {}; Error: {}'.format(url, error))
+                emit('request_error', url=url, error=str(error))
+            else:
+                # 304 is a valid answer to a conditional request
+                if response.status_code in (200, 304):
+                    return response
+                if attempt == self.retries:
+                    break
+
+            # back off exponentially with jitter, honouring Retry-After if the server sent one
+            delay = self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            time.sleep(delay)
+
+        # throw a warning for non-200 status codes
+        warn('Request: {}; Status code: {}'.format(url, response.status_code))
+        return response
+
+    def fetch_all(self, urls):
+        """
+        Takes in a list of urls, returns their responses in the same order
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return list(pool.map(self.get, urls))
+
+    def iter_fetch(self, urls):
+        """
+        Takes in a list of urls, yields their responses in the same order as each one (and those before it) arrives
+        If a fetch raises, the pages after it that have not started are cancelled
+        """
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            yield from pool.map(self.get, urls)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+def iter_fetch(urls, fetcher=None):
+    """
+    Takes in a list of urls and an optional fetcher, yields their responses in order as they arrive
+    A default fetcher backed by the on-disk response cache is created (and closed) when none is given
+    """
+    if fetcher is not None:
+        yield from fetcher.iter_fetch(urls)
+        return
+    with Fetcher(cache=ResponseCache()) as fetcher:
+        yield from fetcher.iter_fetch(urls)
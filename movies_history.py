@@ -0,0 +1,166 @@
+"""
+Predicting Movie Revenue --
+Incremental star and director history
+Keeps a running sum and count of domestic gross per star and per director, so star power and director power
+of newly added movies are computed in O(batch) time instead of recomputing the whole history
+"""
+
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from movies_preprocessing import add_release_features
+from movies_tables import MovieTables
+
+STATE_PATH = 'data/feature_state.pkl'
+
+#====================================================================
+### Running history per entity
+#====================================================================
+
+class RunningHistory:
+    """
+    Running totals of previous releases per entity (star or director)
+    Totals are split into releases before the entity's last release date and releases on it, so a new movie
+    released on that same date still only sees strictly earlier releases
+    """
+    def __init__(self):
+        # name: [last release date, sum before it, count before it, sum on it, count on it]
+        self.entities = {}
+
+    def __len__(self):
+        return len(self.entities)
+
+    def before(self, name, date):
+        """
+        Takes in an entity and a release date, returns the sum and count of its releases strictly before that date
+        """
+        entity = self.entities.get(name)
+        if entity is None:
+            return 0, 0
+        last_date, sum_before, count_before, sum_on, count_on = entity
+        if date > last_date:
+            return sum_before + sum_on, count_before + count_on
+        if date == last_date:
+            return sum_before, count_before
+        raise ValueError('{} released on {} is earlier than its last known release on {}'.format(name, date, last_date))
+
+    def add(self, name, date, total, count):
+        """
+        Takes in an entity, a release date and the gross total and row count released on it, folds them into the history
+        """
+        entity = self.entities.get(name)
+        if entity is None:
+            self.entities[name] = [date, 0, 0, total, count]
+        elif date > entity[0]:
+            self.entities[name] = [date, entity[1] + entity[3], entity[2] + entity[4], total, count]
+        elif date == entity[0]:
+            entity[3] += total
+            entity[4] += count
+        else:
+            raise ValueError('{} released on {} is earlier than its last known release on {}'.format(name, date, entity[0]))
+
+    def check(self, df, key, date='release_date'):
+        """
+        Takes in a batch of new rows, raises a ValueError without changing the history if any of them is released
+        before its entity's last known release
+        """
+        # each entity's earliest release in the batch is the only one that can be out of order
+        first = df[[key, date]].dropna().groupby(key, sort=False)[date].min()
+        for name, day in first.items():
+            self.before(name, day)
+
+    def score(self, df, key, value='domestic_gross', date='release_date', weight=None):
+        """
+        Takes in a batch of new rows, returns the mean and count of value over earlier releases sharing the same key
+        (as history_before does on the full data) and adds the batch to the history
+        An optional weight column counts each row as that many rows
+        The whole batch is checked before any of it is added, so an out of order release leaves the history unchanged
+        """
+        self.check(df, key, date)
+
+        # sum and count per key and release date, in chronological order within each key
+        if weight is None:
+            daily = df.groupby([key, date])[value].agg(['sum', 'count'])
+        else:
+            daily = df.assign(sum=df[value] * df[weight], count=df[weight]).groupby([key, date])[['sum', 'count']].sum()
+
+        prior_sum = np.zeros(len(daily))
+        prior_count = np.zeros(len(daily), dtype='int64')
+        for i, ((name, day), total, count) in enumerate(zip(daily.index, daily['sum'], daily['count'])):
+            prior_sum[i], prior_count[i] = self.before(name, day)
+            self.add(name, day, int(total), int(count))
+
+        # look up the prior totals for every row (rows with a missing key have no history)
+        rows = pd.MultiIndex.from_frame(df[[key, date]])
+        prior_sum = pd.Series(prior_sum, index=daily.index).reindex(rows).to_numpy(dtype=float)
+        prior_count = pd.Series(prior_count, index=daily.index).reindex(rows).fillna(0).to_numpy(dtype='int64')
+
+        prior_mean = np.full(len(df), np.nan)
+        np.divide(prior_sum, prior_count, out=prior_mean, where=prior_count > 0)
+
+        return pd.Series(prior_mean, index=df.index), pd.Series(prior_count, index=df.index)
+
+#====================================================================
+### Star and director state
+#====================================================================
+
+class FeatureState:
+    """
+    Persisted star and director histories used by engineer_features_incremental
+    """
+    def __init__(self):
+        self.stars = RunningHistory()
+        self.directors = RunningHistory()
+
+    def save(self, path=STATE_PATH):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path=STATE_PATH):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+def star_rows(merged_df):
+    # one row per movie and star, as star power is computed in engineer_features
+    return merged_df[['movie', 'release_date', 'stars', 'domestic_gross']].drop_duplicates()
+
+def engineer_features_incremental(merged_df, state):
+    """
+    Takes in merged data of newly added movies and the feature state of all earlier movies,
+    returns the new movies with the same engineered features as engineer_features and updates the state
+    New movies must not be released before the latest release already in the state, otherwise a ValueError is raised
+    and the state is left unchanged
+    """
+    # check both histories before either is updated
+    state.stars.check(merged_df, 'stars')
+    state.directors.check(merged_df, 'director')
+
+    # create new features as star power and star appearances
+    merged_df_reduced = star_rows(merged_df)
+    merged_df_reduced['star_power'], merged_df_reduced['star_appearances'] = state.stars.score(merged_df_reduced, 'stars')
+    merged_df = merged_df.merge(merged_df_reduced)
+    merged_df['star_power'] = merged_df['star_power'].fillna(0)
+
+    # create a new feature as director power
+    merged_df = merged_df.sort_values(by='release_date', ascending=True)
+    merged_df['director_power'], _ = state.directors.score(merged_df, 'director')
+    merged_df['director_power'] = merged_df['director_power'].fillna(0)
+
+    # create new features as title length and month
+    merged_df = add_release_features(merged_df)
+
+    return merged_df
+
+def build_feature_state(merged_df):
+    """
+    Takes in the full merged data (wide or as movie tables), returns a feature state holding the complete
+    star and director histories
+    """
+    if isinstance(merged_df, MovieTables):
+        merged_df = merged_df.to_frame()
+    state = FeatureState()
+    engineer_features_incremental(merged_df, state)
+    return state
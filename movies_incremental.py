@@ -0,0 +1,159 @@
+"""
+Predicting Movie Revenue --
+Incremental scrape mode
+Records a high-water mark per source (the latest release year or date scraped) and only fetches releases from it on,
+merging the delta into the scrape stage artifacts
+"""
+
+import os
+import json
+
+import pandas as pd
+
+from movies_fetch import Fetcher
+from movies_stages import StageCache
+from movies_web_scraping import (IMDB_URL, THENUMBERS_URL, IMDB_COLUMNS, THENUMBERS_COLUMNS, FIRST_YEAR, imdb_page,
+                                 thenumbers_pages, parsed_pages, scrape_pages, iter_imdb_records,
+                                 iter_thenumbers_records)
+from movies_parsing import ColumnBuffer
+
+STATE_PATH = 'data/scrape_state.json'
+
+IMDB_PAGE_SIZE = 50
+MAX_NEW_PAGES = 200
+
+# the-numbers rows released this many days before the mark are fetched again, as their grosses are still growing
+REVISIT_DAYS = 90
+
+# columns identifying the same movie across refreshes
+IMDB_KEYS = ['movie', 'year', 'director']
+THENUMBERS_KEYS = ['movie', 'release_date']
+
+#====================================================================
+### High-water marks
+#====================================================================
+
+def load_state(path=STATE_PATH):
+    """
+    Returns the high-water marks of the last incremental run, or an empty state
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, path=STATE_PATH):
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=1)
+
+def latest_release_date(release_dates):
+    # latest of the numbers' release dates ('Dec 18, 2015') as an iso date, None if none of them is a full date
+    dates = pd.to_datetime(release_dates, format='%b %d, %Y', errors='coerce')
+    return dates.max().strftime('%Y-%m-%d') if dates.notna().any() else None
+
+def latest_year(years):
+    # latest of the imdb years ('(2015)' or '(I) (2015)'), None if there are none
+    years = pd.to_numeric(years.str[-5:-1], errors='coerce')
+    return int(years.max()) if years.notna().any() else None
+
+def initial_state(imdb_data, thenumbers_data):
+    """
+    Takes in the current scrape artifacts, returns high-water marks derived from them
+    (the latest release year and release date they contain)
+    """
+    return {'imdb': {'last_year': latest_year(imdb_data['year'])},
+            'thenumbers': {'last_release_date': latest_release_date(thenumbers_data['release_date'])}}
+
+#====================================================================
+### Fetching the delta
+#====================================================================
+
+def scrape_new_pages(page_url, parse_page, columns, page_size, fetcher):
+    """
+    Takes in a function mapping a page number (1, 2, ...) to its url, fetches and parses pages until one comes back
+    short, returns the parsed rows
+    A page that still fails after retries raises a RuntimeError rather than being taken for the end of the listing
+    """
+    buffer = ColumnBuffer(columns)
+    for page in range(1, MAX_NEW_PAGES + 1):
+        response, records = next(parsed_pages(fetcher.fetch_all([page_url(page)]), parse_page))
+        if records is None:
+            raise RuntimeError('Incremental scrape stopped at {}: status code {}, rerun to resume from the last '
+                               'high-water mark'.format(response.url, response.status_code))
+        buffer.extend(records)
+        if len(records) < page_size:
+            break
+    return buffer.to_frame()
+
+def scrape_imdb_delta(state, fetcher, base_url=IMDB_URL):
+    """
+    Takes in the imdb high-water mark, returns the movies released in its last year or later and the new mark
+    The last year is searched again, as its movies keep passing the search's minimum number of votes
+    """
+    last_year = int(state['last_year']) if state.get('last_year') else None
+    delta = scrape_new_pages(lambda page: imdb_page(page, base_url, last_year or FIRST_YEAR, None),
+                             iter_imdb_records, IMDB_COLUMNS, IMDB_PAGE_SIZE, fetcher)
+    state = {'last_year': max(filter(None, [last_year, latest_year(delta['year'])]), default=None)}
+    return delta, state
+
+def scrape_thenumbers_delta(state, fetcher, base_url=THENUMBERS_URL):
+    """
+    Takes in the-numbers high-water mark, returns the rows released from REVISIT_DAYS before it on, newest first,
+    and the new mark
+    The budget listing is ordered by budget, so a new release can be on any page: every page is fetched
+    (checkpointed, so a failed page raises and a rerun fetches only the rest) and filtered on release date
+    """
+    rows = scrape_pages('thenumbers_delta', thenumbers_pages(base_url), iter_thenumbers_records, THENUMBERS_COLUMNS,
+                        fetcher)
+    dates = pd.to_datetime(rows['release_date'], format='%b %d, %Y', errors='coerce')
+    last_date = state.get('last_release_date')
+    if last_date is not None:
+        keep = dates >= pd.Timestamp(last_date) - pd.Timedelta(days=REVISIT_DAYS)
+        rows, dates = rows[keep], dates[keep]
+    delta = rows.loc[dates.sort_values(ascending=False, kind='stable').index].reset_index(drop=True)
+
+    # both marks are iso dates, so the later one is also the larger string
+    last_date = max(filter(None, [last_date, latest_release_date(delta['release_date'])]), default=None)
+    return delta, {'last_release_date': last_date}
+
+#====================================================================
+### Merging the delta into the artifacts
+#====================================================================
+
+def merge_delta(existing, delta, keys):
+    """
+    Takes in an existing scrape artifact and newly scraped rows, returns them combined with the newest row per key
+    """
+    combined = pd.concat([existing, delta], ignore_index=True)
+    return combined.drop_duplicates(subset=keys, keep='last').reset_index(drop=True)
+
+def incremental_scrape(fetcher=None, stage_cache=None, state_path=STATE_PATH,
+                       imdb_url=IMDB_URL, thenumbers_url=THENUMBERS_URL):
+    """
+    Fetches only the imdb and the-numbers releases from the last high-water marks on, merges the new rows into
+    the scrape_imdb and scrape_thenumbers stage artifacts and records the new marks
+    Star rankings are a snapshot and are refreshed with a full scrape (--invalidate scrape_stars)
+    """
+    cache = StageCache() if stage_cache is None else stage_cache
+    imdb_data = cache.load('scrape_imdb') if cache.exists('scrape_imdb') else pd.DataFrame(columns=IMDB_COLUMNS)
+    thenumbers_data = (cache.load('scrape_thenumbers') if cache.exists('scrape_thenumbers')
+                       else pd.DataFrame(columns=THENUMBERS_COLUMNS))
+
+    state = load_state(state_path) or initial_state(imdb_data, thenumbers_data)
+
+    # fetch without the response cache, the pages at the high-water mark have to be current
+    own_fetcher = fetcher is None
+    fetcher = Fetcher() if own_fetcher else fetcher
+    try:
+        imdb_delta, state['imdb'] = scrape_imdb_delta(state.get('imdb', {}), fetcher, imdb_url)
+        thenumbers_delta, state['thenumbers'] = scrape_thenumbers_delta(state.get('thenumbers', {}), fetcher, thenumbers_url)
+    finally:
+        if own_fetcher:
+            fetcher.close()
+
+    print('New imdb rows:', len(imdb_delta), '; new the-numbers rows:', len(thenumbers_delta))
+    cache.update('scrape_imdb', merge_delta(imdb_data, imdb_delta, IMDB_KEYS))
+    cache.update('scrape_thenumbers', merge_delta(thenumbers_data, thenumbers_delta, THENUMBERS_KEYS))
+    save_state(state, state_path)
+
+    return state
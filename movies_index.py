@@ -0,0 +1,125 @@
+"""
+Predicting Movie Revenue --
+Star and director lookup indexes
+Names are interned to integer ids once and each entity's release history is kept as sorted NumPy arrays,
+so "history before date D" is a binary search instead of a scan of the whole frame
+"""
+
+import numpy as np
+import pandas as pd
+
+DAY = np.timedelta64(1, 'D')
+EPOCH = np.datetime64('1900-01-01')
+
+#====================================================================
+### Entity index
+#====================================================================
+
+class EntityIndex:
+    """
+    Release history per entity (star or director) in CSR-like arrays
+    Entries are sorted by (entity id, release day) with the running gross total and count up to and including
+    each day, so a lookup is one np.searchsorted over a combined (id, day) key
+    """
+    def __init__(self, names, keys, cum_sum, cum_count):
+        self.names = pd.Index(names)  # id -> name
+        self.keys = keys              # id << 32 | release day, sorted
+        self.cum_sum = cum_sum        # running gross per entity, including the entry's day
+        self.cum_count = cum_count    # running number of rows per entity, including the entry's day
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def day(dates):
+        return (pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]') - EPOCH) // DAY
+
+    @classmethod
+    def build(cls, df, key, value='domestic_gross', date='release_date', weight=None):
+        """
+        Takes in a dataframe and an entity column, returns the index of value per entity and release date
+        Rows with a missing entity are left out, an optional weight column counts each row as that many rows
+        """
+        df = df[df[key].notna()]
+        ids, names = pd.factorize(df[key])
+        days = cls.day(df[date].to_numpy())
+        values = df[value].to_numpy()
+        weights = np.ones(len(df), dtype=np.int64) if weight is None else df[weight].to_numpy()
+
+        # sum and count per entity and day, sorted once by id then day
+        daily = pd.DataFrame({'key': (ids.astype(np.int64) << 32) | days, 'sum': values * weights,
+                              'count': np.where(pd.isna(values), 0, weights)}) \
+            .groupby('key')[['sum', 'count']].sum()
+        keys = daily.index.to_numpy()
+        entity = keys >> 32
+
+        # running totals restart at each entity
+        cum_sum = daily['sum'].to_numpy().cumsum()
+        cum_count = daily['count'].to_numpy().cumsum()
+        starts = np.flatnonzero(np.r_[True, entity[1:] != entity[:-1]])
+        lengths = np.diff(np.r_[starts, len(keys)])
+        cum_sum -= np.repeat(np.r_[0, cum_sum[starts[1:] - 1]], lengths)
+        cum_count -= np.repeat(np.r_[0, cum_count[starts[1:] - 1]], lengths)
+
+        return cls(names, keys, cum_sum, cum_count)
+
+    def ids(self, names):
+        """
+        Takes in entity names, returns their integer ids (-1 for unknown names)
+        """
+        return self.names.get_indexer(names)
+
+    def history_before_ids(self, ids, dates):
+        """
+        Takes in arrays of entity ids and release dates, returns the sum and count of each entity's rows
+        released strictly before the matching date
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        query = (ids << 32) | self.day(dates)
+
+        # the entry just before the query position is the entity's last day before the date, if it is the same entity
+        pos = np.searchsorted(self.keys, query, side='left') - 1
+        found = (ids >= 0) & (pos >= 0)
+        found[found] &= (self.keys[pos[found]] >> 32) == ids[found]
+
+        # gathered only where found, so an empty index (e.g. built from all missing names) returns zeros
+        prior_sum = np.zeros(len(ids), dtype=self.cum_sum.dtype)
+        prior_count = np.zeros(len(ids), dtype=self.cum_count.dtype)
+        prior_sum[found] = self.cum_sum[pos[found]]
+        prior_count[found] = self.cum_count[pos[found]]
+        return prior_sum, prior_count
+
+    def history_before(self, names, dates):
+        """
+        Takes in entity names and release dates, returns the mean (missing without history) and count
+        of each entity's rows released strictly before the matching date
+        """
+        prior_sum, prior_count = self.history_before_ids(self.ids(names), dates)
+        prior_mean = np.full(len(prior_sum), np.nan)
+        np.divide(prior_sum, prior_count, out=prior_mean, where=prior_count > 0)
+        return prior_mean, prior_count
+
+    def lookup(self, name, date):
+        """
+        Takes in one entity name and a release date, returns the mean gross and count of its earlier releases
+        """
+        prior_mean, prior_count = self.history_before([name], [date])
+        return float(prior_mean[0]), int(prior_count[0])
+
+    def save(self, path):
+        np.savez(path, names=np.asarray(self.names, dtype=object), keys=self.keys,
+                 cum_sum=self.cum_sum, cum_count=self.cum_count)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path, allow_pickle=True)
+        return cls(arrays['names'], arrays['keys'], arrays['cum_sum'], arrays['cum_count'])
+
+def build_indexes(merged_df):
+    """
+    Takes in merged data, returns the star index (one row per movie and star, as for star power)
+    and the director index (every merged row, as for director power)
+    """
+    star_rows = merged_df[['movie', 'release_date', 'stars', 'domestic_gross']].drop_duplicates()
+    return {'stars': EntityIndex.build(star_rows, 'stars'),
+            'directors': EntityIndex.build(merged_df, 'director')}
@@ -0,0 +1,132 @@
+"""
+Predicting Movie Revenue --
+Title matching for the imdb and the numbers join
+Titles the exact (movie, year) join misses are matched on normalized titles within a year of each other,
+then on shared title trigrams, blocked by year and trigram so candidates stay near-linear instead of all pairs
+"""
+
+import re
+
+import pandas as pd
+
+import movies_metrics
+
+KEYS = ['movie', 'year']
+
+# arabic numbers and roman numerals from ii on, as whole words
+NUMBER = re.compile(r'\b(?:\d+|ii|iii|iv|v|vi|vii|viii|ix|x)\b')
+
+#====================================================================
+### Normalized titles
+#====================================================================
+
+def normalize_titles(titles):
+    """
+    Takes in a series of titles, returns them lowercased and ascii folded, with '&' spelled out,
+    apostrophes dropped, any other punctuation as single spaces and a leading 'the' removed
+    """
+    titles = pd.Series(titles, dtype=str)
+    titles = titles.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii').str.lower()
+    titles = titles.str.replace('&', ' and ', regex=False).str.replace(r"['`]", '', regex=True)
+    titles = titles.str.replace(r'[^a-z0-9]+', ' ', regex=True).str.strip()
+    return titles.str.replace(r'^the ', '', regex=True)
+
+def title_grams(title):
+    # character trigrams of a normalized title, padded so short titles and word edges count
+    padded = ' ' + title + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def title_numbers(title):
+    # sequel and part numbers in a normalized title, which a fuzzy match must not change
+    return NUMBER.findall(title)
+
+def one_to_one(candidates):
+    # greedily keeps the best scoring pair per title on either side
+    candidates = candidates.sort_values('score', ascending=False, kind='stable')
+    return candidates.drop_duplicates('left').drop_duplicates('right')
+
+#====================================================================
+### Matching
+#====================================================================
+
+def match_titles(left, right, threshold=0.75, year_window=1, max_block=100):
+    """
+    Takes in two dataframes of movie and year, returns one-to-one matches between their rows as a dataframe
+    of left and right index labels, score and method ('normalized' for equal normalized titles,
+    'fuzzy' for trigram jaccard similarity of at least threshold), released at most year_window years apart
+    Fuzzy candidates are pairs sharing a trigram in the same year block; trigrams shared by more than
+    max_block right titles in a block are too common to block on and are skipped
+    """
+    left = pd.DataFrame({'left': left.index, 'title': normalize_titles(left['movie']).to_numpy(),
+                         'year': left['year'].to_numpy()})
+    right = pd.DataFrame({'right': right.index, 'title': normalize_titles(right['movie']).to_numpy(),
+                          'year': right['year'].to_numpy()})
+    offsets = range(-year_window, year_window + 1)
+
+    # right rows once per year in the window, scores slightly preferring the same year
+    def shifted(frame):
+        return pd.concat([frame.assign(year=frame['year'] + offset, penalty=0.01 * abs(offset)) for offset in offsets],
+                         ignore_index=True)
+
+    # equal normalized titles
+    candidates = left.merge(shifted(right), on=['title', 'year'])
+    normalized = one_to_one(candidates.assign(score=1 - candidates['penalty'], method='normalized'))
+
+    # trigram blocking over the titles still unmatched
+    left = left[~left['left'].isin(normalized['left'])]
+    right = right[~right['right'].isin(normalized['right'])]
+    grams = {('left', label): title_grams(title) for label, title in zip(left['left'], left['title'])}
+    grams.update({('right', label): title_grams(title) for label, title in zip(right['right'], right['title'])})
+
+    left_grams = left.assign(gram=[list(grams['left', label]) for label in left['left']]).explode('gram')
+    right_grams = shifted(right.assign(gram=[list(grams['right', label]) for label in right['right']]).explode('gram'))
+    block_sizes = right_grams.groupby(['year', 'gram'])['right'].transform('size')
+    pairs = left_grams[['left', 'year', 'gram']].merge(right_grams[block_sizes <= max_block], on=['year', 'gram'])
+
+    # exact jaccard similarity for the few candidates sharing the most trigrams with each left title,
+    # zero unless both titles have the same numbers so sequels are not matched to each other
+    pairs = pairs.groupby(['left', 'right'], as_index=False).agg(shared=('gram', 'size'), penalty=('penalty', 'min'))
+    pairs = pairs.sort_values('shared', ascending=False, kind='stable').groupby('left').head(3)
+    left_numbers = dict(zip(left['left'], map(title_numbers, left['title'])))
+    right_numbers = dict(zip(right['right'], map(title_numbers, right['title'])))
+    jaccard = [len(grams['left', a] & grams['right', b]) / len(grams['left', a] | grams['right', b])
+               if left_numbers[a] == right_numbers[b] else 0.0 for a, b in zip(pairs['left'], pairs['right'])]
+    pairs = pairs.assign(score=pd.Series(jaccard, index=pairs.index, dtype=float) - pairs['penalty'],
+                         method='fuzzy')
+    fuzzy = one_to_one(pairs[pairs['score'] >= threshold])
+
+    columns = ['left', 'right', 'score', 'method']
+    return pd.concat([normalized[columns], fuzzy[columns]], ignore_index=True)
+
+def align_thenumbers(imdb_data, thenumbers_data, fuzzy=True, threshold=0.75):
+    """
+    Takes in cleaned imdb data (wide or movie tables) and cleaned the numbers data, returns the numbers data
+    with the movie and year of rows matched to an imdb movie by title set to that movie's,
+    so the exact (movie, year) join in merge_data or merge_tables picks them up
+    Match counts and rate are printed and reported to the active recorder
+    """
+    movies = getattr(imdb_data, 'movies', imdb_data)
+    keys = movies[KEYS].drop_duplicates().reset_index(drop=True)
+    thenumbers_data = thenumbers_data.reset_index(drop=True)
+
+    # movies and rows the exact join already matches
+    imdb_exact = pd.MultiIndex.from_frame(keys).isin(pd.MultiIndex.from_frame(thenumbers_data[KEYS]))
+    thenumbers_exact = pd.MultiIndex.from_frame(thenumbers_data[KEYS]).isin(pd.MultiIndex.from_frame(keys))
+
+    matches = pd.DataFrame(columns=['left', 'right', 'score', 'method'])
+    if fuzzy:
+        matches = match_titles(keys[~imdb_exact], thenumbers_data[~thenumbers_exact], threshold)
+        matched = keys.loc[matches['left']]
+        thenumbers_data.loc[matches['right'], 'movie'] = matched['movie'].to_numpy()
+        thenumbers_data.loc[matches['right'], 'year'] = matched['year'].to_numpy(thenumbers_data['year'].dtype)
+
+    methods = matches['method'].value_counts()
+    report = {'imdb_movies': len(keys), 'exact': int(imdb_exact.sum()),
+              'normalized': int(methods.get('normalized', 0)), 'fuzzy': int(methods.get('fuzzy', 0))}
+    report['unmatched'] = report['imdb_movies'] - report['exact'] - report['normalized'] - report['fuzzy']
+    report['match_rate'] = 1 - report['unmatched'] / max(report['imdb_movies'], 1)
+    movies_metrics.emit('title_match', **report)
+    print('Matched {match_rate:.1%} of {imdb_movies} imdb movies: {exact} exact, {normalized} normalized, '
+          '{fuzzy} fuzzy, {unmatched} unmatched'.format(**report))
+
+    return thenumbers_data
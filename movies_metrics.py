@@ -0,0 +1,198 @@
+"""
+Predicting Movie Revenue --
+Instrumentation for the scraping and preprocessing chain
+Stages, requests and page parsing report timers, bytes, row counts and peak memory as json lines events
+to the active recorder, which summarizes them at the end of a run; any stage can also be run under cProfile
+"""
+
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import resource
+import threading
+from contextlib import contextmanager
+
+METRICS_PATH = 'data/metrics.jsonl'
+PROFILE_DIR = 'data/profiles'
+
+def count_rows(value):
+    # dataframes and movie tables count their rows, tuples of them the sum, lists of pages their length
+    if isinstance(value, tuple):
+        return sum(count_rows(item) for item in value)
+    return len(value) if hasattr(value, '__len__') else 0
+
+def max_rss_mb():
+    # the process's peak resident memory so far
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+#====================================================================
+### Recorder
+#====================================================================
+
+class Recorder:
+    """
+    Collects instrumentation events, appending each one as a json line to path (if given)
+    Stages named in profile are run under cProfile, with stats dumped to profile_dir
+    """
+    def __init__(self, path=METRICS_PATH, profile=(), profile_dir=PROFILE_DIR):
+        self.path = path
+        self.profile = set(profile)
+        self.profile_dir = profile_dir
+        self.events = []
+        self.lock = threading.Lock()
+        self.run = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def emit(self, event, **fields):
+        """
+        Takes in an event type and its fields, records it and appends it to the json lines file
+        """
+        record = dict({'run': self.run, 'event': event, 'time': round(time.time(), 3)}, **fields)
+        with self.lock:
+            self.events.append(record)
+            if self.path is not None:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record, default=str) + '\n')
+
+    @contextmanager
+    def stage(self, name, inputs=()):
+        """
+        Context manager timing a stage, yields a dict in which the caller sets the stage's 'output'
+        Emits the stage's wall time, rows in and out and peak memory, profiling it if requested
+        """
+        result = {}
+        profiler = cProfile.Profile() if name in self.profile else None
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield result
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.emit('stage', stage=name, seconds=time.perf_counter() - start, rows_in=count_rows(tuple(inputs)),
+                      rows_out=count_rows(result.get('output', ())), max_rss_mb=max_rss_mb())
+            if profiler is not None:
+                self.dump_profile(name, profiler)
+
+    def dump_profile(self, name, profiler):
+        """
+        Takes in a stage name and its profiler, writes the stats (for pstats or snakeviz) and prints the top calls
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, name + '.prof')
+        profiler.dump_stats(path)
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+        print(stream.getvalue())
+        self.emit('profile', stage=name, path=path)
+
+    def frame(self, event):
+        """
+        Takes in an event type, returns its recorded events as a dataframe
+        """
+        # pandas is only loaded to summarize a run, so recording (and the command line) starts without it
+        import pandas as pd
+        return pd.DataFrame([record for record in self.events if record['event'] == event])
+
+    def summary(self):
+        """
+        Returns a dict summarizing the run: per stage timings and rows, request, cache and parse totals and the title match rate
+        """
+        summary = {}
+
+        stages = self.frame('stage')
+        if len(stages):
+            summary['stages'] = stages[['stage', 'seconds', 'rows_in', 'rows_out', 'max_rss_mb']].to_dict('records')
+            summary['max_rss_mb'] = float(stages['max_rss_mb'].max())
+
+        requests = self.frame('request')
+        if len(requests):
+            summary['requests'] = len(requests)
+            summary['bytes_downloaded'] = int(requests['bytes'].sum())
+            summary['network_seconds'] = float(requests['seconds'].sum())
+            summary['rate_limit_wait_seconds'] = float(requests['wait_seconds'].sum())
+            summary['failed_requests'] = int((~requests['status'].isin([200, 304])).sum())
+
+        cache_hits = self.frame('cache_hit')
+        summary['cache_hits'] = len(cache_hits)
+
+        matches = self.frame('title_match')
+        if len(matches):
+            # over every matched batch, e.g. the partitions of a chunked run
+            imdb_movies = max(int(matches['imdb_movies'].sum()), 1)
+            summary['title_match_rate'] = 1 - float(matches['unmatched'].sum()) / imdb_movies
+
+        pages = self.frame('parse')
+        if len(pages):
+            summary['pages_parsed'] = len(pages)
+            summary['parse_seconds'] = float(pages['seconds'].sum())
+            summary['records_parsed'] = int(pages['records'].sum())
+
+        return summary
+
+    def report(self):
+        """
+        Prints and records the run summary, returns it
+        """
+        summary = self.summary()
+        self.emit('summary', **summary)
+
+        for stage in summary.get('stages', []):
+            print('{stage:<20} {seconds:>9.2f} s  rows {rows_in:>9} -> {rows_out:<9} max rss {max_rss_mb:.0f} MB'
+                  .format(**stage))
+        if 'requests' in summary:
+            print('{} requests, {:.1f} MB downloaded, {:.1f} s network, {:.1f} s rate limit wait, {} failed'.format(
+                summary['requests'], summary['bytes_downloaded'] / 2 ** 20, summary['network_seconds'],
+                summary['rate_limit_wait_seconds'], summary['failed_requests']))
+        print('{} pages from cache'.format(summary['cache_hits']))
+        if 'pages_parsed' in summary:
+            print('{} pages parsed in {:.1f} s ({} records)'.format(
+                summary['pages_parsed'], summary['parse_seconds'], summary['records_parsed']))
+
+        return summary
+
+#====================================================================
+### Active recorder
+#====================================================================
+
+# the fetch layer, parsers and stage cache report to the active recorder, if any
+_ACTIVE = {'recorder': None}
+
+def emit(event, **fields):
+    """
+    Takes in an event type and its fields, records it with the active recorder (no-op without one)
+    """
+    recorder = _ACTIVE['recorder']
+    if recorder is not None:
+        recorder.emit(event, **fields)
+
+@contextmanager
+def stage(name, inputs=()):
+    """
+    Times a stage with the active recorder, yields a dict in which the caller sets the stage's 'output'
+    """
+    recorder = _ACTIVE['recorder']
+    if recorder is None:
+        yield {}
+        return
+    with recorder.stage(name, inputs) as result:
+        yield result
+
+@contextmanager
+def recording(recorder):
+    """
+    Makes recorder the active recorder for the duration of the block
+    """
+    previous = _ACTIVE['recorder']
+    _ACTIVE['recorder'] = recorder
+    try:
+        yield recorder
+    finally:
+        _ACTIVE['recorder'] = previous
@@ -0,0 +1,239 @@
+"""
+Predicting Movie Revenue --
+Streaming page parsers for the web scrapers
+Pages are walked with lxml's iterparse, yielding one typed record per container and freeing each container
+once parsed, so no full soup is ever built; records are batched straight into columnar buffers
+"""
+
+import io
+import os
+import time
+import resource
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from lxml import etree
+
+def has_class(name):
+    # xpath test for a whitespace-separated class token, as beautifulsoup's class_ matching does
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(name)
+
+def text(element):
+    # all descendant text, like beautifulsoup's .text
+    return ''.join(element.itertext())
+
+def first(element, path):
+    found = element.xpath(path)
+    return found[0] if found else None
+
+def iter_elements(html, tag, is_container):
+    """
+    Takes in page html, yields every element with the given tag accepted by is_container,
+    clearing it (and the siblings before it) once the consumer moves on
+    """
+    data = html.encode('utf-8') if isinstance(html, str) else html
+    for _, element in etree.iterparse(io.BytesIO(data), events=('end',), tag=tag, html=True, recover=True):
+        if not is_container(element):
+            continue
+        yield element
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+#====================================================================
+### IMDB search pages
+#====================================================================
+
+IMDB_TEXT_MUTED = ".//p[{}]".format(has_class('text-muted'))
+IMDB_CREDITS = ".//div[{}]//p[@class='']".format(has_class('lister-item-content'))
+
+def iter_imdb_records(html):
+    """
+    Takes in the html of an IMDB search page, yields one movie record per lister item
+    Records match parse_imdb_page in movies_web_scraping.py field for field
+    """
+    containers = iter_elements(html, 'div', lambda div: div.get('class') == 'lister-item mode-advanced')
+    for container in containers:
+        # name and year from the header
+        header = first(container, './/h3')
+        name = text(first(header, './/a'))
+        year = text(first(header, ".//span[{}]".format(has_class('lister-item-year'))))
+
+        # imdb rating, metascore and votes
+        imdb = first(container, './/strong')
+        imdb = float(text(imdb)) if imdb is not None else 'no stars given'
+        m_score = first(container, ".//span[{}]".format(has_class('metascore')))
+        m_score = int(text(m_score)) if m_score is not None else 'no metascore'
+        vote = first(container, ".//span[@name='nv']")
+        vote = int(vote.get('data-value')) if vote is not None else 'no votes'
+
+        # runtime, certificate and genre share one lookup of the muted paragraph
+        muted = first(container, IMDB_TEXT_MUTED)
+        runtime = first(muted, ".//span[{}]".format(has_class('runtime')))
+        runtime = text(runtime) if runtime is not None else 'no runtime'
+        certificate = first(muted, ".//span[{}]".format(has_class('certificate')))
+        certificate = text(certificate) if certificate is not None else 'not rated'
+        genre = first(muted, ".//span[{}]".format(has_class('genre')))
+        genre = text(genre).split() if genre is not None else 'no genre'
+
+        # director (first link) and stars (remaining links) share one lookup of the credits paragraph
+        links = [text(a) for a in first(container, IMDB_CREDITS).iter('a')]
+        director = links[0] if links else 'no director'
+        star = links[1:] if links else 'no stars'
+
+        yield (name, year, imdb, m_score, vote, runtime, certificate, genre, director, star)
+
+#====================================================================
+### the-numbers budget pages
+#====================================================================
+
+def iter_thenumbers_records(html):
+    """
+    Takes in the html of a the-numbers budget page, yields one movie record per row of the first table
+    """
+    tables = iter_elements(html, 'table', lambda table: True)
+    table = next(tables, None)
+    if table is None:
+        return
+
+    for row in table.xpath('.//tr')[1:101]:
+        items = row.xpath('.//td')
+
+        release_date = first(items[1], './/a')
+        release_date = text(release_date) if release_date is not None else 'no release date'
+        movie_name = first(items[2], './/a')
+        movie_name = text(movie_name) if movie_name is not None else 'no movie name'
+
+        yield (movie_name, release_date, text(items[3]), text(items[4]), text(items[5]))
+
+#====================================================================
+### IMDB starmeter pages
+#====================================================================
+
+def iter_imdbstarmeter_records(html):
+    """
+    Takes in the html of an IMDB starmeter page, yields one star record per lister item
+    """
+    containers = iter_elements(html, 'div', lambda div: 'lister-item' in (div.get('class') or '').split())
+    for container in containers:
+        star_name = first(container, './/img[@alt]').get('alt') or 'no name'
+
+        star_ranking = first(container, ".//span[{}]".format(has_class('lister-item-index')))
+        star_ranking = text(star_ranking) if star_ranking is not None else 'no ranking'
+
+        # first text node directly under the muted paragraph
+        muted = first(container, ".//p[{}]".format(has_class('text-muted')))
+        texts = [muted.text] + [child.tail for child in muted]
+        actor_or_actress = next((string for string in texts if string is not None), None) or 'no type'
+
+        yield (star_name, star_ranking, actor_or_actress)
+
+#====================================================================
+### Columnar buffers
+#====================================================================
+
+class ColumnBuffer:
+    """
+    Accumulates records into one list per column, then builds a dataframe without an intermediate list of rows
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.data = [[] for _ in self.columns]
+
+    def __len__(self):
+        return len(self.data[0])
+
+    def extend(self, records):
+        appends = [column.append for column in self.data]
+        for record in records:
+            for append, value in zip(appends, record):
+                append(value)
+
+    def to_frame(self):
+        return pd.DataFrame(dict(zip(self.columns, self.data)), columns=self.columns)
+
+#====================================================================
+### Parallel parsing
+#====================================================================
+
+def parse_content(parse_page, html):
+    # runs in a parse worker: the page's records and the seconds taken to parse them
+    start = time.perf_counter()
+    records = list(parse_page(html))
+    return records, time.perf_counter() - start
+
+def parse_responses(responses, parse_page, workers=1, max_pending=None):
+    """
+    Takes in an iterable of fetched responses and a page parser, yields (response, records, seconds) in order,
+    with records None for responses other than 200
+    With several workers (None for one per core), pages are handed to a process pool as they are fetched and
+    parsed while later pages are still downloading, with at most max_pending pages (4 per worker by default)
+    queued ahead of the consumer
+    """
+    if workers == 1:
+        for response in responses:
+            if response.status_code != 200:
+                yield response, None, 0.0
+            else:
+                yield (response,) + parse_content(parse_page, response.text)
+        return
+
+    workers = os.cpu_count() if workers is None else workers
+    max_pending = 4 * workers if max_pending is None else max_pending
+
+    def completed(response, future):
+        if future is None:
+            return response, None, 0.0
+        return (response,) + future.result()
+
+    pending = deque()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for response in responses:
+            future = pool.submit(parse_content, parse_page, response.text) if response.status_code == 200 else None
+            pending.append((response, future))
+            if len(pending) > max_pending:
+                yield completed(*pending.popleft())
+        while pending:
+            yield completed(*pending.popleft())
+
+#====================================================================
+### Parser micro-benchmark
+#====================================================================
+
+def _measure(parse, pages, streaming):
+    # runs in a fresh process so ru_maxrss reflects only this parser
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    records = 0
+    for page in pages:
+        if streaming:
+            records += sum(1 for _ in parse(page))
+        else:
+            records += len(parse(page))
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return records, seconds, (peak - baseline) / 1024
+
+def benchmark_parsers(pages, source='imdb'):
+    """
+    Takes in a list of saved page htmls and the source they come from ('imdb', 'thenumbers' or 'imdbstarmeter'),
+    returns a dataframe comparing records/s and peak memory growth of the soup parser and the streaming parser
+    """
+    from movies_web_scraping import parse_imdb_page, parse_thenumbers_page, parse_imdbstarmeter_page
+    parsers = {'imdb': (parse_imdb_page, iter_imdb_records),
+               'thenumbers': (parse_thenumbers_page, iter_thenumbers_records),
+               'imdbstarmeter': (parse_imdbstarmeter_page, iter_imdbstarmeter_records)}
+    soup_parser, stream_parser = parsers[source]
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name, parse, streaming in [('soup', soup_parser, False), ('stream', stream_parser, True)]:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            records, seconds, peak_mb = pool.submit(_measure, parse, pages, streaming).result()
+        results.append({'parser': name, 'pages': len(pages), 'records': records, 'seconds': seconds,
+                        'records_per_s': records / seconds, 'peak_rss_growth_mb': peak_mb})
+
+    return pd.DataFrame(results)
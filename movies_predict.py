@@ -0,0 +1,265 @@
+"""
+Predicting Movie Revenue --
+Prediction service for pre-release titles
+Loads the trained model and the star/director lookup tables once, then scores single movies or batches
+from their budget, cast, director, runtime, certificate, month and genres, in process or over HTTP
+"""
+
+import json
+import pickle
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from movies_features import COMPLETE_FEATURES, TARGET, encode_inputs, encode_movies
+
+MODEL_PATH = 'data/model.pkl'
+LOOKUP_PATH = 'data/lookup_tables.pkl'
+
+# small batches are faster through the flattened forest, large ones through scikit-learn's per-tree predict
+FLAT_MAX_ROWS = 64
+
+#====================================================================
+### Flattened random forest
+#====================================================================
+
+class FlatForest:
+    """
+    A fitted random forest flattened into concatenated node arrays, so every tree is walked at once,
+    one level per step, instead of calling each of the trees in turn
+    """
+    def __init__(self, forest):
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+
+        self.roots = offsets
+        self.feature = np.concatenate([np.maximum(tree.feature, 0) for tree in trees])
+        self.threshold = np.concatenate([tree.threshold for tree in trees])
+        self.value = np.concatenate([tree.value[:, 0, 0] for tree in trees])
+
+        # leaves point to themselves, so finished trees stay put while deeper ones keep descending
+        left, right = [], []
+        for tree, offset in zip(trees, offsets):
+            nodes = np.arange(tree.node_count) + offset
+            leaf = tree.children_left < 0
+            left.append(np.where(leaf, nodes, tree.children_left + offset))
+            right.append(np.where(leaf, nodes, tree.children_right + offset))
+        self.left = np.concatenate(left)
+        self.right = np.concatenate(right)
+
+    def predict(self, X):
+        # trees compare float32 features, as scikit-learn does
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+
+        # one entry per (row, tree), only entries that have not reached a leaf are advanced
+        nodes = np.tile(self.roots, len(X))
+        rows = np.repeat(np.arange(len(X)), len(self.roots))
+        active = np.flatnonzero(self.left[nodes] != nodes)
+        while active.size:
+            current = nodes[active]
+            go_left = X[rows[active], self.feature[current]] <= self.threshold[current]
+            nodes[active] = np.where(go_left, self.left[current], self.right[current])
+            active = active[self.left[nodes[active]] != nodes[active]]
+
+        return self.value[nodes].reshape(len(X), len(self.roots)).mean(axis=1)
+
+#====================================================================
+### Training and lookup tables
+#====================================================================
+
+def train_model(movies_genre_df, path=MODEL_PATH, n_estimators=1800, max_features=3, random_state=None,
+                registry=None):
+    """
+    Takes in the movies data with one row per genre, fits the notebook's final random forest on the complete
+    feature set and pickles it with its feature columns, returns the fitted model
+    With a model registry (see movies_registry), the registered forest is reused when the data is unchanged
+    and grown with extra trees when movies were only added
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    movies_matrix = encode_movies(movies_genre_df)
+    X, y = movies_matrix[COMPLETE_FEATURES], movies_matrix[TARGET]
+    if registry is None:
+        rf = RandomForestRegressor(n_estimators=n_estimators, max_features=max_features, random_state=random_state)
+        rf.fit(X, y)
+    else:
+        params = {'n_estimators': n_estimators, 'max_features': max_features, 'random_state': random_state}
+        rf, _ = registry.fit('random_forest', params, X, y)
+
+    with open(path, 'wb') as f:
+        pickle.dump({'model': rf, 'features': COMPLETE_FEATURES}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return rf
+
+def build_lookup_tables(feature_state, star_data, path=LOOKUP_PATH):
+    """
+    Takes in the feature state of all released movies and the cleaned star rankings, pickles and returns
+    per-star (mean gross, appearances, star points) and per-director mean gross lookups
+    """
+    stars = {}
+    for name, (_, sum_before, count_before, sum_on, count_on) in feature_state.stars.entities.items():
+        stars[name] = ((sum_before + sum_on) / (count_before + count_on), count_before + count_on)
+    directors = {name: (sum_before + sum_on) / (count_before + count_on)
+                 for name, (_, sum_before, count_before, sum_on, count_on) in feature_state.directors.entities.items()}
+    star_points = dict(zip(star_data['star_name'], star_data['star_points'].astype(float)))
+
+    tables = {'stars': stars, 'directors': directors, 'star_points': star_points}
+    with open(path, 'wb') as f:
+        pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return tables
+
+#====================================================================
+### Predictor
+#====================================================================
+
+# movie fields: the json types they take
+NUMBER_FIELDS = ['production_budget', 'runtime', 'year']
+STRING_FIELDS = ['movie', 'director', 'certificate', 'month', 'release_date']
+LIST_FIELDS = ['stars', 'genres']
+
+def check_movie(movie):
+    """
+    Takes in a movie dict, raises a TypeError (or ValueError for a number that is not finite)
+    if any of its fields has the wrong type, e.g. a single genre given as a string instead of a list
+    """
+    for field in NUMBER_FIELDS:
+        value = movie.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError('{} must be a number, got {!r}'.format(field, value))
+        if not np.isfinite(value):
+            raise ValueError('{} must be finite, got {!r}'.format(field, value))
+    for field in STRING_FIELDS:
+        if movie.get(field) is not None and not isinstance(movie[field], str):
+            raise TypeError('{} must be a string, got {!r}'.format(field, movie[field]))
+    for field in LIST_FIELDS:
+        values = movie.get(field)
+        if values is not None and (not isinstance(values, list) or not all(isinstance(v, str) for v in values)):
+            raise TypeError('{} must be a list of strings, got {!r}'.format(field, values))
+
+class MoviePredictor:
+    """
+    Scores movies with a pickled model and lookup tables loaded once at startup
+    A movie is a dict with production_budget, stars (list), director, runtime, certificate, genres (list), movie (title)
+    and either release_date or year and month (e.g. 'Jul')
+    """
+    def __init__(self, model_path=MODEL_PATH, lookup_path=LOOKUP_PATH, model=None, tables=None):
+        if model is None:
+            with open(model_path, 'rb') as f:
+                model = pickle.load(f)['model']
+        if tables is None:
+            with open(lookup_path, 'rb') as f:
+                tables = pickle.load(f)
+
+        # random forests are also flattened once so small calls walk all trees together
+        self.model = model
+        self.flat = FlatForest(model) if hasattr(model, 'estimators_') else None
+        if self.flat is not None:
+            self.model.n_jobs = -1
+        self.stars = tables['stars']
+        self.directors = tables['directors']
+        self.star_points = tables['star_points']
+
+    def movie_features(self, movie):
+        """
+        Takes in a movie dict, returns its numeric features (as engineer_features and agg_stars_genre build them)
+        plus certificate, month and genres
+        Raises a TypeError or ValueError for a movie with fields of the wrong type (see check_movie)
+        """
+        check_movie(movie)
+
+        # star power and star points are averaged over the cast, appearances are summed
+        cast = movie.get('stars') or []
+        history = [self.stars.get(star, (0.0, 0)) for star in cast]
+        star_power = sum(mean for mean, _ in history) / len(cast) if cast else 0.0
+        star_appearances = sum(count for _, count in history)
+        star_points = sum(self.star_points.get(star, 0.0) for star in cast) / len(cast) if cast else 0.0
+
+        if movie.get('release_date') is not None:
+            release_date = pd.Timestamp(movie['release_date'])
+            year, month = release_date.year, release_date.strftime('%b')
+        else:
+            year, month = movie['year'], movie['month']
+        genres = movie.get('genres') or []
+
+        return {'runtime': movie['runtime'],
+                'year': year,
+                'genre_count': len(genres),
+                'title_length': len(movie.get('movie', '')),
+                'production_budget': movie['production_budget'],
+                'director_power': self.directors.get(movie.get('director'), 0.0),
+                'star_power': star_power,
+                'star_points': star_points,
+                'star_appearances': star_appearances,
+                'certificate': movie.get('certificate'),
+                'month': month,
+                'genres': genres}
+
+    def feature_matrix(self, movies):
+        """
+        Takes in a list of movie dicts, returns their feature matrix in COMPLETE_FEATURES order
+        """
+        return encode_inputs(pd.DataFrame([self.movie_features(movie) for movie in movies]))
+
+    def predict_batch(self, movies):
+        """
+        Takes in a list of movie dicts, returns an array of predicted domestic gross from a single model call
+        """
+        if not movies:
+            return np.array([])
+        return self.predict_matrix(self.feature_matrix(movies))
+
+    def predict_matrix(self, X):
+        """
+        Takes in a feature matrix in COMPLETE_FEATURES order, returns the model's predictions
+        """
+        if self.flat is not None and len(X) <= FLAT_MAX_ROWS:
+            return self.flat.predict(X)
+        return self.model.predict(pd.DataFrame(X, columns=COMPLETE_FEATURES))
+
+    def predict(self, movie):
+        """
+        Takes in a movie dict, returns its predicted domestic gross
+        """
+        return float(self.predict_batch([movie])[0])
+
+#====================================================================
+### HTTP endpoint
+#====================================================================
+
+def serve(predictor, host='127.0.0.1', port=8000):
+    """
+    Serves the predictor over HTTP: POST a movie json to /predict or a list of movies to /predict_batch
+    """
+    class PredictHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if self.path == '/predict':
+                    if not isinstance(body, dict):
+                        raise TypeError('/predict expects a movie json object')
+                    result = {'domestic_gross': predictor.predict(body)}
+                elif self.path == '/predict_batch':
+                    if not isinstance(body, list) or not all(isinstance(movie, dict) for movie in body):
+                        raise TypeError('/predict_batch expects a json list of movie objects')
+                    result = {'domestic_gross': predictor.predict_batch(body).tolist()}
+                else:
+                    self.send_error(404)
+                    return
+            except (ValueError, KeyError, TypeError) as error:
+                self.send_error(400, str(error))
+                return
+
+            data = json.dumps(result).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), PredictHandler)
+    print('Serving predictions on http://{}:{}'.format(host, port))
+    server.serve_forever()
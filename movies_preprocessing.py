@@ -9,17 +9,67 @@ import pickle
 from datetime import datetime
 
 from movies_web_scraping import imdb_scraper, thenumbers_scraper, imdbstarmeter_scraper
+from movies_artifacts import DATA_DIR, write_artifact
+from movies_index import EntityIndex
+
+MONEY_COLS = ['production_budget', 'domestic_gross', 'worldwide_gross']
+
+#====================================================================
+### Parsing scraped numbers
+#====================================================================
+
+def parse_integers(values, strip=',$'):
+    """
+    Takes in a series of scraped number strings and the characters to remove from them,
+    returns the numbers as a nullable Int64 series converted in a single pass over pyarrow strings
+    Strings that are not a number once stripped (sentinels such as 'no domestic gross' or 'Unknown') become missing
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    array = pa.Array.from_pandas(values)
+    if not pa.types.is_string(array.type) and not pa.types.is_large_string(array.type):
+        array = pc.cast(array, pa.string())
+    for char in strip:
+        array = pc.replace_substring(array, char, '')
+    array = pc.if_else(pc.utf8_is_digit(array), array, None)
+
+    integers = pc.cast(array, pa.int64()).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    return pd.Series(integers.array, index=values.index, name=values.name)
+
+def parse_money(values):
+    # '$1,234,567' -> 1234567
+    return parse_integers(values, strip=',$')
+
+def parse_rank(values):
+    # '1,234. ' -> 1234
+    return parse_integers(values, strip=',. ')
 
 #====================================================================
 ### Cleaning the scraped imdb data
 #====================================================================
 
-def clean_imdb():
+def clean_imdb(imdb_data=None):
     """
-    Takes in scraped imdb data, returns cleaned imdb data
+    Takes in scraped imdb data (scraped if not given), returns cleaned imdb data
     """
-    # read data
-    imdb_data = imdb_scraper()
+    # read data and clean one record per movie
+    imdb_data = clean_imdb_records(imdb_scraper() if imdb_data is None else imdb_data)
+
+    # explode the genre and stars features into rows
+    imdb_data = imdb_data.explode('genre').reset_index(drop=True)
+    imdb_data = imdb_data.explode('stars').reset_index(drop=True)
+
+    # remove comma from genre
+    imdb_data['genre'] = imdb_data['genre'].str.replace(',', '')
+
+    return imdb_data
+
+def clean_imdb_records(imdb_data):
+    """
+    Takes in scraped imdb data, returns cleaned imdb data with one record per movie (genre and stars still as lists)
+    """
+    imdb_data = imdb_data.copy()
 
     # clean up the year feature
     imdb_data.loc[:, 'year'] = imdb_data['year'].str[-5:-1]
@@ -46,25 +96,18 @@ def clean_imdb():
     # create a new feature as genre count
     imdb_data['genre_count'] = imdb_data.genre.str.len() 
 
-    # explode the genre and stars features into rows
-    imdb_data = imdb_data.explode('genre').reset_index(drop=True)
-    imdb_data = imdb_data.explode('stars').reset_index(drop=True)
-
-    # remove comma from genre
-    imdb_data['genre'] = imdb_data['genre'].str.replace(',', '')
-
     return imdb_data
 
 #====================================================================
 ### Cleaning the scraped numbers data
 #====================================================================
 
-def clean_thenumbers():
+def clean_thenumbers(thenumbers_data=None):
     """
-    Takes in scraped the numbers data, returns cleaned the numbers data
+    Takes in scraped the numbers data (scraped if not given), returns cleaned the numbers data
     """
     # read data
-    thenumbers_data = thenumbers_scraper()
+    thenumbers_data = thenumbers_scraper() if thenumbers_data is None else thenumbers_data.copy()
 
     # remove records with unknown release dates
     thenumbers_data = thenumbers_data[thenumbers_data.release_date.str.len() >= 11] 
@@ -72,10 +115,11 @@ def clean_thenumbers():
     # format release date
     thenumbers_data['release_date'] = pd.to_datetime(thenumbers_data['release_date'], format='%b %d, %Y')
 
-    # convert datatype of budget and gross features to numeric type
-    thenumbers_data['production_budget'] = thenumbers_data['production_budget'].str.replace(',', '').str.replace('$', '').astype(int)
-    thenumbers_data['domestic_gross'] = thenumbers_data['domestic_gross'].str.replace(',', '').str.replace('$', '').astype(int)
-    thenumbers_data['worldwide_gross'] = thenumbers_data['worldwide_gross'].str.replace(',', '').str.replace('$', '').astype(int)      
+    # convert datatype of budget and gross features to numeric type, removing records with missing amounts
+    for col in MONEY_COLS:
+        thenumbers_data[col] = parse_money(thenumbers_data[col])
+    thenumbers_data = thenumbers_data.dropna(subset=MONEY_COLS)
+    thenumbers_data = thenumbers_data.astype({col: 'int64' for col in MONEY_COLS})
 
     # create new feature as year
     thenumbers_data['year'] = thenumbers_data['release_date'].dt.year
@@ -86,40 +130,37 @@ def clean_thenumbers():
 ### Cleaning the scraped stars data
 #====================================================================
 
-def clean_stars():
+def clean_stars(star_data=None):
     """
-    Takes in scraped stars data, returns cleaned stars data
+    Takes in scraped stars data (scraped if not given), returns cleaned stars data
     """
     # read data
-    star_data = imdbstarmeter_scraper()
+    star_data = imdbstarmeter_scraper() if star_data is None else star_data.copy()
 
-    # remove period and space char in star ranking feature
-    star_data.star_ranking = star_data.star_ranking.str[:-2]
+    # convert star ranking to int, removing comma, period and space chars and stars without a ranking
+    star_data['star_ranking'] = parse_rank(star_data.star_ranking)
+    star_data = star_data.dropna(subset=['star_ranking']).astype({'star_ranking': 'int64'})
 
     # remove \n and space char in actor or actress feature
-    star_data.actor_or_actress = star_data.actor_or_actress.str.strip()
+    star_data['actor_or_actress'] = star_data.actor_or_actress.str.strip()
 
     # add a new feature called star points (representing reverse order of star ranking number)
     star_data['star_points'] = star_data.star_ranking.values[::-1]
 
-    # convert datatype of star ranking and star points to int
-    star_data['star_ranking'] = star_data.star_ranking.str.replace(',','').astype(int)
-    star_data['star_points'] = star_data.star_points.str.replace(',','').astype(int)
-
     return star_data
 
 #====================================================================
 ### Merge imdb, the numbers and stars data
 #====================================================================
 
-def merge_data():
+def merge_data(imdb_data=None, thenumbers_data=None, star_data=None):
     """
-    Takes in cleaned imdb, the numbers and stars data, returns merged data
+    Takes in cleaned imdb, the numbers and stars data (cleaned from a fresh scrape if not given), returns merged data
     """
     # read in clean datasets
-    imdb_data = clean_imdb()
-    thenumbers_data = clean_thenumbers()
-    star_data = clean_stars()
+    imdb_data = clean_imdb() if imdb_data is None else imdb_data
+    thenumbers_data = clean_thenumbers() if thenumbers_data is None else thenumbers_data
+    star_data = clean_stars() if star_data is None else star_data
 
     # merge imdb and the numbers
     merged_df = pd.merge(imdb_data, thenumbers_data, how='left', left_on=['movie', 'year'], right_on=['movie', 'year'])
@@ -131,10 +172,7 @@ def merge_data():
     merged_df = merged_df[merged_df.release_date < 'Jan 1, 2020'] 
 
     # merge with stars data
-    merged_df = pd.merge(merged_df, star_data, how='left', left_on=['stars'], right_on=['star_name'])
-
-    # if actor or actress not in top 1000 list, then default to 0 star points
-    merged_df['star_points'].fillna(0, inplace=True)
+    merged_df = join_star_rankings(merged_df, star_data)
 
     # convert datatype of budget and gross features to integer
     merged_df.production_budget = merged_df.production_budget.astype(int)
@@ -143,36 +181,73 @@ def merge_data():
 
     return merged_df
 
+def join_star_rankings(df, star_data):
+    """
+    Takes in data with a stars column and cleaned stars data, returns the data left-joined with the star rankings
+    """
+    # join on star names interned to integer ids
+    star_ids = pd.Index(star_data['star_name'].unique())
+    df = df.assign(star_id=star_ids.get_indexer(df['stars']))
+    star_data = star_data.assign(star_id=star_ids.get_indexer(star_data['star_name']))
+    df = pd.merge(df, star_data, how='left', on='star_id').drop(columns='star_id')
+
+    # if actor or actress not in top 1000 list, then default to 0 star points
+    df['star_points'] = df['star_points'].fillna(0)
+
+    return df
+
+#====================================================================
+### As-of history of previous releases
+#====================================================================
+
+def history_before(df, key, value='domestic_gross', date='release_date', weight=None):
+    """
+    Takes in a dataframe and a grouping column (e.g. stars or director), returns the mean and count of value 
+    over all rows with the same key released strictly before each row, aligned to the dataframe's index
+    An optional weight column counts each row as that many rows
+    """
+    # index each key's release history once, then look up every row by binary search
+    index = EntityIndex.build(df, key, value, date, weight)
+    prior_mean, prior_count = index.history_before(df[key], df[date])
+
+    return pd.Series(prior_mean, index=df.index), pd.Series(prior_count, index=df.index)
+
 #====================================================================
 ### Feature engineering
 #====================================================================
 
-def engineer_features():
+def engineer_features(merged_df=None):
     """
-    Takes in merged data, returns merged data with engineered features
+    Takes in merged data (merged from a fresh scrape if not given), returns merged data with engineered features
     """
     # read in merged data
-    merged_df = merge_data()
+    merged_df = merge_data() if merged_df is None else merged_df
 
     # create new features as star power and star appearances 
     merged_df_reduced = merged_df[['movie','release_date','stars','domestic_gross']].drop_duplicates()
-    merged_df_reduced['star_power'] = merged_df_reduced.apply(lambda x: merged_df_reduced[(merged_df_reduced['stars'] == x['stars'])&(merged_df_reduced['release_date'] < x['release_date'])].domestic_gross.mean(), axis=1)
-    merged_df_reduced['star_appearances'] = merged_df_reduced.apply(lambda x: merged_df_reduced[(merged_df_reduced['stars'] == x['stars'])&(merged_df_reduced['release_date'] < x['release_date'])].shape[0], axis=1)
+    merged_df_reduced['star_power'], merged_df_reduced['star_appearances'] = history_before(merged_df_reduced, 'stars')
     merged_df = merged_df.merge(merged_df_reduced)
 
     # fill missing values in star power with zeroes
-    merged_df['star_power'].fillna(0, inplace=True)
+    merged_df['star_power'] = merged_df['star_power'].fillna(0)
 
     # create a new feature as director power
     # sort values by ascending release date
     merged_df = merged_df.sort_values(by='release_date', ascending=True)
-    merged_df['director_power'] = merged_df.apply(
-        lambda x: merged_df[(merged_df.director == x.director) & (merged_df.release_date < x.release_date)].domestic_gross.mean(), axis=1)
+    merged_df['director_power'], _ = history_before(merged_df, 'director')
 
     # fill in missing values with zeroes
-    merged_df['director_power'].fillna(0, inplace=True)
+    merged_df['director_power'] = merged_df['director_power'].fillna(0)
 
     # create new features as title length and month
+    merged_df = add_release_features(merged_df)
+
+    return merged_df
+
+def add_release_features(merged_df):
+    """
+    Takes in merged data, returns it with integer budget and gross features and the title length and month features
+    """
     # convert datatype of budget and gross features to integer
     merged_df.production_budget = merged_df.production_budget.astype(int)
     merged_df.domestic_gross = merged_df.domestic_gross.astype(int)
@@ -190,20 +265,34 @@ def engineer_features():
 ### Aggregate the stars and genre data
 #====================================================================
 
-def agg_stars_genre():
+# columns identifying one row of the aggregated data per movie and genre
+MOVIE_GENRE_COLS = ['movie', 'year', 'imdb', 'metascore', 'votes', 'runtime', 'title_length',
+                    'certificate', 'genre', 'genre_count', 'director', 'release_date', 'month',
+                    'production_budget', 'domestic_gross', 'worldwide_gross',
+                    'director_power']
+
+def agg_stars_genre(merged_df=None, directory=DATA_DIR):
     """
-    Takes in merged data with engineered features, returns aggregated data on stars and genre
+    Takes in merged data with engineered features (engineered from a fresh scrape if not given), 
+    returns aggregated data on stars and genre, also written as parquet artifacts under directory
     """
     # read in merged data with engineered features
-    merged_df = engineer_features()
+    merged_df = engineer_features() if merged_df is None else merged_df
     
     # aggregate the stars data, by averaging the "star power" and "star points", and summing the "star appearances" for each movie
-    groupby_cols = ['movie', 'year', 'imdb', 'metascore', 'votes', 'runtime', 'title_length',
-                    'certificate', 'genre', 'genre_count', 'director', 'release_date', 'month',
-                    'production_budget', 'domestic_gross', 'worldwide_gross',
-                    'director_power']
-    movies_genre_df = merged_df.groupby(groupby_cols).agg({'star_power':'mean', 'star_points':'mean', 'star_appearances':'sum'}).reset_index()
+    movies_genre_df = merged_df.groupby(MOVIE_GENRE_COLS).agg({'star_power':'mean', 'star_points':'mean', 'star_appearances':'sum'}).reset_index()
 
+    # collapse genres into one row per movie and write both dataframes
+    movies_df = collapse_genres(movies_genre_df)
+    write_artifact(movies_df, 'movies_df', directory)
+    write_artifact(movies_genre_df, 'movies_genre_df', directory)
+
+    return movies_df, movies_genre_df
+
+def collapse_genres(movies_genre_df):
+    """
+    Takes in aggregated data with one row per movie and genre, returns one row per movie
+    """
     # collapse genres of movies into genre count (to get 1 row per movie)
     groupby_cols = ['movie', 'year', 'imdb', 'metascore', 'votes', 'runtime', 'title_length',
                     'certificate', 'genre_count', 'director', 'release_date', 'month',
@@ -219,6 +308,4 @@ def agg_stars_genre():
                         'director_power', 'star_power', 'star_appearances', 'star_points',
                         'worldwide_gross', 'domestic_gross']]  
 
-    # pickle dataframes for eda and modeling               
-    movies_df.to_pickle('data/movies_df.pkl')
-    movies_genre_df.to_pickle('data/movies_genre_df.pkl')
\ No newline at end of file
+    return movies_df
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+Predicting Movie Revenue --
+Model registry for the notebook's final models
+Fitted models are pickled with their feature columns and a fingerprint of the rows they were trained on, so a refresh
+on unchanged data loads the model instead of refitting it, and a refresh after movies were only added grows the random
+forest with extra trees (and warm starts the Lasso from its previous coefficients) instead of fitting from scratch
+"""
+
+import os
+import json
+import math
+import time
+import pickle
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from movies_artifacts import read_artifact
+from movies_features import COMPLETE_FEATURES, TARGET, encode_movies
+from movies_datasets import MATRIX_SOURCE_COLS
+from movies_experiments import MODEL_TRANSFORMS, make_model, make_transforms
+import movies_metrics
+
+REGISTRY_DIR = 'data/models'
+
+# model: parameters of the final fit on the complete feature set, as in the modeling notebook
+FINAL_MODELS = {
+    'random_forest': {'n_estimators': 1800, 'max_features': 3},
+    'lasso': {'alpha': 100},
+    'ridge': {'alpha': 1},
+}
+
+# model: how it takes in added rows without a full fit, 'grow' adds trees fitted on the updated rows and keeps
+# the existing ones, 'init' refits starting from the previous coefficients; other models are fitted from scratch
+WARM_STARTS = {'random_forest': 'grow', 'lasso': 'init'}
+
+# a forest grown past this many times its configured trees is fitted from scratch, so old trees do not dominate
+MAX_GROWTH = 2
+
+#====================================================================
+### Training data fingerprints
+#====================================================================
+
+def row_hashes(X, y):
+    """
+    Takes in training features (dataframe) and target, returns the sorted 64-bit hashes of their rows,
+    so the same rows in any order have the same hashes
+    """
+    rows = pd.DataFrame(X.to_numpy(dtype=float)).assign(target=np.asarray(y, dtype=float))
+    return np.sort(pd.util.hash_pandas_object(rows, index=False).to_numpy())
+
+def data_fingerprint(model, params, features, hashes):
+    """
+    Takes in a model name, its parameters, the feature columns and the training row hashes,
+    returns a hash of all of them
+    """
+    digest = hashlib.sha256(json.dumps([model, params, features], sort_keys=True).encode())
+    digest.update(hashes.tobytes())
+    return digest.hexdigest()
+
+def added_rows(previous, current):
+    """
+    Takes in the row hashes a model was fitted on and those of the updated training data, returns the number
+    of rows added, or None if any of the previous rows is gone (changed or removed)
+    """
+    previous, previous_counts = np.unique(previous, return_counts=True)
+    current, current_counts = np.unique(current, return_counts=True)
+    positions = np.searchsorted(current, previous)
+    if (positions >= len(current)).any():
+        return None
+    if (current[positions] != previous).any() or (current_counts[positions] < previous_counts).any():
+        return None
+    return int(current_counts.sum() - previous_counts.sum())
+
+#====================================================================
+### Fitting
+#====================================================================
+
+def make_estimator(model, params):
+    # the model behind its transforms as a pipeline, or the bare model without transforms (as the prediction
+    # service expects the random forest)
+    from sklearn.pipeline import make_pipeline
+
+    steps = make_transforms(MODEL_TRANSFORMS[model]) + [make_model(model, params)]
+    return steps[0] if len(steps) == 1 else make_pipeline(*steps)
+
+def final_step(estimator):
+    return estimator.steps[-1][1] if hasattr(estimator, 'steps') else estimator
+
+def warm_start(estimator, model, params, X, y, added):
+    """
+    Takes in a fitted estimator, its model name and parameters, the updated training data and the number of rows
+    added since the fit, returns the estimator refitted by growing or warm starting it, or None if it has to be
+    fitted from scratch
+    """
+    final = final_step(estimator)
+    if WARM_STARTS[model] == 'grow':
+        # extra trees in proportion to the added rows, each fitted on a bootstrap of all rows
+        base = params.get('n_estimators', 100)
+        n_estimators = len(final.estimators_) + max(1, math.ceil(base * added / len(y)))
+        if n_estimators > MAX_GROWTH * base:
+            return None
+        final.set_params(warm_start=True, n_estimators=n_estimators)
+    else:
+        final.set_params(warm_start=True)
+
+    estimator.fit(X, y)
+    final.set_params(warm_start=False)
+    return estimator
+
+#====================================================================
+### Model registry
+#====================================================================
+
+class ModelRegistry:
+    """
+    Fitted models under a directory, one pickle per name with the model, its feature columns and training row hashes
+    (readable by MoviePredictor as a model path) and a json record of its parameters and data fingerprint
+    """
+    def __init__(self, directory=REGISTRY_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.pkl')
+
+    def meta_path(self, name):
+        return os.path.join(self.directory, name + '.json')
+
+    def meta(self, name):
+        try:
+            with open(self.meta_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, name):
+        """
+        Takes in a model name, returns its registry entry (model, features and hashes)
+        """
+        with open(self.path(name), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, name, entry, meta):
+        # the json record is written last, so it never describes a partially written pickle
+        with open(self.path(name), 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.meta_path(name), 'w') as f:
+            json.dump(meta, f)
+
+    def fit(self, model, params, X, y, name=None):
+        """
+        Takes in a model name (see MODEL_TRANSFORMS), its parameters and the training features (dataframe) and target,
+        returns the fitted estimator registered under name (the model name if not given) and how it was obtained:
+        'cached' when it was registered for the same parameters, features and rows, 'warm_start' when all the rows it
+        was fitted on are still there and rows were only added, 'fit' otherwise
+        """
+        name = model if name is None else name
+        features = list(X.columns)
+        hashes = row_hashes(X, y)
+        fingerprint = data_fingerprint(model, params, features, hashes)
+        meta = self.meta(name)
+        start = time.perf_counter()
+
+        registered = meta is not None and os.path.exists(self.path(name))
+        if registered and meta['fingerprint'] == fingerprint:
+            movies_metrics.emit('model_cached', model=name)
+            return self.load(name)['model'], 'cached'
+
+        estimator, how = None, 'fit'
+        if registered and model in WARM_STARTS and (meta['model'], meta['params'], meta['features']) == \
+                (model, params, features):
+            entry = self.load(name)
+            added = added_rows(entry['hashes'], hashes)
+            if added is not None:
+                estimator = warm_start(entry['model'], model, params, X, y, added)
+                how = 'warm_start'
+        if estimator is None:
+            estimator, how = make_estimator(model, params).fit(X, y), 'fit'
+
+        seconds = time.perf_counter() - start
+        meta = {'model': model, 'params': params, 'features': features, 'fingerprint': fingerprint, 'rows': len(hashes),
+                'fit': how, 'seconds': seconds, 'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        if hasattr(final_step(estimator), 'estimators_'):
+            meta['n_estimators'] = len(final_step(estimator).estimators_)
+        self.save(name, {'model': estimator, 'features': features, 'hashes': hashes}, meta)
+        movies_metrics.emit('model_fit', model=name, fit=how, rows=len(hashes), seconds=seconds)
+
+        return estimator, how
+
+#====================================================================
+### Refreshing the final models
+#====================================================================
+
+def refresh_models(movies_genre_df=None, models=FINAL_MODELS, registry=None):
+    """
+    Takes in the movies data with one row per genre (the movies_genre_df artifact if not given) and the final models'
+    parameters, fits or refreshes each model on the complete feature set through the registry,
+    returns {model: (estimator, how it was obtained)}
+    """
+    registry = ModelRegistry() if registry is None else registry
+    if movies_genre_df is None:
+        movies_genre_df = read_artifact('movies_genre_df', MATRIX_SOURCE_COLS)
+    movies_matrix = encode_movies(movies_genre_df)
+    X, y = movies_matrix[COMPLETE_FEATURES], movies_matrix[TARGET]
+
+    results = {}
+    for model, params in models.items():
+        results[model] = registry.fit(model, params, X, y)
+        print('{}: {} on {} movies'.format(model, results[model][1], len(y)))
+    return results
@@ -0,0 +1,98 @@
+"""
+Predicting Movie Revenue --
+Batch what-if scoring for release planning
+Scores a slate of movies across a grid of release months, certificates, alternative leads, directors or budgets,
+building the whole grid's feature matrix as one vectorized block and scoring it with a single model call
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from movies_features import CERTIFICATES, encode_inputs
+
+# every level a planner can pick, including the notebook's reference levels dropped from the dummies
+RELEASE_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+RELEASE_CERTIFICATES = ['G'] + CERTIFICATES
+
+# scenario axes set straight on a feature column, besides month, certificate, lead and director
+NUMERIC_AXES = ['production_budget', 'runtime', 'year']
+
+#====================================================================
+### Scenario grid
+#====================================================================
+
+def scenario_grid(**axes):
+    """
+    Takes in axes as lists of values, e.g. month=RELEASE_MONTHS, certificate=['PG-13', 'R'], lead=['Star A', ...],
+    returns a dataframe with one row per combination (the cartesian product of the axes)
+    """
+    names = list(axes)
+    return pd.DataFrame(list(itertools.product(*(axes[name] for name in names))), columns=names)
+
+def cast_history(predictor, stars):
+    # per star: mean gross, appearances and star points, 0 for stars without history or ranking
+    history = [predictor.stars.get(star, (0.0, 0)) for star in stars]
+    return (np.array([mean for mean, _ in history], dtype=float),
+            np.array([count for _, count in history], dtype=float),
+            np.array([predictor.star_points.get(star, 0.0) for star in stars], dtype=float))
+
+def scenario_features(predictor, movies, grid):
+    """
+    Takes in a MoviePredictor, a list of base movie dicts and a scenario grid, returns the model inputs of every
+    (movie, scenario) pair, movies major, as a dataframe ready for encode_inputs
+    Each base movie's features are computed once, grid axes then overwrite their columns for all rows at once;
+    a lead replaces the first star of the cast (or becomes the cast of a movie without stars)
+    """
+    n_movies, n_grid = len(movies), len(grid)
+    base = pd.DataFrame([predictor.movie_features(movie) for movie in movies])
+    features = base.loc[base.index.repeat(n_grid)].reset_index(drop=True)
+
+    for axis in grid.columns:
+        values = np.tile(grid[axis].to_numpy(), n_movies)
+        if axis in ('month', 'certificate') or axis in NUMERIC_AXES:
+            features[axis] = values
+        elif axis == 'director':
+            director_power = [predictor.directors.get(name, 0.0) for name in grid[axis]]
+            features['director_power'] = np.tile(director_power, n_movies)
+        elif axis == 'lead':
+            # the rest of each cast is summed once per movie, the leads are looked up once per grid value
+            casts = [movie.get('stars') or [] for movie in movies]
+            rest = np.array([[column.sum() for column in cast_history(predictor, cast[1:])] for cast in casts],
+                            dtype=float).reshape(n_movies, 3)
+            size = np.repeat([max(len(cast), 1) for cast in casts], n_grid)
+            lead_mean, lead_count, lead_points = (np.tile(column, n_movies)
+                                                  for column in cast_history(predictor, grid[axis]))
+            features['star_power'] = (np.repeat(rest[:, 0], n_grid) + lead_mean) / size
+            features['star_appearances'] = np.repeat(rest[:, 1], n_grid) + lead_count
+            features['star_points'] = (np.repeat(rest[:, 2], n_grid) + lead_points) / size
+        else:
+            raise ValueError('Unknown scenario axis: {}'.format(axis))
+
+    return features
+
+#====================================================================
+### Scoring
+#====================================================================
+
+def score_scenarios(predictor, movies, grid):
+    """
+    Takes in a MoviePredictor, a slate of base movie dicts and a scenario grid (see scenario_grid),
+    returns one row per (movie, scenario) with the axis values, the predicted domestic gross, the base movie's
+    predicted gross and the change from it
+    Base movies and every scenario are encoded as one feature block and scored in a single model call
+    """
+    movies = list(movies)
+    features = scenario_features(predictor, movies, grid)
+    base = pd.DataFrame([predictor.movie_features(movie) for movie in movies])
+    predictions = predictor.predict_matrix(encode_inputs(pd.concat([features, base], ignore_index=True)))
+
+    n_grid = len(grid)
+    base_gross = predictions[len(features):]
+    results = pd.concat([pd.DataFrame({'movie': np.repeat([movie.get('movie', '') for movie in movies], n_grid)}),
+                         pd.concat([grid] * len(movies), ignore_index=True)], axis=1)
+    results['domestic_gross'] = predictions[:len(features)]
+    results['base_gross'] = np.repeat(base_gross, n_grid)
+    results['change'] = results['domestic_gross'] - results['base_gross']
+    return results
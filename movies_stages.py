@@ -0,0 +1,276 @@
+"""
+Predicting Movie Revenue --
+Stage cache for the scraping and preprocessing chain
+Each stage's output is persisted with a fingerprint of its code and inputs, so downstream stages load
+upstream artifacts instead of re-running them
+Stage functions are named rather than imported, so checking a cached stage never imports the scraping and
+preprocessing modules
+"""
+
+import os
+import ast
+import json
+import pickle
+import hashlib
+import importlib
+import importlib.util
+from functools import lru_cache
+
+import movies_metrics
+
+STAGE_DIR = 'data/stages'
+
+#====================================================================
+### Stage graph
+#====================================================================
+
+# stage name: ('module.function', upstream stages passed in as positional arguments)
+# imdb data is carried as normalized movie tables from cleaning to aggregation,
+# the numbers rows are matched to imdb titles before the exact (movie, year) merge
+STAGES = {
+    'scrape_imdb': ('movies_web_scraping.imdb_scraper', []),
+    'scrape_thenumbers': ('movies_web_scraping.thenumbers_scraper', []),
+    'scrape_stars': ('movies_web_scraping.imdbstarmeter_scraper', []),
+    'clean_imdb': ('movies_tables.normalize_imdb', ['scrape_imdb']),
+    'clean_thenumbers': ('movies_preprocessing.clean_thenumbers', ['scrape_thenumbers']),
+    'clean_stars': ('movies_preprocessing.clean_stars', ['scrape_stars']),
+    'match_titles': ('movies_matching.align_thenumbers', ['clean_imdb', 'clean_thenumbers']),
+    'merge': ('movies_tables.merge_tables', ['clean_imdb', 'match_titles', 'clean_stars']),
+    'features': ('movies_tables.engineer_table_features', ['merge']),
+    'aggregate': ('movies_tables.agg_tables', ['features']),
+    'feature_state': ('movies_history.build_feature_state', ['merge']),
+}
+
+# stage name: the code it is versioned on in place of its function's module and imports, as 'module' or
+# 'module.name' (a top-level function or assignment); scrapes are versioned on the pages they fetch and how those
+# are parsed, so changes to fetching, caching, checkpoints or metrics never trigger a re-scrape
+SCRAPE_CODE = ['movies_parsing', 'movies_web_scraping.IMDB_URL', 'movies_web_scraping.THENUMBERS_URL']
+STAGE_CODE = {
+    'scrape_imdb': SCRAPE_CODE + ['movies_web_scraping.' + name for name in
+                                  ('FIRST_YEAR', 'LAST_YEAR', 'IMDB_COLUMNS', 'imdb_page', 'imdb_pages',
+                                   'parse_imdb_page')],
+    'scrape_thenumbers': SCRAPE_CODE + ['movies_web_scraping.' + name for name in
+                                        ('THENUMBERS_COLUMNS', 'thenumbers_page', 'thenumbers_pages',
+                                         'parse_thenumbers_page')],
+    'scrape_stars': SCRAPE_CODE + ['movies_web_scraping.' + name for name in
+                                   ('STARMETER_COLUMNS', 'imdbstarmeter_pages', 'parse_imdbstarmeter_page')],
+}
+
+# modules left out of the fingerprints of the stages importing them: fetching, response caching, checkpoints and
+# instrumentation never change a stage's output, and the scrapers and parsers only reach later stages through
+# the scrape artifacts, whose digests are already part of their fingerprints
+UNVERSIONED_MODULES = {'movies_fetch', 'movies_cache', 'movies_checkpoint', 'movies_metrics', 'movies_web_scraping',
+                       'movies_parsing'}
+
+@lru_cache(maxsize=None)
+def module_path(module):
+    # source file of a module, found without importing it (None for modules outside this project)
+    spec = importlib.util.find_spec(module)
+    origin = getattr(spec, 'origin', None)
+    project = os.path.dirname(os.path.abspath(__file__))
+    if origin is None or not origin.endswith('.py') or os.path.dirname(os.path.abspath(origin)) != project:
+        return None
+    return origin
+
+def parse_module(module):
+    # source and syntax tree of a project module
+    path = module_path(module)
+    return parse_file(path, os.path.getmtime(path))
+
+@lru_cache(maxsize=None)
+def parse_file(path, mtime):
+    # parsed once per modification time
+    with open(path, 'rb') as f:
+        source = f.read()
+    return source, ast.parse(source, path)
+
+def top_level_imports(tree):
+    """
+    Takes in a module's syntax tree, yields the top-level names of the modules it imports at module level
+    (including under a module-level if or try), skipping the imports inside functions
+    """
+    nodes = list(tree.body)
+    while nodes:
+        node = nodes.pop(0)
+        if isinstance(node, ast.Import):
+            yield from (alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            yield node.module.split('.')[0]
+        elif isinstance(node, (ast.If, ast.Try)):
+            nodes += node.body + node.orelse + getattr(node, 'finalbody', []) + \
+                [child for handler in getattr(node, 'handlers', []) for child in handler.body]
+
+def project_modules(module):
+    """
+    Takes in a project module name, returns the sorted names of it and every project module it imports at
+    module level, directly or through other project modules, found by parsing their source without importing them
+    """
+    found, pending = set(), [module]
+    while pending:
+        name = pending.pop()
+        if name in found or name in UNVERSIONED_MODULES or module_path(name) is None:
+            continue
+        found.add(name)
+        pending += top_level_imports(parse_module(name)[1])
+    return sorted(found)
+
+def definition_source(module, name):
+    """
+    Takes in a project module and the name of a top-level function, class or assignment in it, returns its source
+    """
+    source, tree = parse_module(module)
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names = [node.name]
+        elif isinstance(node, ast.Assign):
+            names = [target.id for target in node.targets if isinstance(target, ast.Name)]
+        else:
+            continue
+        if name in names:
+            return ast.get_source_segment(source.decode('utf-8'), node).encode()
+    raise KeyError('{} is not defined at the top level of {}'.format(name, module))
+
+def code_version(func, code=None):
+    """
+    Takes in a stage function name ('module.function'), returns a hash of the source of the module defining it
+    and of every project module it imports, read from their files without importing them
+    With code (see STAGE_CODE), hashes the source of those modules and top-level definitions instead
+    """
+    if code is None:
+        code = project_modules(func.rsplit('.', 1)[0])
+    digest = hashlib.sha256()
+    for item in code:
+        if '.' not in item:
+            source = parse_module(item)[0]
+        else:
+            source = definition_source(*item.rsplit('.', 1))
+        digest.update(item.encode() + b'\0' + hashlib.sha256(source).digest())
+    return digest.hexdigest()
+
+def stage_function(func):
+    """
+    Takes in a stage function name ('module.function'), returns the function, importing its module
+    """
+    module, name = func.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+#====================================================================
+### Stage cache
+#====================================================================
+
+class StageCache:
+    """
+    Persists stage outputs under a directory as pickles with a json record of their fingerprint and content digest
+    """
+    def __init__(self, directory=STAGE_DIR, stages=STAGES):
+        self.directory = directory
+        self.stages = stages
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.pkl')
+
+    def meta_path(self, name):
+        return os.path.join(self.directory, name + '.json')
+
+    def meta(self, name):
+        try:
+            with open(self.meta_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, name):
+        with open(self.path(name), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, name, output, fingerprint):
+        """
+        Takes in a stage name, its output and fingerprint, persists both and returns the output's digest
+        """
+        data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha256(data).hexdigest()
+        with open(self.path(name), 'wb') as f:
+            f.write(data)
+        with open(self.meta_path(name), 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'digest': digest}, f)
+        return digest
+
+    def fingerprint(self, name, digests=()):
+        """
+        Takes in a stage name and the digests of its inputs, returns a hash of the stage's code and inputs
+        """
+        func, _ = self.stages[name]
+        return hashlib.sha256(json.dumps([code_version(func, STAGE_CODE.get(name))] + list(digests)).encode()).hexdigest()
+
+    def exists(self, name):
+        return self.meta(name) is not None and os.path.exists(self.path(name))
+
+    def update(self, name, output):
+        """
+        Takes in the name of a stage without inputs (a scrape) and a new output for it,
+        stores it as the stage's current artifact so downstream stages rebuild from it
+        """
+        return self.save(name, output, self.fingerprint(name))
+
+    def build(self, name, force=(), built=None):
+        """
+        Takes in a stage name, makes sure its artifact is current (building upstream stages first) and returns its digest
+        Stages in force are recomputed even if their fingerprint matches
+        """
+        built = {} if built is None else built
+        if name in built:
+            return built[name]
+
+        _, inputs = self.stages[name]
+        digests = [self.build(upstream, force, built) for upstream in inputs]
+        fingerprint = self.fingerprint(name, digests)
+        meta = self.meta(name)
+        if name not in force and self.exists(name) and meta['fingerprint'] == fingerprint:
+            movies_metrics.emit('stage_cached', stage=name)
+            built[name] = meta['digest']
+            return built[name]
+
+        built[name] = self.execute(name, fingerprint)
+        return built[name]
+
+    def execute(self, name, fingerprint):
+        """
+        Takes in a stage name and its fingerprint, runs the stage on its upstream artifacts and returns the digest
+        of the persisted output
+        """
+        func, inputs = self.stages[name]
+        print('Running stage:', name)
+        inputs = [self.load(upstream) for upstream in inputs]
+        with movies_metrics.stage(name, inputs) as result:
+            result['output'] = output = stage_function(func)(*inputs)
+        return self.save(name, output, fingerprint)
+
+    def run_only(self, name):
+        """
+        Takes in a stage name, reruns exactly that stage on the existing artifacts of its upstream stages
+        (current or not, without rebuilding them) and returns its output
+        """
+        _, inputs = self.stages[name]
+        missing = [upstream for upstream in inputs if not self.exists(upstream)]
+        if missing:
+            raise FileNotFoundError('Stage {} needs the artifacts of: {}'.format(name, ', '.join(missing)))
+
+        self.execute(name, self.fingerprint(name, [self.meta(upstream)['digest'] for upstream in inputs]))
+        return self.load(name)
+
+    def run(self, name, force=()):
+        """
+        Takes in a stage name, returns its output, recomputing only stages that are stale or forced
+        """
+        self.build(name, force)
+        return self.load(name)
+
+def run_stage(name, invalidate=(), only=False):
+    """
+    Takes in a stage name and stages to force-invalidate, returns the stage's output
+    With only, just that stage is rerun on the existing upstream artifacts
+    """
+    if only:
+        return StageCache().run_only(name)
+    return StageCache().run(name, force=set(invalidate))
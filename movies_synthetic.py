@@ -0,0 +1,185 @@
+"""
+Predicting Movie Revenue --
+Synthetic scraped data for benchmarks
+Generates imdb, the-numbers and star ranking data shaped like the scrapers' output at any number of movies,
+and the html pages they would be scraped from, so the pipeline can be timed and profiled without hitting the sites
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from movies_features import GENRES
+
+# benchmark sizes, in imdb movies
+SIZES = {'3k': 3000, '30k': 30000, '300k': 300000}
+
+CERTIFICATES = ['G', 'PG', 'PG-13', 'R', 'NC-17', 'Not Rated', 'not rated', 'Unrated', 'TV-14', 'TV-MA', 'Approved']
+CERTIFICATE_WEIGHTS = [0.04, 0.14, 0.28, 0.38, 0.01, 0.03, 0.03, 0.03, 0.02, 0.02, 0.02]
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+#====================================================================
+### Synthetic scrapes
+#====================================================================
+
+def money(values):
+    return ['${:,}'.format(value) for value in values]
+
+def synthetic_imdb(n_movies, rng, first_year=1990, last_year=2020):
+    """
+    Takes in a number of movies and a numpy random generator, returns imdb data as returned by imdb_scraper
+    """
+    years = rng.integers(first_year, last_year + 1, n_movies)
+    n_stars = max(n_movies // 5, 10)
+    n_directors = max(n_movies // 4, 10)
+
+    # popular stars and directors appear in many movies
+    star_ids = np.minimum(rng.zipf(1.6, (n_movies, 4)) - 1, n_stars - 1)
+    director_ids = np.minimum(rng.zipf(1.8, n_movies) - 1, n_directors - 1)
+    cast_sizes = rng.choice([0, 1, 2, 3, 4], n_movies, p=[0.01, 0.02, 0.05, 0.12, 0.80])
+    genre_counts = rng.choice([1, 2, 3], n_movies, p=[0.2, 0.35, 0.45])
+    metascores = rng.integers(20, 100, n_movies)
+
+    records = []
+    for i in range(n_movies):
+        genres = [str(genre) for genre in rng.choice(GENRES, genre_counts[i], replace=False)]
+        records.append(('Movie {}'.format(i),
+                        '({})'.format(years[i]),
+                        round(float(rng.uniform(3, 9)), 1),
+                        int(metascores[i]) if metascores[i] >= 28 else 'no metascore',
+                        int(rng.integers(100, 2000000)),
+                        '{} min'.format(rng.integers(75, 180)),
+                        str(rng.choice(CERTIFICATES, p=CERTIFICATE_WEIGHTS)),
+                        [genre + ',' for genre in genres[:-1]] + genres[-1:],
+                        'Director {}'.format(director_ids[i]),
+                        ['Star {}'.format(star) for star in dict.fromkeys(star_ids[i, :cast_sizes[i]])]))
+
+    return pd.DataFrame(records, columns=['movie', 'year', 'imdb', 'metascore', 'votes', 'runtime',
+                                          'certificate', 'genre', 'director', 'stars'])
+
+def synthetic_thenumbers(imdb_data, rng, coverage=0.85):
+    """
+    Takes in synthetic imdb data and a numpy random generator, returns the-numbers data as returned by
+    thenumbers_scraper, with budgets for a share of the imdb movies
+    """
+    movies = imdb_data.sample(frac=coverage, random_state=rng.integers(2 ** 31))
+    years = movies['year'].str[1:5].to_numpy()
+    months = rng.choice(MONTHS, len(movies))
+    days = rng.integers(1, 29, len(movies))
+    release_dates = ['{} {}, {}'.format(month, day, year) for month, day, year in zip(months, days, years)]
+
+    # a few release dates are unknown, as on the site
+    unknown = rng.random(len(movies)) < 0.02
+    release_dates = np.where(unknown, 'Unknown', release_dates)
+
+    budgets = (rng.lognormal(16.5, 1.2, len(movies)) // 1000 * 1000).astype(np.int64) + 100000
+    domestic = (budgets * rng.lognormal(0, 1, len(movies))).astype(np.int64)
+    worldwide = domestic + (domestic * rng.uniform(0, 2, len(movies))).astype(np.int64)
+
+    return pd.DataFrame({'movie': movies['movie'].to_numpy(),
+                         'release_date': release_dates,
+                         'production_budget': money(budgets),
+                         'domestic_gross': money(domestic),
+                         'worldwide_gross': money(worldwide)})
+
+def synthetic_stars(n_ranked=1000):
+    """
+    Takes in a number of ranked stars, returns the star ranking as returned by imdbstarmeter_scraper
+    """
+    ranks = np.arange(1, n_ranked + 1)
+    return pd.DataFrame({'star_name': ['Star {}'.format(rank - 1) for rank in ranks],
+                         'star_ranking': ['{:,}. '.format(rank) for rank in ranks],
+                         'actor_or_actress': np.where(ranks % 2 == 0, '\n    Actor\n    ', '\n    Actress\n    ')})
+
+def synthetic_scrape(n_movies, seed=0):
+    """
+    Takes in a number of movies and a seed, returns synthetic (imdb_data, thenumbers_data, star_data)
+    """
+    rng = np.random.default_rng(seed)
+    imdb_data = synthetic_imdb(n_movies, rng)
+    thenumbers_data = synthetic_thenumbers(imdb_data, rng)
+    return imdb_data, thenumbers_data, synthetic_stars()
+
+#====================================================================
+### Synthetic pages
+#====================================================================
+
+IMDB_ITEM = '''<div class="lister-item mode-advanced"><div class="lister-item-content">
+<h3 class="lister-item-header"><span class="lister-item-index unbold text-primary">{index}.</span>
+<a href="/title/tt{index:07d}/">{movie}</a> <span class="lister-item-year text-muted unbold">{year}</span></h3>
+<p class="text-muted "><span class="certificate">{certificate}</span> <span class="ghost">|</span>
+<span class="runtime">{runtime}</span> <span class="ghost">|</span> <span class="genre">
+{genre}            </span></p>
+<div class="ratings-bar"><div class="inline-block ratings-imdb-rating"><strong>{imdb:.1f}</strong></div>{metascore}</div>
+<p class="">Director: <a href="/name/d/">{director}</a>{stars}</p>
+<p class="sort-num_votes-visible"><span class="text-muted">Votes:</span> <span name="nv" data-value="{votes}">{votes:,}</span></p>
+</div></div>
+'''
+
+IMDB_METASCORE = '<div class="inline-block ratings-metascore"><span class="metascore favorable">{}        </span> Metascore</div>'
+
+THENUMBERS_ROW = ('<tr><td class="data">{index}</td><td><a href="/box-office-chart/daily">{release_date}</a></td>'
+                  '<td><b><a href="/movie/budgets">{movie}</a></b></td><td class="data">{production_budget}</td>'
+                  '<td class="data">{domestic_gross}</td><td class="data">{worldwide_gross}</td></tr>\n')
+
+STARMETER_ITEM = '''<div class="lister-item mode-detail"><div class="lister-item-image"><a href="/name/n/">
+<img alt="{star_name}" height="209" src="star.jpg" width="140"></a></div><div class="lister-item-content">
+<h3 class="lister-item-header"><span class="lister-item-index unbold text-primary">{star_ranking}</span>
+<a href="/name/n/"> {star_name}</a></h3><p class="text-muted text-small">{actor_or_actress}<span class="ghost">|</span>
+<a href="/title/t/">Movie</a></p></div></div>
+'''
+
+def page(body):
+    return '<!DOCTYPE html>\n<html><head><title>synthetic</title></head><body>\n' + body + '</body></html>\n'
+
+def imdb_page_html(imdb_data, first_index=1):
+    """
+    Takes in rows of synthetic imdb data, returns an IMDB search page listing them
+    """
+    items = []
+    for index, row in enumerate(imdb_data.itertuples(index=False), first_index):
+        metascore = '' if row.metascore == 'no metascore' else IMDB_METASCORE.format(row.metascore)
+        stars = ' <span class="ghost">|</span> Stars: ' + ', '.join('<a href="/name/s/">{}</a>'.format(star)
+                                                                    for star in row.stars) if row.stars else ''
+        items.append(IMDB_ITEM.format(index=index, movie=row.movie, year=row.year, certificate=row.certificate,
+                                      runtime=row.runtime, genre=' '.join(row.genre), imdb=row.imdb,
+                                      metascore=metascore, director=row.director, stars=stars, votes=row.votes))
+    return page(''.join(items))
+
+def thenumbers_page_html(thenumbers_data, first_index=1):
+    """
+    Takes in rows of synthetic the-numbers data, returns a the-numbers budget page listing them
+    """
+    header = '<tr><th>&nbsp;</th><th>Release Date</th><th>Movie</th><th>Production Budget</th>' \
+             '<th>Domestic Gross</th><th>Worldwide Gross</th></tr>\n'
+    rows = [THENUMBERS_ROW.format(index=index, **row._asdict())
+            for index, row in enumerate(thenumbers_data.itertuples(index=False), first_index)]
+    return page('<table>\n' + header + ''.join(rows) + '</table>\n')
+
+def starmeter_page_html(star_data):
+    """
+    Takes in rows of synthetic star ranking data, returns an IMDB starmeter page listing them
+    """
+    return page(''.join(STARMETER_ITEM.format(**row._asdict()) for row in star_data.itertuples(index=False)))
+
+def write_pages(directory, imdb_data, thenumbers_data, star_data):
+    """
+    Takes in a directory and synthetic scraped data, writes the pages the sites would serve for it
+    (50 imdb movies, 100 the-numbers movies and 50 stars per page) and returns the page paths per source
+    """
+    sources = {'imdb': (imdb_data, 50, imdb_page_html),
+               'thenumbers': (thenumbers_data, 100, thenumbers_page_html),
+               'imdbstarmeter': (star_data, 50, lambda rows, first_index: starmeter_page_html(rows))}
+
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for source, (data, page_size, render) in sources.items():
+        paths[source] = []
+        for number, first_row in enumerate(range(0, len(data), page_size), 1):
+            path = os.path.join(directory, '{}_{:05d}.html'.format(source, number))
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(render(data.iloc[first_row:first_row + page_size], first_row + 1))
+            paths[source].append(path)
+
+    return paths
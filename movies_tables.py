@@ -0,0 +1,255 @@
+"""
+Predicting Movie Revenue --
+Normalized movie tables for the preprocessing pipeline
+Movies are kept one row each under an integer movie id, with their genres and stars in movie-genre and
+movie-star bridge tables, so the genre x star rows of clean_imdb and merge_data are never built
+"""
+
+import time
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from movies_web_scraping import imdb_scraper
+from movies_artifacts import DATA_DIR, write_artifact
+from movies_preprocessing import (clean_imdb_records, clean_thenumbers, clean_stars, join_star_rankings,
+                                  history_before, add_release_features, collapse_genres, MOVIE_GENRE_COLS)
+
+# column order of merge_data's output, restored by MovieTables.to_frame
+MERGED_COLUMNS = ['movie', 'year', 'imdb', 'metascore', 'votes', 'runtime', 'certificate', 'genre', 'director',
+                  'stars', 'genre_count', 'release_date', 'production_budget', 'domestic_gross', 'worldwide_gross',
+                  'star_name', 'star_ranking', 'actor_or_actress', 'star_points']
+
+CATEGORICAL_COLS = ['certificate', 'director', 'genre', 'stars']
+
+#====================================================================
+### Movie, genre and star tables
+#====================================================================
+
+def categorize(df):
+    """
+    Takes in a dataframe, returns it with the repeated string columns stored as categoricals
+    """
+    return df.astype({col: 'category' for col in CATEGORICAL_COLS if col in df.columns})
+
+def decategorize(df):
+    """
+    Takes in a dataframe, returns it with categorical columns converted back to their categories' dtype
+    """
+    return df.astype({col: df[col].cat.categories.dtype for col in df.columns
+                      if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+class MovieTables:
+    """
+    One row per movie (movie_id is the row position) with movie-genre and movie-star bridge tables
+    A movie without genres or stars has one bridge row with a missing value, as exploding an empty list gives
+    """
+    def __init__(self, movies, genres, stars):
+        self.movies = movies  # movie_id and one column per movie feature
+        self.genres = genres  # movie_id, genre
+        self.stars = stars    # movie_id, stars and the per movie and star columns
+
+    def __len__(self):
+        return len(self.movies)
+
+    def memory_usage(self):
+        """
+        Returns the bytes held by the three tables
+        """
+        return sum(int(table.memory_usage(deep=True).sum()) for table in (self.movies, self.genres, self.stars))
+
+    def to_frame(self):
+        """
+        Returns the wide data with one row per movie, genre and star, with the columns of merge_data
+        (and of engineer_features once features are added)
+        """
+        frame = self.movies.merge(self.genres, on='movie_id').merge(self.stars, on='movie_id').drop(columns='movie_id')
+        order = [col for col in MERGED_COLUMNS if col in frame.columns]
+        return decategorize(frame[order + [col for col in frame.columns if col not in order]])
+
+def rekey(bridge, record_ids):
+    """
+    Takes in a bridge table and the old movie id of every new movie, returns the bridge table keyed on the new ids
+    """
+    new_ids = pd.DataFrame({'movie_id': np.arange(len(record_ids), dtype=np.int32), 'record_id': record_ids})
+    return new_ids.merge(bridge.rename(columns={'movie_id': 'record_id'}), on='record_id').drop(columns='record_id')
+
+#====================================================================
+### Normalized pipeline
+#====================================================================
+
+def normalize_imdb(imdb_data=None):
+    """
+    Takes in scraped imdb data (scraped if not given), returns cleaned imdb data as movie tables
+    """
+    # read data and clean one record per movie
+    records = clean_imdb_records(imdb_scraper() if imdb_data is None else imdb_data).reset_index(drop=True)
+    movie_ids = np.arange(len(records), dtype=np.int32)
+
+    # one bridge row per listed genre and star
+    genres = records['genre'].explode()
+    genres = pd.DataFrame({'movie_id': genres.index.to_numpy(dtype=np.int32), 'genre': genres.str.replace(',', '').to_numpy()})
+    stars = records['stars'].explode()
+    stars = pd.DataFrame({'movie_id': stars.index.to_numpy(dtype=np.int32), 'stars': stars.to_numpy()})
+
+    movies = records.drop(columns=['genre', 'stars'])
+    movies.insert(0, 'movie_id', movie_ids)
+
+    return MovieTables(categorize(movies), categorize(genres), categorize(stars))
+
+def merge_tables(movie_tables=None, thenumbers_data=None, star_data=None):
+    """
+    Takes in imdb movie tables, cleaned the numbers and stars data (cleaned from a fresh scrape if not given),
+    returns merged movie tables, as merge_data does for the wide data
+    """
+    # read in clean datasets
+    movie_tables = normalize_imdb() if movie_tables is None else movie_tables
+    thenumbers_data = clean_thenumbers() if thenumbers_data is None else thenumbers_data
+    star_data = clean_stars() if star_data is None else star_data
+
+    # merge imdb and the numbers, drop movies without a release date or released from 2020 on
+    movies = pd.merge(movie_tables.movies, thenumbers_data, how='left', on=['movie', 'year'])
+    movies = movies.dropna(subset=['release_date'])
+    movies = movies[movies.release_date < 'Jan 1, 2020']
+
+    # a movie matching several the numbers rows becomes several movies, renumber them and their bridge rows
+    record_ids = movies['movie_id'].to_numpy()
+    movies = movies.assign(movie_id=np.arange(len(movies), dtype=np.int32)).reset_index(drop=True)
+    genres = rekey(movie_tables.genres, record_ids)
+    stars = join_star_rankings(rekey(movie_tables.stars, record_ids), star_data)
+
+    # convert datatype of budget and gross features to integer
+    movies = movies.astype({'production_budget': int, 'domestic_gross': int, 'worldwide_gross': int})
+
+    return MovieTables(movies, genres, stars)
+
+def engineer_table_features(movie_tables=None, state=None):
+    """
+    Takes in merged movie tables (merged from a fresh scrape if not given), returns them with the features
+    of engineer_features: star power and star appearances per movie and star, director power, title length
+    and month per movie
+    With a feature state (see movies_history), star and director history is looked up in and added to its running
+    totals instead, so movies released after every movie already in the state can be engineered one batch at a time
+    """
+    movie_tables = merge_tables() if movie_tables is None else movie_tables
+    movies, stars = movie_tables.movies.copy(), movie_tables.stars.copy()
+
+    # star power and star appearances over one row per movie, release date and star, as in engineer_features
+    keys = ['movie', 'release_date', 'stars', 'domestic_gross']
+    star_rows = stars[['movie_id', 'stars']].merge(movies[['movie_id', 'movie', 'release_date', 'domestic_gross']],
+                                                   on='movie_id', how='left')
+    star_rows_reduced = star_rows[keys].drop_duplicates()
+    history = history_before if state is None else state.stars.score
+    star_rows_reduced['star_power'], star_rows_reduced['star_appearances'] = history(star_rows_reduced, 'stars')
+    star_rows = star_rows.merge(star_rows_reduced, on=keys, how='left')
+    stars['star_power'] = star_rows['star_power'].fillna(0).to_numpy()
+    stars['star_appearances'] = star_rows['star_appearances'].to_numpy()
+
+    # director power, each movie counting once per genre and star row as in the wide data
+    rows = np.bincount(movie_tables.genres['movie_id'], minlength=len(movies)) \
+           * np.bincount(stars['movie_id'], minlength=len(movies))
+    history = history_before if state is None else state.directors.score
+    movies['director_power'], _ = history(movies.assign(rows=rows), 'director', weight='rows')
+    movies['director_power'] = movies['director_power'].fillna(0)
+
+    # create new features as title length and month
+    movies = add_release_features(movies)
+
+    return MovieTables(movies, movie_tables.genres, stars)
+
+def aggregate_tables(movie_tables):
+    """
+    Takes in movie tables with engineered features, returns the aggregated data of agg_stars_genre
+    (movies_df and movies_genre_df)
+    """
+    movies = decategorize(movie_tables.movies)
+
+    # star power and star points totals, star rows and star appearances per movie
+    per_movie = movie_tables.stars.groupby('movie_id').agg(star_power=('star_power', 'sum'),
+                                                           star_points=('star_points', 'sum'),
+                                                           star_appearances=('star_appearances', 'sum'),
+                                                           star_rows=('star_power', 'size'))
+
+    # movies sharing every aggregation key are one group, rows with a missing key are left out as in groupby
+    movie_cols = [col for col in MOVIE_GENRE_COLS if col != 'genre']
+    movies = movies.dropna(subset=movie_cols)
+    movies['group'] = movies.groupby(movie_cols, sort=False).ngroup()
+
+    # average star power and star points, sum star appearances per group and genre
+    genre_rows = movie_tables.genres.dropna(subset=['genre']) \
+        .merge(movies[['movie_id', 'group']], on='movie_id').join(per_movie, on='movie_id')
+    totals = genre_rows.groupby(['group', 'genre'], observed=True) \
+        .agg(movie_id=('movie_id', 'first'), star_power=('star_power', 'sum'), star_points=('star_points', 'sum'),
+             star_appearances=('star_appearances', 'sum'), star_rows=('star_rows', 'sum')).reset_index()
+    totals['star_power'] /= totals['star_rows']
+    totals['star_points'] /= totals['star_rows']
+
+    movies_genre_df = totals[['movie_id', 'genre', 'star_power', 'star_points', 'star_appearances']] \
+        .merge(movies[['movie_id'] + movie_cols], on='movie_id')
+    movies_genre_df = decategorize(movies_genre_df)[MOVIE_GENRE_COLS + ['star_power', 'star_points', 'star_appearances']]
+    movies_genre_df = movies_genre_df.sort_values(MOVIE_GENRE_COLS).reset_index(drop=True)
+
+    # collapse genres into one row per movie
+    return collapse_genres(movies_genre_df), movies_genre_df
+
+def agg_tables(movie_tables=None, directory=DATA_DIR):
+    """
+    Takes in movie tables with engineered features (engineered from a fresh scrape if not given),
+    returns the aggregated data of agg_stars_genre, also written as parquet artifacts under directory
+    """
+    movie_tables = engineer_table_features() if movie_tables is None else movie_tables
+    movies_df, movies_genre_df = aggregate_tables(movie_tables)
+
+    # write both dataframes
+    write_artifact(movies_df, 'movies_df', directory)
+    write_artifact(movies_genre_df, 'movies_genre_df', directory)
+
+    return movies_df, movies_genre_df
+
+#====================================================================
+### Wide vs normalized benchmark
+#====================================================================
+
+def _run_pipeline(normalized, n_movies, seed):
+    # runs in a fresh process so ru_maxrss reflects only this pipeline
+    from movies_synthetic import synthetic_scrape
+    from movies_preprocessing import clean_imdb, merge_data, engineer_features, agg_stars_genre
+
+    import pyarrow.parquet  # imported up front so the parquet writer is not counted as pipeline memory
+
+    imdb_data, thenumbers_data, star_data = synthetic_scrape(n_movies, seed)
+    thenumbers_data, star_data = clean_thenumbers(thenumbers_data), clean_stars(star_data)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        if normalized:
+            tables = engineer_table_features(merge_tables(normalize_imdb(imdb_data), thenumbers_data, star_data))
+            features_mb = tables.memory_usage() / 2 ** 20
+            movies_df, movies_genre_df = agg_tables(tables, directory)
+        else:
+            merged_df = engineer_features(merge_data(clean_imdb(imdb_data), thenumbers_data, star_data))
+            features_mb = merged_df.memory_usage(deep=True).sum() / 2 ** 20
+            movies_df, movies_genre_df = agg_stars_genre(merged_df, directory)
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return len(movies_df), len(movies_genre_df), seconds, (peak - baseline) / 1024, features_mb
+
+def benchmark_tables(n_movies=50000, seed=0):
+    """
+    Takes in a number of synthetic movies, returns a dataframe comparing runtime, peak memory growth and the size
+    of the engineered features data of the wide pipeline (clean_imdb to agg_stars_genre) and the normalized one (normalize_imdb to agg_tables)
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name, normalized in [('wide', False), ('normalized', True)]:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            movies, movie_genres, seconds, peak_mb, features_mb = \
+                pool.submit(_run_pipeline, normalized, n_movies, seed).result()
+        results.append({'pipeline': name, 'movies': movies, 'movie_genres': movie_genres, 'seconds': seconds,
+                        'peak_rss_growth_mb': peak_mb, 'features_mb': features_mb})
+
+    return pd.DataFrame(results)
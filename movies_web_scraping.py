@@ -4,355 +4,430 @@ Functions for web scraping
 Functions are imported and executed in the __main__.py file
 """
 
-import pandas as pd
 import numpy as np
 import time
-import random
-import pickle
-import sys
 from warnings import warn
-from requests import get
 from bs4 import BeautifulSoup
 
+from movies_fetch import Fetcher, iter_fetch
+from movies_metrics import emit
+from movies_checkpoint import CHECKPOINT_DIR, PageCheckpoint
+from movies_cache import ResponseCache
+from movies_parsing import (ColumnBuffer, parse_responses, iter_imdb_records, iter_thenumbers_records,
+                            iter_imdbstarmeter_records)
+
+IMDB_URL = 'https://www.imdb.com'
+THENUMBERS_URL = 'https://www.the-numbers.com'
+
+# release years covered by the imdb search
+FIRST_YEAR = 1989
+LAST_YEAR = 2019
+
+IMDB_COLUMNS = ['movie', 'year', 'imdb', 'metascore', 'votes', 'runtime', 'certificate', 'genre', 'director', 'stars']
+THENUMBERS_COLUMNS = ['movie', 'release_date', 'production_budget', 'domestic_gross', 'worldwide_gross']
+STARMETER_COLUMNS = ['star_name', 'star_ranking', 'actor_or_actress']
+
+# pages per dataframe chunk of a chunked scrape
+CHUNK_PAGES = 20
+
+def parsed_pages(responses, parse_page, workers=1):
+    """
+    Takes in fetched responses and a page parser, yields (response, records) in order as pages are parsed
+    (across workers processes if more than one), with records None for responses other than 200
+    """
+    for response, records, seconds in parse_responses(responses, parse_page, workers):
+        if records is not None:
+            emit('parse', url=response.url, seconds=seconds, records=len(records), bytes=len(response.content))
+        yield response, records
+
+def parse_pages(responses, parse_page, columns, workers=1):
+    """
+    Takes in fetched responses, a page parser and the record columns,
+    returns a dataframe of the records parsed from every 200 response
+    """
+    buffer = ColumnBuffer(columns)
+    for response, records in parsed_pages(responses, parse_page, workers):
+        # skip pages that still failed after retries (already warned by the fetcher)
+        if records is not None:
+            buffer.extend(records)
+    return buffer.to_frame()
+
+def scrape_pages(source, urls, parse_page, columns, fetcher=None, checkpoint_dir=CHECKPOINT_DIR, parse_workers=1):
+    """
+    Takes in a source name, page urls, a page parser and the record columns, returns a dataframe of the records
+    parsed from every page that comes back 200
+    Pages are parsed as they arrive while later ones are still being fetched, in parse_workers processes if
+    more than one (None for one per core)
+    With a checkpoint_dir, each page's records are logged to disk as soon as it is parsed and a rerun after
+    a failure only fetches the pages not logged yet; the log is removed once every page is in, and if pages still
+    failed after retries a RuntimeError is raised with the log kept, rather than returning a partial scrape
+    """
+    if checkpoint_dir is None:
+        return parse_pages(iter_fetch(urls, fetcher), parse_page, columns, parse_workers)
+
+    checkpoint = PageCheckpoint(source, urls, checkpoint_dir)
+    pending = checkpoint.pending()
+    if len(checkpoint):
+        print('Resuming {} scrape: {} of {} pages already parsed'.format(source, len(checkpoint), len(urls)))
+        emit('checkpoint_resume', source=source, pages=len(checkpoint), pending=len(pending))
+
+    # pages that still failed after retries (already warned by the fetcher) stay pending for the next run
+    for url, (response, records) in zip(pending, parsed_pages(iter_fetch(pending, fetcher), parse_page,
+                                                               parse_workers)):
+        if records is not None:
+            checkpoint.append(url, records)
+
+    # a partial scrape would be cached as the stage's artifact, so fail and keep the log for a rerun instead
+    missing = checkpoint.pending()
+    if missing:
+        emit('checkpoint_incomplete', source=source, pages=len(checkpoint), pending=len(missing))
+        raise RuntimeError('{} scrape incomplete: {} of {} pages failed after retries, rerun to fetch them '
+                           '(parsed pages are kept in {})'.format(source, len(missing), len(urls), checkpoint.path))
+
+    data = checkpoint.to_frame(columns)
+    checkpoint.remove()
+    return data
+
+def iter_scrape_chunks(urls, parse_page, columns, fetcher=None, chunk_pages=CHUNK_PAGES, parse_workers=1):
+    """
+    Takes in page urls, a page parser and the record columns, yields a dataframe of the records parsed from
+    every chunk_pages pages in order, so only one chunk of the scrape is held in memory
+    A page that still fails after retries raises a RuntimeError once the chunks before it are yielded; without a
+    fetcher pages go through the response cache, so a rerun only refetches what was not cached
+    """
+    buffer, pages = ColumnBuffer(columns), 0
+    for response, records in parsed_pages(iter_fetch(urls, fetcher), parse_page, parse_workers):
+        if records is None:
+            raise RuntimeError('Chunked scrape incomplete: {} failed after retries with status code {}'.format(
+                response.url, response.status_code))
+        buffer.extend(records)
+        pages += 1
+        if pages == chunk_pages:
+            yield buffer.to_frame()
+            buffer, pages = ColumnBuffer(columns), 0
+    if pages:
+        yield buffer.to_frame()
+
 #====================================================================
 ### Scraper for IMDB
 #====================================================================
 
-def imdb_scraper():
+def imdb_page(page, base_url=IMDB_URL, first_year=FIRST_YEAR, last_year=LAST_YEAR):
     """
-    Scrapes movie data from IMDB then saves as pickled dataframe
+    Returns the url of an IMDB keyword search page (50 movies per page, sorted by year ascending)
+    for movies released from first_year to last_year (no upper bound if last_year is None)
     """
-    names = []
-    years = []
-    imdb_ratings = []
-    metascores = []
-    votes = []
-    runtimes = []
-    certificates = []
-    genres = []
-    directors = []
-    stars = []
+    release_date = '{}%2C{}'.format(first_year, '' if last_year is None else last_year)
+    return (base_url + '/search/keyword/?mode=advanced&page=' + str(page) +
+            '&ref_=kw_nxt&title_type=movie&release_date=' + release_date + '&sort=year,asc&num_votes=10000%2C')
 
+def imdb_pages(base_url=IMDB_URL):
+    """
+    Returns the urls of the 138 IMDB keyword search pages
+    """
+    return [imdb_page(page, base_url) for page in range(1, 139)] #138 pages
+
+def parse_imdb_page(html):
+    """
+    Takes in the html of an IMDB search page, returns a list of movie records
+    """
+    records = []
+
+    # parse the content of the request with beautifulsoup
+    soup = BeautifulSoup(html, 'lxml') # html.parser
+
+    # select all the 50 movie containers from a single page
+    movie_containers = soup.find_all('div', class_ = 'lister-item mode-advanced')
+
+    # for every movie of these 50
+    for container in movie_containers:
+        # if the movie has a metascore, then:
+        # if container.find('div', class_ = 'ratings-metascore') is not None:
+
+        # scrape the name
+        name = container.h3.a.text
+
+        # scrape the year
+        year = container.h3.find('span', class_ = 'lister-item-year').text
+
+        # scrape the imdb rating
+        imdb = container.strong
+        if imdb:
+            imdb = float(imdb.text)
+        else:
+            imdb = 'no stars given'
+
+        # scrape the metascore
+        m_score = container.find('span', class_ = 'metascore')
+        if m_score:
+            m_score = int(m_score.text)
+        else:
+            m_score = 'no metascore'
+
+        # scrape the number of votes
+        vote = container.find('span', attrs = {'name':'nv'})
+        if vote:
+            vote = int(vote['data-value'])
+        else:
+            vote = 'no votes'
+
+        # scrape the runtime
+        runtime = container.find('p', class_='text-muted').find('span', class_='runtime')
+        if runtime:
+            runtime = runtime.text
+        else:
+            runtime = 'no runtime'
+
+        # scrape the certificate
+        certificate = container.find('p', class_='text-muted').find('span', class_='certificate')
+        if certificate:
+            certificate = certificate.text
+        else:
+            certificate = 'not rated'
+
+        # scrape the genre
+        genre = container.find('p', class_='text-muted').find('span', class_='genre')
+        if genre:
+            genre = genre.text.split()
+        else:
+            genre = 'no genre'
+
+        # scrape the name of the director
+        director = container.find('div', class_='lister-item-content').find('p', class_="").a # picks up only one director
+        if director:
+            director = director.text
+        else:
+            director = 'no director'
+
+        # scrape the names of the stars
+        star = container.find('div', class_='lister-item-content').find('p', class_="").find_all('a') # may pick up any co-directors
+        if star:
+            star = star[1:]
+            star = [a.text for a in star]
+        else:
+            star = 'no stars'
+
+        records.append((name, year, imdb, m_score, vote, runtime, certificate, genre, director, star))
+
+    return records
+
+def imdb_scraper(fetcher=None, base_url=IMDB_URL, streaming=True, checkpoint_dir=CHECKPOINT_DIR, parse_workers=1):
+    """
+    Scrapes movie data from IMDB, returns a dataframe
+    Pages are parsed with the streaming parser unless streaming is False (full BeautifulSoup tree)
+    Parsed pages are checkpointed under checkpoint_dir (None to disable) so an interrupted scrape resumes,
+    pages are parsed in parse_workers processes (None for one per core) while the rest are fetched
+    """
     start_time = time.time()
-    requests = 0
-
-    pages = [str(i) for i in range(1, 139)] #138 pages 
-
-    for page in pages:
-
-        # make a get request
-        response = get('https://www.imdb.com/search/keyword/?mode=advanced&page=' + page +  
-                '&ref_=kw_nxt&title_type=movie&release_date=1989%2C2019&sort=year,asc&num_votes=10000%2C')
-        
-        # pause the loop
-        time.sleep(random.randint(2,8))
-
-        # monitor the requests
-        requests += 1
-        elapsed_time = time.time() - start_time
-        print('Request:{}; Frequency: {} requests/s'.format(requests, requests/elapsed_time))
-        clear_output(wait = True)
-
-        # throw a warning for non-200 status codes
-        if response.status_code != 200:
-            warn('Request: {}; Status code: {}'.format(requests, response.status_code))
-
-        # break the loop if the number of requests is greater than expected
-        if requests > 200:
-            warn('Number of requests was greater than expected.')
-            break
-
-        # parse the content of the request with beautifulsoup
-        soup = BeautifulSoup(response.text, 'lxml') # html.parser
-
-        # select all the 50 movie containers from a single page
-        movie_containers = soup.find_all('div', class_ = 'lister-item mode-advanced')
-
-        # for every movie of these 50
-        for container in movie_containers:
-            # if the movie has a metascore, then:
-            # if container.find('div', class_ = 'ratings-metascore') is not None:
-
-            # scrape the name
-            name = container.h3.a.text
-            names.append(name)
-
-            # scrape the year
-            year = container.h3.find('span', class_ = 'lister-item-year').text
-            years.append(year)
-
-            # scrape the imdb rating
-            imdb = container.strong
-            if imdb:
-                imdb_ratings.append(float(imdb.text))
-            else:
-                imdb = 'no stars given'
-                imdb_ratings.append(imdb)
-
-            # scrape the metascore
-            m_score = container.find('span', class_ = 'metascore')
-            if m_score:
-                metascores.append(int(m_score.text))
-            else:
-                m_score = 'no metascore'
-                metascores.append(m_score)
-
-            # scrape the number of votes
-            vote = container.find('span', attrs = {'name':'nv'})
-            if vote:
-                vote = vote['data-value']
-                votes.append(int(vote))
-            else:
-                vote = 'no votes'
-                votes.append(vote)
-
-            # scrape the runtime
-            runtime = container.find('p', class_='text-muted').find('span', class_='runtime')
-            if runtime:
-                runtimes.append(runtime.text)
-            else:
-                runtime = 'no runtime'
-                runtimes.append(runtime)
-
-            # scrape the certificate            
-            certificate = container.find('p', class_='text-muted').find('span', class_='certificate')
-            if certificate:
-                certificates.append(certificate.text)
-            else:
-                certificate = 'not rated'
-                certificates.append(certificate)
-
-            # scrape the genre
-            genre = container.find('p', class_='text-muted').find('span', class_='genre')
-            if genre:
-                genres.append(genre.text.split())
-            else:
-                genre = 'no genre'
-                genres.append(genre)
-
-            # scrape the name of the director
-            director = container.find('div', class_='lister-item-content').find('p', class_="").a # picks up only one director
-            if director:
-                directors.append(director.text)
-            else:
-                director = 'no director'
-                directors.append(director)
-
-            # scrape the names of the stars
-            star = container.find('div', class_='lister-item-content').find('p', class_="").find_all('a') # may pick up any co-directors
-            if star:
-                star = star[1:]
-                star = [a.text for a in star]   
-                stars.append(star)
-            else:            
-                star = 'no stars'
-                stars.append(star)                                    
-            
-    print((time.time()-start_time)/60, "minutes")
 
-    # store lists into dataframe
-    imdb_data = pd.DataFrame({'movie': names,
-    'year': years,
-    'imdb': imdb_ratings,
-    'metascore': metascores,
-    'votes': votes,
-    'runtime': runtimes,
-    'certificate': certificates,
-    'genre': genres,                          
-    'director': directors,
-    'stars': stars                    
-    })
+    # fetch pages through the shared fetch layer, checkpointing the records parsed from each one
+    parse_page = iter_imdb_records if streaming else parse_imdb_page
+    imdb_data = scrape_pages('imdb', imdb_pages(base_url), parse_page, IMDB_COLUMNS, fetcher, checkpoint_dir,
+                             parse_workers)
+
+    print((time.time()-start_time)/60, "minutes")
 
     return imdb_data
 
+def imdb_scrape_chunks(fetcher=None, base_url=IMDB_URL, chunk_pages=CHUNK_PAGES, parse_workers=1):
+    """
+    Scrapes movie data from imdb with the streaming parser, yields it as dataframes of chunk_pages pages each
+    """
+    return iter_scrape_chunks(imdb_pages(base_url), iter_imdb_records, IMDB_COLUMNS, fetcher, chunk_pages,
+                              parse_workers)
+
 #====================================================================
 ### Scraper for the-numbers
 #====================================================================
 
-def thenumbers_scraper():
+def thenumbers_page(first_row, base_url=THENUMBERS_URL):
     """
-    Scrapes movie data from IMDB then saves as pickled dataframe
+    Returns the url of the the-numbers budget page starting at first_row (1, 101, 201, ...)
     """
-    movie_names = []
-    release_dates = []
-    production_budgets = []
-    domestic_grosses = []
-    worldwide_grosses = []
+    page = '' if first_row == 1 else '/' + str(first_row)
+    return base_url + '/movie/budgets/all' + page
 
+def thenumbers_pages(base_url=THENUMBERS_URL):
+    """
+    Returns the urls of the 61 the-numbers budget pages
+    """
+    return [thenumbers_page(first_row, base_url) for first_row in np.arange(1, 6002, 100)] # 61 pages of results
+
+def parse_thenumbers_page(html):
+    """
+    Takes in the html of a the-numbers budget page, returns a list of movie records
+    """
+    records = []
+
+    # parse the content of the request with BeautifulSoup
+    soup = BeautifulSoup(html, 'lxml')
+    movie_table = soup.find('table')
+    if movie_table is None:
+        warn('No budget table found on page')
+        return records
+    rows = [row for row in movie_table.find_all('tr')]
+
+    for row in rows[1:101]:
+
+        items = row.find_all('td')
+
+        # scrape the release date
+        release_date = items[1].find('a')
+        if release_date:
+            release_date = release_date.text
+        else:
+            release_date = 'no release date'
+
+        # scrape the movie name
+        movie_name = items[2].find('a')
+        if movie_name:
+            movie_name = movie_name.text
+        else:
+            movie_name = 'no movie name'
+
+        # scrape the production budget
+        production_budget = items[3]
+        if production_budget:
+            production_budget = production_budget.text
+        else:
+            production_budget = 'no budget'
+
+        # scrape the domestic gross
+        domestic_gross = items[4]
+        if domestic_gross:
+            domestic_gross = domestic_gross.text
+        else:
+            domestic_gross = 'no domestic gross'
+
+        # scrape the worldwide gross
+        worldwide_gross = items[5]
+        if worldwide_gross:
+            worldwide_gross = worldwide_gross.text
+        else:
+            worldwide_gross = 'no worldwide gross'
+
+        records.append((movie_name, release_date, production_budget, domestic_gross, worldwide_gross))
+
+    return records
+
+def thenumbers_scraper(fetcher=None, base_url=THENUMBERS_URL, streaming=True, checkpoint_dir=CHECKPOINT_DIR,
+                       parse_workers=1):
+    """
+    Scrapes movie data from the-numbers, returns a dataframe
+    Pages are parsed with the streaming parser unless streaming is False (full BeautifulSoup tree)
+    Parsed pages are checkpointed under checkpoint_dir (None to disable) so an interrupted scrape resumes,
+    pages are parsed in parse_workers processes (None for one per core) while the rest are fetched
+    """
     start_time = time.time()
-    requests = 0
-
-    pages = ['/' + str(i) for i in np.arange(101, 6002, 100)] # 61 pages of results
-    pages.insert(0, "") # insert "" in front of list
-
-    for page in pages:
-
-        # make a get request
-        url = 'https://www.the-numbers.com/movie/budgets/all'
-        response = get(url + page)
-        
-        # pause the loop
-        time.sleep(random.randint(2,8))
-
-        # monitor the requests
-        requests += 1
-        elapsed_time = time.time() - start_time
-        print('Request:{}; Frequency: {} requests/s'.format(requests, requests/elapsed_time))
-        clear_output(wait = True)
-
-        # throw a warning for non-200 status codes
-        if response.status_code != 200:
-            warn('Request: {}; Status code: {}'.format(requests, response.status_code))
-
-        # break the loop if the number of requests is greater than expected
-        if requests > 200:
-            warn('Number of requests was greater than expected.')
-            break
-
-        # parse the content of the request with BeautifulSoup
-        soup = BeautifulSoup(response.text, 'lxml') 
-        movie_table = soup.find('table')
-        rows = [row for row in movie_table.find_all('tr')]
-        
-        for row in rows[1:101]:
-            
-            items = row.find_all('td')
-
-            # scrape the release date
-            release_date = items[1].find('a')
-            if release_date:
-                release_dates.append(release_date.text)
-            else:
-                release_date = 'no release date'
-                release_dates.append(release_date)
-
-            # scrape the movie name
-            movie_name = items[2].find('a')
-            if movie_name:
-                movie_names.append(movie_name.text)
-            else:
-                movie_name = 'no movie name'
-                movie_names.append(movie_name)
-
-            # scrape the production budget
-            production_budget = items[3]
-            if production_budget:
-                production_budgets.append(production_budget.text)
-            else:
-                production_budget = 'no budget'
-                production_budgets.append(production_budget)
-
-            # scrape the domestic gross
-            domestic_gross = items[4]
-            if domestic_gross:
-                domestic_grosses.append(domestic_gross.text)
-            else:
-                domestic_gross = 'no domestic gross'
-                domestic_grosses.append(domestic_gross)  
-
-            # scrape the worldwide gross
-            worldwide_gross = items[5]
-            if worldwide_gross:
-                worldwide_grosses.append(worldwide_gross.text)
-            else:
-                worldwide_gross = 'no worldwide gross'
-                worldwide_grosses.append(worldwide_gross)  
 
-    print((time.time()-start_time)/60, "minutes")
+    # fetch pages through the shared fetch layer, checkpointing the records parsed from each one
+    parse_page = iter_thenumbers_records if streaming else parse_thenumbers_page
+    thenumbers_data = scrape_pages('thenumbers', thenumbers_pages(base_url), parse_page, THENUMBERS_COLUMNS,
+                                   fetcher, checkpoint_dir, parse_workers)
 
-    # store lists into dataframe
-    thenumbers_data = pd.DataFrame({'movie': movie_names,
-    'release_date': release_dates,
-    'production_budget': production_budgets,
-    'domestic_gross': domestic_grosses,
-    'worldwide_gross': worldwide_grosses                    
-    })
+    print((time.time()-start_time)/60, "minutes")
 
     return thenumbers_data
 
+def thenumbers_scrape_chunks(fetcher=None, base_url=THENUMBERS_URL, chunk_pages=CHUNK_PAGES, parse_workers=1):
+    """
+    Scrapes movie data from the-numbers with the streaming parser, yields it as dataframes of chunk_pages pages each
+    """
+    return iter_scrape_chunks(thenumbers_pages(base_url), iter_thenumbers_records, THENUMBERS_COLUMNS, fetcher,
+                              chunk_pages, parse_workers)
+
 #====================================================================
 ### Scraper for imdb starmeter
 #====================================================================
 
-def imdbstarmeter_scraper():
+def imdbstarmeter_pages(base_url=IMDB_URL):
     """
-    Scrapes movie data from IMDB then saves as pickled dataframe
+    Returns the urls of the 20 IMDB starmeter pages
     """
-    star_names = []
-    star_rankings = []
-    actor_or_actresses = []
-
-    start_time = time.time()
-    requests = 0
-
     pages = []
-    first_page = 'https://www.imdb.com/search/name/?gender=male,female&ref_=rlm'
+    first_page = base_url + '/search/name/?gender=male,female&ref_=rlm'
     pages.append(first_page)
-    pagerange = [str(i) for i in np.arange(51, 952, 50)] #51, 952, 50 
+    pagerange = [str(i) for i in np.arange(51, 952, 50)] #51, 952, 50
 
-    for page in pagerange: 
-        page = 'https://www.imdb.com/search/name/?gender=male,female&start=' + page + '&ref_=rlm'                                   
+    for page in pagerange:
+        page = base_url + '/search/name/?gender=male,female&start=' + page + '&ref_=rlm'
         pages.append(page)
 
-    for page in pages:
-
-        # make a get request
-        response = get(page)
-        
-        # pause the loop
-        time.sleep(random.randint(2,8))
-
-        # monitor the requests
-        requests += 1
-        elapsed_time = time.time() - start_time
-        print('Request:{}; Frequency: {} requests/s'.format(requests, requests/elapsed_time))
-        clear_output(wait = True)
-
-        # throw a warning for non-200 status codes
-        if response.status_code != 200:
-            warn('Request: {}; Status code: {}'.format(requests, response.status_code))
-
-        # break the loop if the number of requests is greater than expected
-        if requests > 200:
-            warn('Number of requests was greater than expected.')
-            break
-
-        # parse the content of the request with beautifulsoup
-        soup = BeautifulSoup(response.text, 'lxml') 
-        containers = soup.find_all('div', class_='lister-item')
-        
-        for container in containers:
-            # scrape the star's name
-            star_name = container.find('img', alt=True)['alt']
-            if star_name:
-                star_names.append(star_name)
-            else:
-                star_name = 'no name'
-                star_names.append(star_name)
-
-            # scrape the star's ranking
-            star_ranking = container.find('span', class_="lister-item-index")
-            if star_ranking:
-                star_rankings.append(star_ranking.text)
-            else:
-                star_ranking = 'no ranking'
-                star_rankings.append(star_ranking)
-
-            # scrape if star is actor or actress
-            actor_or_actress = container.find('p', class_='text-muted').find(text=True, recursive=False)    
-            if actor_or_actress:
-                actor_or_actresses.append(actor_or_actress)
-            else:
-                actor_or_actress = 'no type'
-                actor_or_actresses.append(actor_or_actress)
-    
-    print((time.time()-start_time)/60, "minutes")
+    return pages
 
-    # store lists into dataframe
-    star_ranking_data = pd.DataFrame({'star_name': star_names,
-    'star_ranking': star_rankings,
-    'actor_or_actress': actor_or_actresses,
-    })
+def parse_imdbstarmeter_page(html):
+    """
+    Takes in the html of an IMDB starmeter page, returns a list of star records
+    """
+    records = []
+
+    # parse the content of the request with beautifulsoup
+    soup = BeautifulSoup(html, 'lxml')
+    containers = soup.find_all('div', class_='lister-item')
+
+    for container in containers:
+        # scrape the star's name
+        star_name = container.find('img', alt=True)['alt']
+        if not star_name:
+            star_name = 'no name'
+
+        # scrape the star's ranking
+        star_ranking = container.find('span', class_="lister-item-index")
+        if star_ranking:
+            star_ranking = star_ranking.text
+        else:
+            star_ranking = 'no ranking'
+
+        # scrape if star is actor or actress
+        actor_or_actress = container.find('p', class_='text-muted').find(text=True, recursive=False)
+        if actor_or_actress:
+            actor_or_actress = str(actor_or_actress)
+        else:
+            actor_or_actress = 'no type'
+
+        records.append((star_name, star_ranking, actor_or_actress))
+
+    return records
+
+def imdbstarmeter_scraper(fetcher=None, base_url=IMDB_URL, streaming=True, checkpoint_dir=CHECKPOINT_DIR,
+                          parse_workers=1):
+    """
+    Scrapes star rankings from the IMDB starmeter, returns a dataframe
+    Pages are parsed with the streaming parser unless streaming is False (full BeautifulSoup tree)
+    Parsed pages are checkpointed under checkpoint_dir (None to disable) so an interrupted scrape resumes,
+    pages are parsed in parse_workers processes (None for one per core) while the rest are fetched
+    """
+    start_time = time.time()
+
+    # fetch pages through the shared fetch layer, checkpointing the records parsed from each one
+    parse_page = iter_imdbstarmeter_records if streaming else parse_imdbstarmeter_page
+    star_ranking_data = scrape_pages('imdbstarmeter', imdbstarmeter_pages(base_url), parse_page, STARMETER_COLUMNS,
+                                     fetcher, checkpoint_dir, parse_workers)
+
+    print((time.time()-start_time)/60, "minutes")
 
     return star_ranking_data
 
+#====================================================================
+### Reparsing cached pages
+#====================================================================
+
+# source: (page urls, streaming parser, soup parser, record columns)
+SOURCES = {
+    'imdb': (imdb_pages, iter_imdb_records, parse_imdb_page, IMDB_COLUMNS),
+    'thenumbers': (thenumbers_pages, iter_thenumbers_records, parse_thenumbers_page, THENUMBERS_COLUMNS),
+    'imdbstarmeter': (imdbstarmeter_pages, iter_imdbstarmeter_records, parse_imdbstarmeter_page, STARMETER_COLUMNS),
+}
+
+def reparse_cached(source, urls=None, workers=None, streaming=True, cache=None):
+    """
+    Takes in a source ('imdb', 'thenumbers' or 'imdbstarmeter') and optionally its page urls (all pages if not given),
+    parses its pages from the response cache across a process pool (one worker per core by default)
+    without touching the network, returns the dataframe
+    """
+    pages, stream_parser, soup_parser, columns = SOURCES[source]
+    urls = pages() if urls is None else urls
+    parse_page = stream_parser if streaming else soup_parser
+
+    with Fetcher(cache=ResponseCache() if cache is None else cache, offline=True) as fetcher:
+        return parse_pages(fetcher.iter_fetch(urls), parse_page, columns, workers)
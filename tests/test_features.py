@@ -0,0 +1,75 @@
+"""
+Predicting Movie Revenue --
+Tests for the vectorized star and director history features
+history_before and engineer_features must give the same star power, star appearances and director power
+as the original row by row lambdas
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from movies_synthetic import synthetic_scrape
+from movies_preprocessing import clean_imdb, clean_thenumbers, clean_stars, merge_data, engineer_features, \
+    history_before
+
+FEATURES = ['star_power', 'star_appearances', 'director_power']
+
+#====================================================================
+### Original lambda implementation
+#====================================================================
+
+def lambda_history_before(df, key):
+    # mean and count of domestic gross over earlier releases with the same key, one filter of the whole frame per row
+    prior_mean = df.apply(lambda x: df[(df[key] == x[key]) & (df['release_date'] < x['release_date'])].domestic_gross.mean(), axis=1)
+    prior_count = df.apply(lambda x: df[(df[key] == x[key]) & (df['release_date'] < x['release_date'])].shape[0], axis=1)
+    return prior_mean, prior_count
+
+def lambda_engineer_features(merged_df):
+    # engineer_features as it was before vectorizing, for the history features only
+    merged_df_reduced = merged_df[['movie','release_date','stars','domestic_gross']].drop_duplicates()
+    merged_df_reduced['star_power'] = merged_df_reduced.apply(lambda x: merged_df_reduced[(merged_df_reduced['stars'] == x['stars'])&(merged_df_reduced['release_date'] < x['release_date'])].domestic_gross.mean(), axis=1)
+    merged_df_reduced['star_appearances'] = merged_df_reduced.apply(lambda x: merged_df_reduced[(merged_df_reduced['stars'] == x['stars'])&(merged_df_reduced['release_date'] < x['release_date'])].shape[0], axis=1)
+    merged_df = merged_df.merge(merged_df_reduced)
+    merged_df['star_power'] = merged_df['star_power'].fillna(0)
+
+    merged_df = merged_df.sort_values(by='release_date', ascending=True)
+    merged_df['director_power'] = merged_df.apply(
+        lambda x: merged_df[(merged_df.director == x.director) & (merged_df.release_date < x.release_date)].domestic_gross.mean(), axis=1)
+    merged_df['director_power'] = merged_df['director_power'].fillna(0)
+    return merged_df
+
+#====================================================================
+### Tests
+#====================================================================
+
+@pytest.fixture(scope='module')
+def movies_df():
+    return pd.read_pickle('data/movies_df.pkl')
+
+@pytest.mark.parametrize('key', ['director', 'certificate'])
+def test_history_before_matches_lambda(movies_df, key):
+    prior_mean, prior_count = history_before(movies_df, key)
+    expected_mean, expected_count = lambda_history_before(movies_df, key)
+
+    pd.testing.assert_series_equal(prior_mean, expected_mean, check_dtype=False, check_names=False)
+    pd.testing.assert_series_equal(prior_count, expected_count, check_dtype=False, check_names=False)
+
+def test_history_before_missing_keys_matches_lambda(movies_df):
+    # rows without a key have no history, and an all missing key column gives an empty index
+    movies_df = movies_df.head(1000)
+    directors = movies_df.assign(director=movies_df['director'].where(movies_df['votes'] % 2 == 0))
+    for df in (directors, movies_df.assign(director=np.nan)):
+        prior_mean, prior_count = history_before(df, 'director')
+        expected_mean, expected_count = lambda_history_before(df, 'director')
+        pd.testing.assert_series_equal(prior_mean, expected_mean, check_dtype=False, check_names=False)
+        pd.testing.assert_series_equal(prior_count, expected_count, check_dtype=False, check_names=False)
+
+def test_engineer_features_matches_lambda():
+    imdb_data, thenumbers_data, star_data = synthetic_scrape(300, seed=2)
+    merged_df = merge_data(clean_imdb(imdb_data), clean_thenumbers(thenumbers_data), clean_stars(star_data))
+
+    keys = ['movie', 'release_date', 'stars', 'genre']
+    features = engineer_features(merged_df).sort_values(keys)[keys + FEATURES].reset_index(drop=True)
+    expected = lambda_engineer_features(merged_df).sort_values(keys)[keys + FEATURES].reset_index(drop=True)
+    pd.testing.assert_frame_equal(features, expected, check_dtype=False)
@@ -0,0 +1,55 @@
+"""
+Predicting Movie Revenue --
+Tests for the incremental star and director history
+Features engineered batch by batch through a feature state must equal engineer_features on the full merged data
+"""
+
+import pandas as pd
+import pytest
+
+from movies_synthetic import synthetic_scrape
+from movies_preprocessing import clean_imdb, clean_thenumbers, clean_stars, merge_data, engineer_features
+from movies_history import FeatureState, engineer_features_incremental
+
+FEATURES = ['star_power', 'star_appearances', 'director_power']
+
+@pytest.fixture(scope='module')
+def merged_df():
+    imdb_data, thenumbers_data, star_data = synthetic_scrape(600, seed=1)
+    return merge_data(clean_imdb(imdb_data), clean_thenumbers(thenumbers_data), clean_stars(star_data))
+
+def sorted_features(df):
+    # one row per movie, star and genre in a fixed order, so frames built in different orders compare equal
+    keys = ['movie', 'release_date', 'stars', 'genre']
+    return df.sort_values(keys)[keys + FEATURES].reset_index(drop=True)
+
+@pytest.mark.parametrize('cutoffs', [['2005-01-01'], ['2000-01-01', '2010-06-15', '2015-01-01']])
+def test_incremental_equals_full(merged_df, cutoffs):
+    full = engineer_features(merged_df)
+
+    # every batch starts on a cutoff date, so it is never released before the history already in the state
+    state = FeatureState()
+    bounds = [pd.Timestamp.min] + [pd.Timestamp(cutoff) for cutoff in cutoffs] + [pd.Timestamp.max]
+    batches = [merged_df[(merged_df['release_date'] >= start) & (merged_df['release_date'] < end)]
+               for start, end in zip(bounds[:-1], bounds[1:])]
+    incremental = pd.concat([engineer_features_incremental(batch, state) for batch in batches])
+
+    pd.testing.assert_frame_equal(sorted_features(incremental), sorted_features(full), check_dtype=False)
+
+def test_out_of_order_batch_leaves_state_unchanged(merged_df):
+    cutoff = pd.Timestamp('2010-01-01')
+    state = FeatureState()
+    engineer_features_incremental(merged_df[merged_df['release_date'] < cutoff], state)
+    stars = {name: list(entity) for name, entity in state.stars.entities.items()}
+    directors = {name: list(entity) for name, entity in state.directors.entities.items()}
+
+    # a valid batch with one row of the last star by name released before the star's history,
+    # so the rows of every other star come first
+    batch = merged_df[merged_df['release_date'] >= cutoff]
+    late_star = max(set(batch['stars'].dropna()) & set(stars))
+    early_row = batch[batch['stars'] == late_star].head(1).assign(release_date=pd.Timestamp('1980-01-01'))
+
+    with pytest.raises(ValueError):
+        engineer_features_incremental(pd.concat([batch, early_row]), state)
+    assert state.stars.entities == stars
+    assert state.directors.entities == directors